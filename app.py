@@ -1,645 +1,68 @@
-import io, pickle, random, itertools, json
-from dataclasses import dataclass
+import io, os, pickle, random, itertools, json, time
+from dataclasses import asdict, dataclass
 from datetime import datetime
 from pathlib import Path
 from typing import List, Tuple
 from os import PathLike
+import numpy as np
 import pandas as pd
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from typing import List, Tuple
 from pathlib import Path
 import json, pickle
+import hmac
 import re
 import textwrap
 from supabase import create_client
+from patient_data import PATIENT_DF_PATH, current_dataset_sha256, file_sha256, load_patient_df_from_repo
+from patient_store import PatientStore
+from cards import minify_css, selected_frame_style
+from pairs import PreparedPairs
+from pairs_io import PairColumns, pair_columns, read_pairs
+from scheduler import ActivePairScheduler
+from autosave import GroupCommitWriter, SnapshotWriter
+from storage import ProgressStore, SQLiteStore, SupabaseStore
+from transitivity import MODES as TRANSITIVE_MODES, TransitiveSkipper
+from timing import SpanRecorder, span, timed, to_jsonl, to_prometheus
+from prefetch import PairPrefetcher, render_pair
+from export import FORMATS as EXPORT_FORMATS, export_results
 
 
 st.set_page_config(page_title="Ranking Study", page_icon="🩺", layout="wide")
 
-def _map_level(val, mapping: dict, fallback: str = "unknown") -> str:
-    return mapping.get(val, fallback)
-
-# 1) Add these small helpers and rules near your function (or at top of the file)
-ABNORMAL_RULES = {
-    # "risk_band": {"medium": "orange", "high": "red"},
-    # "smoker": {"yes": "red"}, # can comment back in for coloring
-    # "adherence": {"low": "red"}, # can comment back in for coloring
-    # BMI handled by thresholds below
-}
-
-def _colorize(val: str, color: str | None) -> str:
-    return f'<span class="val {color}">{val}</span>' if color else f'<span class="val_bold">{val}</span>'
-
-def _abnormal_color(name: str, value_str: str, value_num: float | None = None) -> str | None:
-    """
-    Returns a color name if abnormal, else None.
-    name: one of {'risk_band','smoker','ses','adherence','bmi'}
-    value_str: normalized, lowercase string label of the value to check
-    value_num: numeric value for thresholded checks (e.g., BMI)
-    """
-    if name == "bmi":
-        if value_num is None:
-            return None
-         # can comment back in for coloring
-        # if value_num >= 30:
-        #     return "red"
-        # if value_num >= 25:
-        #     return "orange"
-        return None
-    
-    if name == "risk_percentile":
-        if value_num is None:
-            return None
-        # # 33–65.999... => orange, 66–100 => red
-         # can comment back in for coloring
-        # if 85 <= value_num < 95:
-        #     return "orange"
-        # if 95 <= value_num <= 100:
-        #     return "red"
-        return None
-
-    rules = ABNORMAL_RULES.get(name, {})
-    return rules.get(value_str)  # returns color or None
-
-def percentile_label(p):
-    # for suffix logic, use the integer part
-    n = int(round(p))
-    last_two = n % 100
-    if 11 <= last_two <= 13:
-        suf = "th"
-    else:
-        last = n % 10
-        suf = {1: "st", 2: "nd", 3: "rd"}.get(last, "th")
-
-    # format number nicely (no trailing .0 if whole)
-    num_str = f"{p:g}"
-
-    return suf + ' percentile'
-
-# def patient_card_html(label: str, p: dict, selected: bool, side: str,
-#                       category_order: list[str] | None = None,
-#                       per_category_master: dict[str, list[str]] | None = None) -> str:
-#     sex_label       = "male" if int(p["sex"]) == 1 else "female"
-#     smoker_label    = "yes" if int(p["smoker"]) == 1 else "no"
-#     diabetes_label  = "yes" if int(p["diabetes"]) == 1 else "no"
-#     ses_label       = _map_level(int(p["socio_economic"]), {1: "low", 2: "medium", 3: "high"})
-#     risk_band_label = _map_level(int(p.get("risk_band", 0)), {1: "low", 2: "medium", 3: "high"})
-#     adherence_val   = str(p.get("adherence", "none"))
-#     adherence_lab   = "not applicable (no chronic meds)" if adherence_val == "none" else adherence_val
-#     bmi_val         = float(p["bmi"])
-#     sel_class       = " selected" if selected else ""
-#     recs_html = recs_grouped_html_for_patient(
-#         p, category_order=category_order, per_category_master=per_category_master
-#     )
-#     abnornal_values = {risk_band_label: {"medium": "orange", "high": "red"}, smoker_label: {"yes": "red"}, ses_label: {"low": "red"}, adherence_lab: {"low": "red", "medium": "orange"}, bmi_val: {30: "red", 25: "orange"}}
-
-
-#     html = f"""
-# <div class="frame {side}{sel_class}"></div>
-
-# <div class="card-badge cell badge {side}">{label}</div>
-
-# <div class="section cell sec-demo {side}">
-#   <div class="section-title">Demographics</div>
-#   <div class="row row-3">
-#     <div><span class="item-label">Age:</span> {int(p['age'])}</div>
-#     <div><span class="item-label">Sex:</span> {sex_label}</div>
-#     <div><span class="item-label">Socio-economic:</span> {ses_label}</div>
-#   </div>
-# </div>
-
-# <div class="section cell sec-risk {side}">
-#   <div class="section-title">Predicted Risk</div>
-#   <div class="row row-2 rm-top">
-#     <div><span class="item-label-2"><span class="item-label">SCORE2</span>(10-year CVD risk):</span> {int(p['risk'])}%</div>
-#     <div><span class="item-label">Risk band for age:</span> {risk_band_label}</div>
-#   </div>
-# </div>
-
-# <div class="section cell sec-mods {side}">
-#   <div class="section-title">Modifiable Behavior</div>
-#   <div class="row row-3">
-#     <div><span class="item-label">BMI:</span> {int(round(bmi_val))}</div>
-#     <div><span class="item-label">Smoker:</span> {smoker_label}</div>
-#     <div><span class="item-label">Adherence:</span> {adherence_lab}</div>
-
-#   </div>
-# </div>
-
-
-# <div class="section section-recs cell sec-recs {side}">
-#   <div class="section-title">C-Pi recommendations</div>
-#   <ul class="recs">{recs_html}</ul>
-# </div>
-# """
-#     return textwrap.dedent(html).strip()
-
-# 2) Update your patient_card_html to colorize the displayed values
-def patient_card_html(label: str, p: dict, selected: bool, side: str,
-                      category_order: list[str] | None = None,
-                      per_category_master: dict[str, list[str]] | None = None) -> str:
-    sex_label       = "male" if int(p["sex"]) == 1 else "female"
-    smoker_label    = "yes" if int(p["smoker"]) == 1 else "no"
-    # diabetes_label  = "yes" if int(p["diabetes"]) == 1 else "no"
-    ses_label       = _map_level(int(p["socio_economic"]), {1: "low", 2: "medium", 3: "high"})
-    # risk_band_label = _map_level(int(p.get("risk_band", 0)), {1: "low", 2: "medium", 3: "high"})
-    adherence_val   = str(p.get("adherence", "none"))
-    adherence_lab   = "not applicable (no chronic meds)" if adherence_val == "none" else adherence_val
-    bmi_val         = float(p["bmi"])
-    sel_class       = " selected" if selected else ""
-    recs_html = recs_grouped_html_for_patient(
-        p, category_order=category_order, per_category_master=per_category_master
-    )
-
-    # --- colorized risk band and score---
-    # risk_band_disp = _colorize(risk_band_label, _abnormal_color("risk_band", risk_band_label))
-    # risk_color = _abnormal_color("risk_band", risk_band_label)  # 'red' | 'orange' | None
-    # risk_pct_span = (
-    # f'<span class="risk-pct {risk_color}">{int(p["risk"])}%</span>'
-    # if risk_color else
-    # f'<span class="risk-pct">{int(p["risk"])}%</span>'
-    # )
-
-# --- risk percentile coloring ---
-    risk_pct_val        = int(p['risk_percentile'])
-    risk_percentile_lbl = percentile_label(risk_pct_val)
-    risk_pct_color      = _abnormal_color("risk_percentile", "", risk_pct_val)
-    risk_percentile_disp = _colorize(risk_pct_val, risk_pct_color)
-
-    # Optionally color the SCORE2 % with the same color
-    risk_pct_span = (
-        f'<span class="risk-pct {risk_pct_color}">{int(p["risk"])}%</span>'
-        if risk_pct_color else
-        f'<span class="risk-pct">{int(p["risk"])}%</span>'
-    )
-
-    smoker_disp    = _colorize(smoker_label,     _abnormal_color("smoker", smoker_label))
-    # ses_disp       = _colorize(ses_label,        _abnormal_color("ses", ses_label))
-    # only color adherence if it's one of the graded labels (not the 'not applicable...' string)
-    adherence_disp = ( _colorize(adherence_lab, _abnormal_color("adherence", adherence_lab))
-                       if adherence_val != "none" else adherence_lab )
-    bmi_disp = _colorize(f"{bmi_val:.1f}", _abnormal_color("bmi", "", bmi_val))
-
-    html = f"""
-<div class="frame {side}{sel_class}"></div>
-
-<div class="card-badge cell badge {side}">{label}</div>
-
-<div class="section cell sec-demo {side}">
-  <div class="section-title">Demographics</div>  
-  <div class="row row-3">
-    <div><span class="item-label">Age:</span> {int(p['age'])}</div>
-    <div><span class="item-label">Sex:</span> {sex_label}</div>
-    <div><span class="item-label">Socio-economic:</span> {ses_label}</div>
-  </div>
-</div>
-
-<div class="section cell sec-risk {side}">
-  <div class="section-title">Predicted Risk</div>
-  <div class="row row-2 rm-top">
-<!--<div><span class="item-label-2"><span class="item-label">SCORE2</span>(10-year CVD risk):</span> {int(p['risk'])}%</div>-->
-<!--<div><span class="item-label">Risk percentile for age:</span>{int(p['risk_percentile'])}{risk_percentile_lbl}</div>-->
-    <div><span class="item-label-2"><span class="item-label">SCORE2</span>(10-year CVD risk):</span><span class="risk-pct">{int(p["risk"])}%</span></div>      
-    <div><span class="item-label">Risk for age:</span> {risk_percentile_disp}{risk_percentile_lbl}</div>
-<!-- <div><span class="item-label-2"><span class="item-label">SCORE2</span>(10-year CVD risk):</span>  {risk_pct_span}</div>    <div><span class="item-label">Risk band for age:</span> risk_band_disp</div>  -->
-  </div>
-</div>
-<div class="section cell sec-mods {side}">
-  <div class="section-title">Behavioral Factors</div>
-  <div class="row row-3">
-    <div><span class="item-label">BMI:</span> {bmi_disp}</div>
-    <div><span class="item-label">Smoker:</span> {smoker_disp}</div>
-    <div><span class="item-label">Adherence:</span> {adherence_disp}</div>
-  </div>
-</div>
-
-<div class="section section-recs cell sec-recs {side}">
-  <div class="section-title">C-Pi recommendations</div>
-  <ul class="recs">{recs_html}</ul>
-</div>
-"""
-    return textwrap.dedent(html).strip()
-
-st.markdown("""
-<style>
-:root{
-  --page-bg:#ffffff; --page-fg:#111111;
-  --card-bg:#ffffff; --card-fg:#1f1f1f;
-  --card-border:#d7d7d7; --inset-divider:#dfdfdf;
-  --card-shadow:0 2px 6px rgba(0,0,0,.06);
-  --card-selected-bg:#f7fcf7; --card-selected-border:#34c759;
-}
-@media (prefers-color-scheme: dark){
-  :root{
-    --page-bg:#0e0f12; --page-fg:#eaeaea;
-    --card-bg:#17181c; --card-fg:#e7e7e7;
-    --card-border:#2b2f36; --inset-divider:#2f333a;
-    --card-shadow:0 4px 14px rgba(0,0,0,.6);
-    --card-selected-bg:#132a1b; --card-selected-border:#2ecc71;
-  }
-}
-html, body{ background:var(--page-bg); color:var(--page-fg); }
-
-/* Two-column parent grid (shared row tracks) */
-.pair-grid{
-  display:grid;
-  grid-template-columns:1fr 1fr;
-  column-gap:16px;
-  grid-template-areas:
-    "badgeL badgeR"
-    "demoL  demoR"
-    "riskL  riskR"
-    "modsL  modsR"
-    "adhL   adhR"
-    "recsL  recsR";
-  align-items:stretch;
-  color:var(--card-fg);
-}
-
-/* Sections placed directly into the grid */
-.cell{ z-index:1; }
-.badge.left  { grid-area:badgeL; }
-.badge.right { grid-area:badgeR; }
-.sec-demo.left  { grid-area:demoL; }
-.sec-demo.right { grid-area:demoR; }
-.sec-risk.left  { grid-area:riskL; }
-.sec-risk.right { grid-area:riskR; }
-.sec-mods.left  { grid-area:modsL; }
-.sec-mods.right { grid-area:modsR; }
-.sec-adh.left   { grid-area:adhL; }
-.sec-adh.right  { grid-area:adhR; }
-.sec-recs.left  { grid-area:recsL; }
-.sec-recs.right { grid-area:recsR; }
-
-/* The background/border frame spans all rows in its column */
-.frame{
-  grid-row:1 / -1;
-  position:relative;
-  z-index:0;
-  background:var(--card-bg);
-  border:3px solid var(--card-border);
-  border-radius:14px;
-  box-shadow:var(--card-shadow);
-}
-.frame.left  { grid-column:1; }
-.frame.right { grid-column:2; }
-.frame.selected{ background:var(--card-selected-bg); border-color:var(--card-selected-border); }
-
-/* Section + rows styling */
-.card-badge{font-weight:700;font-size:.95rem;padding:10px 14px;border-bottom:2px solid var(--inset-divider)}
-.section{padding:10px 14px 12px;border-bottom:2px solid var(--inset-divider)}
-.section:last-of-type{border-bottom:0}
-.section-title{font-weight:800;margin-bottom:8px}
-.row{display:grid}
-.row-3{ grid-template-columns:1fr 1fr 1fr; }
-.row-2{ grid-template-columns:1fr 1fr; }
-.row-1{ grid-template-columns:1fr; }
-.row>*{padding:4px 10px 4px 0}
-.row>*:not(:first-child){border-left:2px solid var(--inset-divider);padding-left:12px}
-.rm-top{ margin-bottom:10px; }
-
-/* Recs */
-ul.recs{margin:6px 0 0 1.1rem}
-ul.recs li{margin:.2rem 0}
-ul.recs li.ghost{opacity:.45;font-style:italic}
-.recs .rec-cat{ text-decoration:underline; text-underline-offset:2px; text-decoration-thickness:2px; }
-.recs .rec-main{ font-weight:700; }
-.recs .rec-cost{ font-style:italic; }
-.item-label{margin-right:6px; text-decoration:underline; text-underline-offset:2px; text-decoration-thickness:2px; }
-.item-label-2{margin-right:6px}
-.risk-pct{  }
-.risk-pct.red{ color:#b00020; }
-.risk-pct.orange{ color:#e67e22; }
-.val {
-  font-weight: 800;
-  padding: 0 .1rem;
-  border-radius: .35rem;
-}
-.val.red {
-  color: #d32f2f;
-}
-.val.orange {
-  color: #e67e22; /* lighter orange */
-}  
-/* (optional) subtle backgrounds for contrast – uncomment if you want chips */
-/*
-.val.red{ background:rgba(176,0,32,.12); }
-.val.orange{ background:rgba(192,86,0,.12); }
-color: #e67e22; /* lighter orange */
-            
-/* Make left & middle a bit narrower; right column broader */
-.sec-demo .row-3,
-.sec-mods .row-3{
-  grid-template-columns: 0.75fr 0.75fr 1.5fr;
-}
-
-/* (optional) on narrow screens, fall back to equal columns or a stack */
-@media (max-width: 900px){
-  .sec-demo .row-3,
-  .sec-mods .row-3{
-    grid-template-columns: 1fr 1fr 1fr; /* or: 1fr to stack */
-  }
-}
-
-}
-/* compact spacing inside cells */
-.pair-grid .card-badge{
-  padding: 8px 10px;
-}
-.pair-grid .section{
-  padding: 6px 10px 8px;   /* was 10px 14px 12px */
-}
-.pair-grid .section-title{
-  margin-bottom: 6px;      /* was 8px */
-}
-.pair-grid .row > *{
-  padding: 2px 6px 2px 0;  /* was 4px 10px 4px 0 */
-  line-height: 1.25;       /* slightly tighter */
-}
-/* keep the divider but reduce left padding for middle/right cells */
-.pair-grid .row > *:not(:first-child){
-  padding-left: 8px;       /* was 12px */
-}
-
-/* optional: tighten recs list a bit */
-.pair-grid ul.recs{ margin: 4px 0 0 1rem; }
-.pair-grid ul.recs li{ margin: .15rem 0; }
-
-@import url('https://fonts.googleapis.com/css2?family=Poppins:wght@600;700&display=swap');
-
-/* Define font stacks so it's easy to switch later */
-:root{
-  --body-font: ui-sans-serif, system-ui, -apple-system, "Segoe UI", Roboto, "Helvetica Neue", Arial, "Noto Sans", "Apple Color Emoji", "Segoe UI Emoji";
-  --header-font: "Poppins", ui-sans-serif, system-ui, -apple-system, "Segoe UI", Roboto, "Helvetica Neue", Arial;
-}
+@st.cache_resource
+def get_process_timings() -> SpanRecorder:
+    """Span timings of every session served by this process."""
+    return SpanRecorder()
 
-/* Apply */
-body, html{
-  font-family: var(--body-font);
-}
-.card-badge,
-.section-title{
-  font-family: var(--header-font);
-  letter-spacing: .2px;       /* tiny polish */
-}
+def _timings() -> tuple[SpanRecorder, SpanRecorder]:
+    """The recorders a span on the script thread goes to: this session's and the process'."""
+    if "timings" not in st.session_state:
+        st.session_state.timings = SpanRecorder()
+    return st.session_state.timings, get_process_timings()
 
-/* If you want headers a touch heavier without changing size */
-.section-title{ font-weight: 700;  }
-.card-badge{   font-weight: 700; }
-            
-            .card-badge,
-.card-badge,
-.section-title {
-  color: #444444; /* darker gray */
-}
+def _span(name: str):
+    """`with _span("..."):` times the block into the session and process timings (see timing.py)."""
+    return span(name, *_timings())
 
-@media (prefers-color-scheme: dark) {
-  .card-badge,
-  .section-title {
-    color: #cccccc; /* balanced for dark mode */
-  }
-}
-}
-            
-           
-</style>
-""", unsafe_allow_html=True)
-
-PATIENT_DF_PATH = (Path(__file__).parent / "patient_df.csv").resolve()
-
-_RAW_REC_MAP = {
-    "rec1":  {"DL": "Labs - for screening: lipid panel (cost 2)", "category": "Labs", "main": "lipid panel", "cost": "(cost 2)"},
-    "rec2":  {"DL": "Labs - for treatment monitoring: liver enzymes (cost 1)", "category": "Labs", "main": "liver enzymes", "cost": "(cost 1)"},
-    "rec3":  {"DL": "Labs - for risk stratification / screening:  Lp(a) (cost 6)", "category": "Labs", "main": "Lp(a)", "cost": "(cost 6)"},
-    "rec4":  {"DL": "Labs - for treatment monitoring: LDL (cost 2)",  "category": "Labs", "main": "LDL", "cost": "(cost 2)"},
-    "rec5":  {"DL": "Imaging - for risk stratification: carotid doppler (cost 20)",  "category": "Imaging", "main": "carotid doppler", "cost": "(cost 20)"},
-    "rec6":  {"DL": "Treatment - initiate first-line: low dose statin (yearly cost 200)", "category": "Treatment", "main": "low dose statin", "cost": "(yearly cost 200)"}, 
-    "rec7":  {"DL": "Treatment - initiate advanced treatment: high dose statin (yearly cost 200)", "category": "Treatment", "main": "high dose statin", "cost": "(yearly cost 200)"}, 
-    "rec8":  {"DL": "Treatment - prescribe advanced treatment: PCSK9 (yearly cost 20,000)", "category": "Treatment", "main": "PCSK9", "cost": "(yearly cost 20,000)"}, 
-    "rec9":  {"DL": "Treatment - upgrade: high dose statin (yearly cost 200)", "category": "Treatment", "main": "high dose statin", "cost": "(yearly cost 200)"},  
-    "rec10": {"DL": "Treatment - replacement d/t contraindication: switch to PCSK9 (yearly cost 20,000)",  "category": "Treatment", "main": "PCSK9", "cost": "(yearly cost 20,000)"}, 
-    "rec11": {"DL": "Consults - hepatology consult: d/t high liver enzymes after statin initiation (cost 5)", "category": "Consults", "main": "hepatology", "cost": "(cost 5)"}, 
-    "rec12": {"DL": "Lifestyle - dietitian: package of nutritional consultation sessions (cost 20)",  "category": "Lifestyle", "main": "nutritional consultation", "cost": "(cost 20)"}, 
-    "rec13": {"DL": "Treatment - discuss pros/cons of statins vs. lifestyle changes in gray-zone patients (cost 2)",  "category": "Treatment", "main": "discuss pros/cons", "cost": "(cost 2)"}, 
-    "rec14": {"DL": "Lifestyle - consult about exercise, nutrition, and smoking (cost 2)",  "category": "Lifestyle", "main": "exercise, nutrition, and smoking", "cost": "(cost 2)"},
-    "rec15": {"DL": 'Lifestyle - reccomend the AHA "Heart & Stroke Helper" app to track lipids, meds and lifestyle (cost 0)',  "category": "Lifestyle", "main": '"Heart & Stroke Helper" app', "cost": "(cost 0)"}
-}
+APP_CSS_PATH = Path(__file__).parent / "app.css"
 
-# # old version
-# _RAW_REC_MAP = {
-#     "rec1":  {"DL": "Labs - for risk stratification / screening: lipid panel (cost 2)"},
-#     "rec2":  {"DL": "Labs - for treatment monitoring: liver enzymes (cost 1)"},
-#     "rec3":  {"DL": "Labs - for risk stratification / screening:  Lp(a) (cost 6)"},
-#     "rec4":  {"DL": "Labs - for treatment monitoring: LDL (cost 2)"},
-#     "rec5":  {"DL": "Imaging - for risk stratification: carotid doppler (cost 20)"},
-#     "rec6":  {"DL": "Treatment - initiate first-line treatment: low dose statin (yearly cost 200)"},
-#     "rec7":  {"DL": "Treatment - initiate advanced treatment: high dose statin (yearly cost 200)"},
-#     "rec8":  {"DL": "Treatment - prescribe advanced treatment: PCSK9 (yearly cost 20,000)"},
-#     "rec9":  {"DL": "Treatment - upgrade: switch to a high dose statin (yearly cost 200)"},
-#     "rec10": {"DL": "Treatment - replacement d/t contraindication: switch to PCSK9 (yearly cost 20,000)"},
-#     "rec11": {"DL": "Consults - lipidologist consult: d/t statins failure/intolerance, to consider PCSK9 (cost 6)"},
-#     "rec12": {"DL": "Consults - hepatology consult: d/t high liver enzymes after statin initiation (cost 5)"},
-#     "rec13": {"DL": "Lifestyle - dietitian: referral for a package of nutritional consultation sessions (cost 20)"},
-#     "rec14": {"DL": "Treatment - discuss pros/cons of drug treatment vs. lifestyle changes in gray-zone patients (cost 2)"},
-#     "rec15": {"DL": "Lifestyle - consult about exercise, nutrition, and smoking cessation (cost 2)"},
-#     "rec16": {"DL": 'Lifestyle - reccomend the AHA "Heart & Stroke Helper" app to track lipids, meds and lifestyle (cost 0)'}
-# }
-# _CATEGORY_ORDER = ["Labs", "Imaging", "Treatment", "Consults", "Lifestyle", "Other"]
-
-# def recs_grouped_html_for_patient(p: dict) -> str:
-#     """
-#     Returns HTML <li> items of FULL DL sentences, with:
-#       - category in <span class="rec-cat">…</span>  (bold via CSS)
-#       - main     in <span class="rec-main">…</span> (bold via CSS)
-#       - cost     in <span class="rec-cost">…</span> (italic via CSS)
-#     Grouped by _CATEGORY_ORDER; within a category preserves map order.
-#     """
-#     chosen = set(p.get("recommendations") or [])
-#     if not chosen or chosen == {"no active recommendations"}:
-#         return "<li>no active recommendations</li>"
-
-#     # Collect chosen items with display metadata
-#     items = []
-#     for idx, (key, meta) in enumerate(_RAW_REC_MAP.items()):
-#         dl = meta.get("DL", "")
-#         if dl in chosen:
-#             cat  = meta.get("category", "Other")
-#             main = meta.get("main", "")
-#             cost = meta.get("cost", "")
-#             items.append((cat, idx, dl, main, cost))
-
-#     if not items:
-#         return "<li>no active recommendations</li>"
-
-#     # Sort by category, then original order
-#     order_index = {c: i for i, c in enumerate(_CATEGORY_ORDER)}
-#     items.sort(key=lambda t: (order_index.get(t[0], 999), t[1]))
-
-#     # Render full DL with targeted styling
-#     def _style_dl(dl: str, cat: str, main: str, cost: str) -> str:
-#         s = dl
-#         # category at the start -> bold
-#         s = re.sub(r'^' + re.escape(cat) + r'(?=\s*-\s*)',
-#                    f'<span class="rec-cat">{cat}</span>', s, count=1)
-#         # first occurrence of main -> bold
-#         if main:
-#             s = re.sub(re.escape(main),
-#                        f'<span class="rec-main">{main}</span>', s, count=1)
-#         # first occurrence of cost -> italic
-#         if cost:
-#             s = re.sub(re.escape(cost),
-#                        f'<span class="rec-cost">{cost}</span>', s, count=1)
-#         return s
-
-#     parts, prev_cat = [], None
-#     for cat, _, dl, main, cost in items:
-#         cls = "cat-start" if cat != prev_cat else ""
-#         parts.append(f'<li class="{cls}">{_style_dl(dl, cat, main, cost)}</li>')
-#         prev_cat = cat
-#     return "".join(parts)
-
-_CATEGORY_ORDER = ["Labs", "Imaging", "Treatment", "Consults", "Lifestyle", "Other"]
-
-def recs_grouped_html_for_patient(
-    p: dict,
-    category_order: list[str] | None = None,
-    per_category_master: dict[str, list[str]] | None = None
-) -> str:
+@st.cache_resource
+def _stylesheet_html() -> str:
     """
-    Render FULL DL sentences with styled parts, aligned by a shared plan:
-    - category_order: order of categories (common first)
-    - per_category_master: for each category, the ordered list of DLs (common first,
-      then the side-unique ones). Missing items are shown as light placeholders to
-      preserve vertical alignment.
+    app.css, minified, read once per process. The message is above
+    global.minCachedMessageSize (.streamlit/config.toml), so the browser receives
+    it once per session and later reruns only send a reference to it.
     """
-    chosen = set(p.get("recommendations") or [])
-    order = category_order or _CATEGORY_ORDER
-
-    # quick index from DL -> meta
-    dl2meta = {meta["DL"]: meta for meta in _RAW_REC_MAP.values()}
-
-    def _style_dl(dl: str, cat: str, main: str, cost: str) -> str:
-        s = dl
-        s = re.sub(r'^' + re.escape(cat) + r'(?=\s*-\s*)',
-                   f'<span class="rec-cat">{cat}</span>', s, count=1)
-        if main:
-            s = re.sub(re.escape(main), f'<span class="rec-main">{main}</span>', s, count=1)
-        if cost:
-            s = re.sub(re.escape(cost), f'<span class="rec-cost">{cost}</span>', s, count=1)
-        return s
-
-    parts = []
-    # if we have a master plan: iterate exact rows; else fall back to simple grouping
-    if per_category_master:
-        for cat in order:
-            dls = per_category_master.get(cat, [])
-            first_in_cat = True
-            for dl in dls:
-                if dl in chosen:
-                    meta = dl2meta.get(dl, {})
-                    html = _style_dl(dl, cat, meta.get("main",""), meta.get("cost",""))
-                    cls = "cat-start" if first_in_cat else ""
-                    parts.append(f'<li class="{cls}">{html}</li>')
-                else:
-                    # placeholder row so identical recs align line-by-line
-                    cls = "cat-start ghost" if first_in_cat else "ghost"
-                    # parts.append(f'<li class="{cls}">—</li>')
-                first_in_cat = False
-        return "".join(parts)
-
-    # (fallback — not used when we pass a plan)
-    # flat, grouped by global order
-    by_cat = {}
-    for _, meta in _RAW_REC_MAP.items():
-        dl = meta["DL"]
-        if dl in chosen:
-            by_cat.setdefault(meta["category"], []).append(dl)
-    for cat in order:
-        for dl in by_cat.get(cat, []):
-            meta = dl2meta.get(dl, {})
-            html = _style_dl(dl, cat, meta.get("main",""), meta.get("cost",""))
-            parts.append(f'<li class="cat-start">{html}</li>')
-    return "".join(parts) or "<li>no active recommendations</li>"
-
-def recs_by_category_for_patient(p: dict) -> dict[str, list[str]]:
-    chosen = set(p.get("recommendations") or [])
-    out: dict[str, list[str]] = {}
-    for _, meta in _RAW_REC_MAP.items():
-        dl = meta["DL"]
-        if dl in chosen:
-            out.setdefault(meta["category"], []).append(dl)
-    return out
-
-def build_pair_recs_alignment_plan(pX: dict, pY: dict):
-    by_x = recs_by_category_for_patient(pX)
-    by_y = recs_by_category_for_patient(pY)
-
-    cats_x, cats_y = set(by_x.keys()), set(by_y.keys())
-    common = [c for c in _CATEGORY_ORDER if c in cats_x and c in cats_y]
-    rest   = [c for c in _CATEGORY_ORDER if c not in common and (c in cats_x or c in cats_y)]
-    category_order = common + rest
-
-    # per-category master list: common DLs first (map order), then X-only, then Y-only
-    per_cat: dict[str, list[str]] = {}
-    for cat in category_order:
-        xs = by_x.get(cat, [])
-        ys = by_y.get(cat, [])
-        commons = [dl for dl in xs if dl in ys]
-        x_only  = [dl for dl in xs if dl not in commons]
-        y_only  = [dl for dl in ys if dl not in commons]
-        per_cat[cat] = commons + x_only + y_only
-    return category_order, per_cat
+    return f"<style>{minify_css(APP_CSS_PATH.read_text(encoding='utf-8'))}</style>"
+
+with _span("render.stylesheet"):
+    st.markdown(_stylesheet_html(), unsafe_allow_html=True)
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Small helpers
 
-# @st.cache_data(show_spinner=False)
-def load_patient_df_from_repo(path: Path | str | PathLike) -> pd.DataFrame:
-    path = Path(path)
-    if not path.exists():
-        raise FileNotFoundError(f"File A not found at: {path}")
-
-    suf = path.suffix.lower()
-    if suf == ".csv":
-        df = pd.read_csv(path)
-    elif suf == ".xlsx":
-        # pip install openpyxl
-        df = pd.read_excel(path, engine="openpyxl")
-    elif suf == ".xls":
-        # pip install xlrd==1.2.0  (or convert to .xlsx)
-        df = pd.read_excel(path, engine="xlrd")
-    elif suf in (".pkl", ".pickle"):
-        df = pd.read_pickle(path)
-    else:
-        raise ValueError(f"Unsupported File A extension: {suf}")
-
-    # Normalize & validate columns
-    df.columns = [str(c) for c in df.columns]
-    required = {"patient_num", "age", "risk", "risk_percentile", "sex", "adherence", "bmi", "smoker", "socio_economic"}
-    missing = required - set(df.columns)
-    if missing:
-        raise ValueError(f"patient_df missing required columns: {missing}")
-
-    rec_cols = [c for c in df.columns if c.startswith("rec")]
-    # Ensure rec1..rec21 exist and are ints
-    for i in range(1, len(rec_cols) + 1):
-        col = f"rec{i}"
-        if col not in df.columns:
-            df[col] = 0
-        df[col] = df[col].fillna(0).astype(int)
-
-    df["patient_num"] = df["patient_num"].astype(int)
-    df["age"] = df["age"].astype(int)
-    df["risk"] = df["risk"].astype(int)
-    df["risk_percentile"] = df["risk_percentile"].astype(int)
-    df["sex"] = df["sex"].astype(int)
-    df["bmi"] = df["bmi"].astype(float)
-    df["adherence"] = df["adherence"].astype(str)
-    # df["diabetes"] = df["diabetes"].astype(int)
-    df["smoker"] = df["smoker"].astype(int)
-    df["socio_economic"] = df["socio_economic"].astype(int)
-    return df
-
 def _slugify(s: str) -> str:
     s = (s or "").strip().lower()
     s = re.sub(r"[^a-z0-9._-]+", "_", s)
@@ -666,6 +89,43 @@ def _compose_output_filename(upload_name: str, user_name: str | None) -> str:
 
     return f"{stem}.json"
 
+def _setting(name: str, default=None):
+    """App setting from st.secrets, then the environment, else `default`."""
+    try:
+        if name in st.secrets:
+            return st.secrets[name]
+    except Exception:
+        pass  # no secrets.toml at all
+    return os.environ.get(name, default)
+
+# "snapshot": upsert the full progress snapshot on every Submit.
+# "delta": append one progress_deltas row per answer, compacting into a snapshot every DELTA_COMPACT_EVERY answers.
+AUTOSAVE_MODE = str(_setting("AUTOSAVE_MODE", "snapshot")).lower()
+DELTA_COMPACT_EVERY = int(_setting("DELTA_COMPACT_EVERY", 50))
+# "file": pairs in the order of the uploaded file. "adaptive": the next pair is the most informative
+# unanswered one under a Bradley–Terry fit of the answers so far (see scheduler.py).
+PAIR_ORDER = str(_setting("PAIR_ORDER", "file")).lower()
+# "off": every pair is asked. "infer": a pair already decided by a chain of answers with confidence
+# >= TRANSITIVE_MIN_CONFIDENCE is recorded as inferred and not asked. "defer": such pairs are asked last.
+TRANSITIVE_SKIP = str(_setting("TRANSITIVE_SKIP", "off")).lower()
+TRANSITIVE_MIN_CONFIDENCE = int(_setting("TRANSITIVE_MIN_CONFIDENCE", 4))
+
+# File A, the patient table (patient_df.csv next to app.py unless set).
+PATIENT_DF_PATH = Path(_setting("PATIENT_DF_PATH", PATIENT_DF_PATH)).resolve()
+
+# Where progress snapshots live: "supabase" (SUPABASE_URL / SUPABASE_ANON_KEY secrets)
+# or "sqlite" (a local WAL-mode file at PROGRESS_SQLITE_PATH, no network needed).
+PROGRESS_BACKEND = str(_setting("PROGRESS_BACKEND", "supabase")).lower()
+PROGRESS_SQLITE_PATH = str(_setting("PROGRESS_SQLITE_PATH", "progress.sqlite3"))
+# Autosaves of all sessions are committed together every GROUP_COMMIT_WINDOW_MS (0 = one write per save).
+GROUP_COMMIT_WINDOW_MS = float(_setting("GROUP_COMMIT_WINDOW_MS", 50))
+GROUP_COMMIT_MAX_QUEUE = int(_setting("GROUP_COMMIT_MAX_QUEUE", 5000))
+# Pairs rendered ahead of the current one in the background (0 = render each pair when shown).
+PREFETCH_DEPTH = int(_setting("PREFETCH_DEPTH", 3))
+# Secret that shows the performance panel in the sidebar when the app is opened with ?admin=<token>
+# (unset = no panel). The login name is free text, so it cannot gate anything.
+ADMIN_TOKEN = str(_setting("ADMIN_TOKEN", ""))
+
 @st.cache_resource
 def get_supabase():
     return create_client(
@@ -673,67 +133,92 @@ def get_supabase():
         st.secrets["SUPABASE_ANON_KEY"],
     )
 
+@st.cache_resource
+def get_progress_store() -> ProgressStore:
+    if PROGRESS_BACKEND == "sqlite":
+        return SQLiteStore(PROGRESS_SQLITE_PATH)
+    if PROGRESS_BACKEND == "supabase":
+        return SupabaseStore(get_supabase())
+    raise ValueError(f"Unknown PROGRESS_BACKEND {PROGRESS_BACKEND!r} (expected 'supabase' or 'sqlite').")
+
+@st.cache_resource
+def get_group_commit() -> GroupCommitWriter | None:
+    """Process-wide batcher for the autosave writes of every session (None when disabled)."""
+    if GROUP_COMMIT_WINDOW_MS <= 0:
+        return None
+    return GroupCommitWriter(get_progress_store(), window=GROUP_COMMIT_WINDOW_MS / 1000,
+                             max_queue=GROUP_COMMIT_MAX_QUEUE)
+
+@st.cache_resource(max_entries=2)
+def _patient_store(path: str, sha256: str) -> PatientStore:
+    return PatientStore(load_patient_df_from_repo(path), sha256)
+
+@st.cache_resource(max_entries=4)
+def _source_sha256(path: str, size: int, mtime_ns: int) -> str:
+    """file_sha256 once per (size, mtime) of the source, for when there is no current sidecar to read it from."""
+    return file_sha256(Path(path))
+
+def get_patient_store() -> PatientStore:
+    """
+    The patient table shared read-only by every session of this process, one per
+    dataset sha256: a changed File A gets a new store on the next Start, and
+    sessions started before keep the one they reference. Only `_patient_store`
+    parses the file, once per sha256.
+    """
+    digest = current_dataset_sha256(PATIENT_DF_PATH)  # the sidecar's hash, checked with one stat
+    if digest is None:  # no sidecar yet, a changed file, or a read-only checkout that never gets one
+        st_ = PATIENT_DF_PATH.stat()
+        digest = _source_sha256(str(PATIENT_DF_PATH), st_.st_size, st_.st_mtime_ns)
+    return _patient_store(str(PATIENT_DF_PATH), digest)
+
+def _progress_writes():
+    """What autosave writes go through: the shared group commit, or the store directly."""
+    return get_group_commit() or get_progress_store()
+
 def sb_load_snapshot(user_name: str, pair_file: str) -> dict | None:
     """Return latest snapshot dict or None."""
-    sb = get_supabase()
-    res = (
-        sb.table("progress_snapshots")
-        .select("snapshot")
-        .eq("user_name", user_name)
-        .eq("pair_file", pair_file)
-        .order("updated_at", desc=True)
-        .limit(1)
-        .execute()
-    )
-    rows = getattr(res, "data", None) or []
-    if not rows:
-        return None
-    return rows[0].get("snapshot")
+    store = get_progress_store()
+    with _span("store.load_snapshot"):
+        snapshot = store.load_snapshot(user_name, pair_file)
+    if AUTOSAVE_MODE != "delta":
+        return snapshot
+    # fold in the answers appended after the snapshot was last compacted
+    after_seq = int((snapshot or {}).get("delta_seq", 0))
+    with _span("store.load_deltas"):
+        deltas = store.load_deltas(user_name, pair_file, after_seq)
+    if not deltas:
+        return snapshot
+    return merge_deltas_into_snapshot(snapshot, deltas)
 
 def sb_save_snapshot(user_name: str, pair_file: str, snapshot: dict) -> None:
-    """Upsert snapshot for (user_name, pair_file)."""
-    sb = get_supabase()
-    sb.table("progress_snapshots").upsert(
-        {
-            "user_name": user_name,
-            "pair_file": pair_file,
-            "snapshot": snapshot,  # jsonb
-            "updated_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
-        },
-        on_conflict="user_name,pair_file",
-    ).execute()
+    """Upsert snapshot for (user_name, pair_file); returns once it is committed."""
+    _progress_writes().save_snapshot(user_name, pair_file, snapshot)
+
+def sb_append_deltas(rows: list[dict]) -> None:
+    """Append answer rows to the delta log (one write for the batch)."""
+    _progress_writes().append_deltas(rows)
+
+def sb_compact_deltas(user_name: str, pair_file: str, snapshot: dict) -> None:
+    """Upsert the compacted snapshot, then drop the deltas it already contains."""
+    sb_save_snapshot(user_name, pair_file, snapshot)
+    get_progress_store().delete_deltas(user_name, pair_file, int(snapshot.get("delta_seq", 0)))
+
+def merge_deltas_into_snapshot(snapshot: dict | None, deltas: list[dict]) -> dict:
+    """Snapshot + trailing deltas -> one snapshot in the usual format (later answers win)."""
+    snapshot = dict(snapshot or {"version": 1, "results": []})
+    results = list(snapshot.get("results") or [])
+    last_seq = int(snapshot.get("delta_seq", 0))
+    for d in deltas:
+        results.append([[int(d["a"]), int(d["b"])], int(d["confidence"])])
+        last_seq = max(last_seq, int(d["seq"]))
+    snapshot["results"] = results
+    snapshot["answered_pairs"] = len(results)
+    snapshot["delta_seq"] = last_seq
+    return snapshot
 
 def _rec_columns(df: pd.DataFrame) -> List[str]:
     return [c for c in df.columns if str(c).lower().startswith("rec")]
 
-def recs_from_row(row_dict: dict) -> list[str]:
-    out = []
-    for key, meta in _RAW_REC_MAP.items():
-        val = row_dict.get(key, 0)
-        try:
-            val = int(val)
-        except Exception:
-            pass
-        if val:
-            out.append(meta["DL"])
-    return out or ["no active recommendations"]
-
-def normalize_patient(row_dict: dict) -> dict:
-    return {
-        "id": int(row_dict.get("patient_num")),
-        "age": int(row_dict.get("age")),
-        "risk": int(row_dict.get("risk")),
-        "risk_percentile": int(row_dict.get("risk_percentile")),
-        # "risk_band": int(row_dict.get("risk_band")),
-        "sex": int(row_dict.get("sex")), 
-        "bmi": float(row_dict.get("bmi")), 
-        "adherence": str(row_dict.get("adherence")), 
-        # "diabetes": int(row_dict.get("diabetes")), 
-        "smoker": int(row_dict.get("smoker")), 
-        "socio_economic": int(row_dict.get("socio_economic")), 
-        "recommendations": recs_from_row(row_dict),
-    }
-
 def read_patient_df(file) -> pd.DataFrame:
     """
     Accept CSV, PKL, or Excel (.xlsx/.xls).
@@ -792,86 +277,38 @@ def read_patient_df(file) -> pd.DataFrame:
     df["socio_economic"] = df["socio_economic"].astype(int)
     return df
 
-def read_pairs_pkl(file) -> List[Tuple[int, int]]:
+def read_pairs_pkl(file) -> PairColumns:
     """Reads a PKL that contains a list of 2-tuples of ints."""
-    data = pickle.load(file)
-    # basic sanity checks
-    if not isinstance(data, (list, tuple)):
-        raise ValueError("pairs_for_ranking must be a list/tuple of (a, b).")
-    pairs = []
-    for t in data:
-        if not (isinstance(t, (list, tuple)) and len(t) == 2):
-            raise ValueError(f"Invalid pair entry: {t}")
-        a, b = int(t[0]), int(t[1])
-        if a == b:
-            continue
-        pairs.append((a, b))
-    if not pairs:
-        raise ValueError("No valid pairs found.")
-    return pairs
+    return read_pairs(file, "pairs.pkl")
 
 
-def read_pairs_file(file) -> List[Tuple[int, int]]:
+def read_pairs_file(file) -> PairColumns:
     """
     Reads an uploaded file containing pairs:
-      - .pkl : pickled list/tuple of 2-tuples/lists
-      - .json: JSON list of [a, b] (or (a, b)) items
-    Returns: list of (int, int)
+      - .pairs: binary pairs file (see pairs_io), used in place without copying
+      - .pkl  : pickled list/tuple of 2-tuples/lists
+      - .json : JSON list of [a, b] items (streamed, never held as Python objects)
+    Returns: int32 a/b columns; self-pairs and repeated unordered pairs are dropped.
     """
     if file is None:
         raise ValueError("No file provided.")
 
-    # Try to detect by extension; default to PKL if unknown
-    suffix = Path(getattr(file, "name", "")).suffix.lower()
-    parse_as_json = (suffix == ".json")
-
     # Reset pointer (Streamlit uploader may have been read before)
     try:
         file.seek(0)
     except Exception:
         pass  # some file-like objects may not support seek
 
-    # Parse
-    try:
-        if parse_as_json:
-            raw = file.read()
-            if isinstance(raw, bytes):
-                raw = raw.decode("utf-8")
-            data = json.loads(raw)
-        else:
-            # assume pickle by default
-            data = pickle.load(file)
-    except Exception as e:
-        kind = "JSON" if parse_as_json else "PKL"
-        raise ValueError(f"Failed to parse {kind}: {e}") from e
-
-    # Validate & normalize
-    if not isinstance(data, (list, tuple)):
-        raise ValueError("pairs_for_ranking must be a list/tuple of (a, b).")
-
-    pairs: List[Tuple[int, int]] = []
-    for t in data:
-        if not (isinstance(t, (list, tuple)) and len(t) == 2):
-            raise ValueError(f"Invalid pair entry: {t!r}")
-        a, b = int(t[0]), int(t[1])
-        if a == b:
-            continue
-        pairs.append((a, b))
-
-    if not pairs:
-        raise ValueError("No valid pairs found in the file.")
+    # Detected by extension; anything but .pairs / .json is read as PKL
+    return read_pairs(file, getattr(file, "name", ""))
 
-    return pairs
 
-
-def validate_pairs_in_df(df: pd.DataFrame, pairs: List[Tuple[int, int]]) -> List[int]:
+def validate_pairs_in_df(df: pd.DataFrame, pairs) -> List[int]:
     """Return list of missing patient_nums (if any)."""
-    ids = set(df["patient_num"].astype(int).tolist())
-    missing = []
-    for a, b in pairs:
-        if a not in ids: missing.append(a)
-        if b not in ids: missing.append(b)
-    return sorted(list(set(missing)))
+    cols = pair_columns(pairs)
+    ids = df["patient_num"].to_numpy()
+    missing = [col[~np.isin(col, ids)] for col in (cols.a, cols.b)]
+    return np.unique(np.concatenate(missing)).tolist()
 
 def _instructions_body():
     st.markdown("""
@@ -906,21 +343,47 @@ else:
 
 def _build_results_payload() -> dict:
     """Build a resume-able snapshot of the user's progress (JSON-safe)."""
-    answered = [r for r in st.session_state.results if r is not None]
+    with _span("payload.build"):
+        return _results_payload()
+
+def _results_payload() -> dict:
+    return _snapshot_payload(st.session_state.results, len(st.session_state.prepared_pairs or []),
+                             st.session_state.idx, st.session_state.get("transitive_skipper"))
+
+def _snapshot_payload(results: list, total_pairs: int, current_index: int,
+                      skipper: TransitiveSkipper | None) -> dict:
+    answered = [r for r in results if r is not None]
     return {
         "version": 1,
         "generated_utc": datetime.utcnow().isoformat(timespec="seconds") + "Z",
-        "total_pairs": int(len(st.session_state.prepared_pairs or [])),
+        "total_pairs": int(total_pairs),
         "answered_pairs": int(len(answered)),
-        "current_index": int(st.session_state.idx or 0),
+        "current_index": int(current_index or 0),
         "results": answered,  # list of [[a,b], conf] or [(a,b), conf] is fine
+        **({"inferred": [list(p) for p in skipper.inferred.values()]} if skipper is not None else {}),
     }
 
-def _serialize_results_json(payload: dict) -> tuple[bytes, str, str]:
-    """Return JSON as bytes + name + mime."""
-    ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-    return data, f"rankings_{ts}.json", "application/json"
+def _deferred_export(fmt: str, snapshot: bool = True):
+    """
+    A st.download_button `data` callable that encodes this session's results as
+    EXPORT_FORMATS[fmt] when the download is requested. It runs outside the
+    script thread, where st.session_state is not available, so it reads this
+    session's state through the run context captured here: results, position
+    and inferred pairs all as of the click.
+    """
+    ctx = get_script_run_ctx()
+
+    def build():
+        state = ctx.session_state if ctx is not None else st.session_state
+        results, idx = state["results"], state["idx"]
+        total = len(state["prepared_pairs"] or [])
+        skipper = state["transitive_skipper"] if "transitive_skipper" in state else None
+        if snapshot:
+            payload = _snapshot_payload(results, total, idx, skipper)
+        else:
+            payload = [r for r in results if r is not None]
+        return export_results(payload, fmt)
+    return timed("results.serialize", build, *_timings())
 
 def load_progress_json(file) -> dict:
     """Read a JSON snapshot and return the dict. Minimal validation."""
@@ -949,19 +412,17 @@ def apply_snapshot_to_session(snapshot: dict):
         
 def save_progress_ui_json(key_suffix: str = ""):
     """Render inline Save (JSON) button. key_suffix keeps keys unique."""
-    payload = _build_results_payload()
-    data, fname, mime = _serialize_results_json(payload)
-
-    # small right-side save button
+    # small right-side save button; the snapshot is only serialized when it is clicked
     c1, c2 = st.columns([1, 0.22])
     with c2:
         st.download_button(
             "💾 Download progress",
-            data=data,
+            data=_deferred_export("json"),
             file_name=st.session_state.results_file_name,
             mime="application/json",
             key=f"save_json_{key_suffix}",
             help="Download a JSON snapshot of your current progress",
+            on_click="ignore",
         )
 
 def apply_snapshot_to_session_smart(snapshot: dict):
@@ -976,8 +437,7 @@ def apply_snapshot_to_session_smart(snapshot: dict):
 
     # Build index map: both (a,b) and (b,a) point to the same index
     idx_map: dict[tuple[int,int], int] = {}
-    for i, pr in enumerate(prepared):
-        a, b = int(pr["a"]), int(pr["b"])
+    for i, (a, b) in enumerate(zip(prepared.a.tolist(), prepared.b.tolist())):
         idx_map[(a, b)] = i
         idx_map[(b, a)] = i
 
@@ -999,7 +459,7 @@ def apply_snapshot_to_session_smart(snapshot: dict):
             continue
 
         # Normalize stored pair to the canonical (a,b) of prepared_pairs[i]
-        canon_a, canon_b = int(prepared[i]["a"]), int(prepared[i]["b"])
+        canon_a, canon_b = int(prepared.a[i]), int(prepared.b[i])
         results[i] = ((canon_a, canon_b), conf)
         placed += 1
 
@@ -1014,13 +474,314 @@ def apply_snapshot_to_session_smart(snapshot: dict):
     st.session_state.pair_counter = next_idx  # keep widget keys advancing
     return placed, n, next_idx
 
+def _autosave_writer() -> SnapshotWriter:
+    """This session's background snapshot writer (a new one per user/pair file)."""
+    key = (st.session_state.user_name, st.session_state.input_filename)
+    writer = st.session_state.get("autosave_writer")
+    if writer is None or st.session_state.get("autosave_key") != key:
+        user_name, pair_file = key
+        timings = _timings()  # the writer's thread has no session state; time its store calls into these
+        if AUTOSAVE_MODE == "delta":
+            writer = SnapshotWriter(timed("store.compact_deltas",
+                                          lambda snapshot: sb_compact_deltas(user_name, pair_file, snapshot), *timings),
+                                    append=timed("store.append_deltas", sb_append_deltas, *timings))
+        else:
+            writer = SnapshotWriter(timed("store.save_snapshot",
+                                          lambda snapshot: sb_save_snapshot(user_name, pair_file, snapshot), *timings))
+        st.session_state.autosave_writer = writer
+        st.session_state.autosave_key = key
+    return writer
+
+def _next_delta_row(idx: int, out_pair: tuple[int, int], conf: int) -> dict:
+    """
+    progress_deltas row for the answer just given. seq is microseconds since the
+    epoch (bumped past the previous one), so it keeps increasing across sessions
+    and restarts without reading the log first; the latest answer for a pair wins.
+    """
+    seq = max(int(st.session_state.get("delta_seq", 0)) + 1, time.time_ns() // 1000)
+    st.session_state.delta_seq = seq
+    st.session_state.answers_since_compact = st.session_state.get("answers_since_compact", 0) + 1
+    return {
+        "user_name": st.session_state.user_name,
+        "pair_file": st.session_state.input_filename,
+        "seq": seq,
+        "idx": int(idx),
+        "a": int(out_pair[0]),
+        "b": int(out_pair[1]),
+        "confidence": conf,
+        "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+    }
+
+def _autosave_status_text() -> str:
+    writer = st.session_state.get("autosave_writer")
+    if writer is None:
+        return ""
+    status = writer.status()
+    if status.stalled:
+        return (f"Autosave failed: {status.unsaved_deltas} answer(s) not saved yet, "
+                f"retried on the next Submit ({status.last_error})")
+    if status.last_error:
+        return f"Autosave: retrying ({status.last_error})" if status.pending else f"Autosave failed: {status.last_error}"
+    if status.pending:
+        return "Autosave: saving…"
+    if status.last_saved_at:
+        return f"Autosave: saved at {status.last_saved_at.astimezone():%H:%M:%S}"
+    return ""
+
+def _pair_scheduler() -> ActivePairScheduler:
+    """
+    This session's adaptive scheduler. Built from `results` on first use after
+    Start / resume, which also moves idx to the first pair it picks.
+    """
+    sched = st.session_state.get("pair_scheduler")
+    if sched is None:
+        prepared = st.session_state.prepared_pairs
+        sched = ActivePairScheduler.from_results(PairColumns(prepared.a, prepared.b), st.session_state.results)
+        st.session_state.pair_scheduler = sched
+        nxt = sched.next_index()
+        st.session_state.idx = len(prepared) if nxt is None else nxt
+    return sched
+
+def _transitive_skipper(sched: ActivePairScheduler | None) -> TransitiveSkipper | None:
+    """
+    This session's transitivity skipper, None unless TRANSITIVE_SKIP is "infer" or
+    "defer". Built from `results` on first use, which also settles the current pair.
+    """
+    if TRANSITIVE_SKIP not in TRANSITIVE_MODES:
+        return None
+    skipper = st.session_state.get("transitive_skipper")
+    if skipper is None:
+        prepared = st.session_state.prepared_pairs
+        skipper = TransitiveSkipper.from_results(PairColumns(prepared.a, prepared.b), st.session_state.results,
+                                                 mode=TRANSITIVE_SKIP, min_confidence=TRANSITIVE_MIN_CONFIDENCE)
+        st.session_state.transitive_skipper = skipper
+        st.session_state.idx = _next_pair_index(st.session_state.idx, sched, skipper)
+    return skipper
+
+def _pair_prefetcher() -> PairPrefetcher | None:
+    """This session's look-ahead renderer of the next pairs (None when PREFETCH_DEPTH is 0)."""
+    if PREFETCH_DEPTH <= 0:
+        return None
+    prefetcher = st.session_state.get("pair_prefetcher")
+    if prefetcher is None:
+        # the worker thread has no session state; time its renders into these
+        prefetcher = PairPrefetcher(st.session_state.prepared_pairs, st.session_state.get("card_fragments"),
+                                    depth=PREFETCH_DEPTH, render=timed("prefetch.render", render_pair, *_timings()))
+        st.session_state.pair_prefetcher = prefetcher
+    return prefetcher
+
+def _next_pair_index(candidate: int, sched: ActivePairScheduler | None, skipper: TransitiveSkipper) -> int:
+    """
+    The pair to show, starting from `candidate` (the next in file order or the
+    scheduler's pick): pairs the answers already decide are inferred or deferred
+    on the way, and deferred ones come after everything else. len(prepared_pairs)
+    when nothing is left.
+    """
+    total = len(st.session_state.prepared_pairs)
+    results = st.session_state.results
+    i = candidate
+    while not skipper.final_pass and i < total:
+        if results[i] is not None or skipper.settle(i):
+            return i
+        if sched is not None:
+            sched.skip(i)
+            nxt = sched.next_index()
+            i = total if nxt is None else nxt
+        else:
+            i += 1
+    nxt = skipper.next_deferred(results)
+    return total if nxt is None else nxt
+
+CONF_LABELS = {
+    5: "5 - completely sure",
+    4: "4 - almost",
+    3: "3 - fairly",
+    2: "2 - slightly",
+    1: "1 - not sure, chose because I had to",
+}
+
+def _submit_answer(answered_idx: int, k_sel: str, k_conf: str):
+    """Submit's on_click: record the answer to pair `answered_idx`, move on to the next pair and autosave."""
+    choice = st.session_state.get(k_sel, None)   # "Patient X" | "Patient Y"
+    conf   = st.session_state.get(k_conf, None)  # int 1..5
+
+    # hard validation
+    if choice not in ("Patient X", "Patient Y"):
+        st.session_state.submit_notice = "Please choose Patient X or Patient Y before submitting."
+        return
+    if conf not in (1, 2, 3, 4, 5):
+        st.session_state.submit_notice = "Please choose a confidence between 1–5."
+        return
+
+    total = len(st.session_state.prepared_pairs)
+    sched = _pair_scheduler() if PAIR_ORDER == "adaptive" else None
+    skipper = _transitive_skipper(sched)
+    pair = st.session_state.prepared_pairs[answered_idx]
+    a, b = pair["a"], pair["b"]
+    if choice == "Patient X":
+        chosen_id, other_id = pair["patient_x"]["id"], pair["patient_y"]["id"]
+    elif choice == "Patient Y":
+        chosen_id, other_id = pair["patient_y"]["id"], pair["patient_x"]["id"]
+
+    if   (chosen_id, other_id) == (a, b): out_pair = (a, b)
+    elif (chosen_id, other_id) == (b, a): out_pair = (b, a)
+    else:                                 out_pair = (chosen_id, other_id)
+
+    st.session_state.results[answered_idx] = (out_pair, int(conf))
+    if sched is not None:
+        sched.record(answered_idx, out_pair[0], int(conf))
+        nxt = sched.next_index()
+        st.session_state.idx = total if nxt is None else nxt
+    else:
+        st.session_state.idx += 1
+    if skipper is not None:
+        skipper.record(out_pair[0], out_pair[1], int(conf))
+        st.session_state.idx = _next_pair_index(st.session_state.idx, sched, skipper)
+    st.session_state.pair_counter += 1
+    # --- autosave to Supabase, written behind so the next pair renders right away ---
+    try:
+        with _span("autosave.submit"):
+            writer = _autosave_writer()
+            if AUTOSAVE_MODE == "delta":
+                row = _next_delta_row(answered_idx, out_pair, int(conf))
+                # compact every DELTA_COMPACT_EVERY answers, and right away if the writer gave up on earlier
+                # writes: the snapshot then carries every answer even if the held deltas never make it
+                status = writer.status()
+                compact = (st.session_state.answers_since_compact >= DELTA_COMPACT_EVERY
+                           or status.stalled or (status.last_error is not None and not status.pending))
+                snapshot = None
+                if compact:
+                    snapshot = {**_build_results_payload(), "delta_seq": row["seq"]}
+                    st.session_state.answers_since_compact = 0
+                writer.submit(snapshot, deltas=[row])
+            else:
+                writer.submit(_build_results_payload())
+    except Exception as e:
+        st.session_state.submit_notice = f"Autosave failed (server): {e}"
+
+def _pair_panel_body():
+    """
+    Caption, progress download, both cards, the two radios and Submit. Runs as
+    an st.fragment, so a radio click or a Submit reruns only this panel (see
+    _pair_panel); Submit does its work in the on_click callback, before the
+    panel reruns with the next pair.
+    """
+    total = len(st.session_state.prepared_pairs)
+    sched = _pair_scheduler() if PAIR_ORDER == "adaptive" else None
+    skipper = _transitive_skipper(sched)
+    if st.session_state.idx >= total:
+        st.session_state.stage = "done"
+        st.session_state.just_finished = True
+        st.rerun()  # the whole app: leave the running page
+
+    pair = st.session_state.prepared_pairs[st.session_state.idx]
+    k_sel  = f"selected_{st.session_state.pair_counter}"
+    k_conf = f"conf_{st.session_state.pair_counter}"
+
+    autosave_text = _autosave_status_text()
+    position = sched.n_answered + 1 if sched is not None else st.session_state.idx + 1
+    inferred_text = f"{len(skipper.inferred)} inferred" if skipper is not None and skipper.inferred else ""
+    st.caption("  •  ".join(t for t in (f"Pair {position} of {total}", inferred_text, autosave_text) if t))
+
+    # Derive output name from the uploaded file + user
+    uploaded_name = st.session_state.get("input_filename", "pairs.json")
+    user_name = st.session_state.get("user_name")  # from your login step
+    out_name = _compose_output_filename(uploaded_name, user_name)
+
+    # Cache once
+    if "results_file_name" not in st.session_state or not st.session_state.results_file_name:
+        st.session_state.results_file_name = out_name
+    # NEW: save JSON on every page
+    save_progress_ui_json(key_suffix=f"run_{st.session_state.pair_counter}")
+
+    current_choice = st.session_state.get(k_sel)
+
+    # the cards never carry the selection, so they stay identical across radio clicks (sent as a
+    # cache reference); the chosen frame is highlighted by the small style element below them.
+    # Usually the prefetcher rendered them while the previous pair was on screen.
+    prefetcher = _pair_prefetcher()
+    rendered = prefetcher.take(st.session_state.idx) if prefetcher is not None else None
+    if rendered is None:
+        with _span("cards.render"):
+            rendered = render_pair(pair, st.session_state.get("card_fragments"))
+        if prefetcher is not None:
+            prefetcher.put(st.session_state.idx, rendered)
+    if prefetcher is not None:
+        prefetcher.ahead(st.session_state.idx)
+
+    st.markdown(f'<div class="pair-grid">{rendered.card_x}{rendered.card_y}</div>', unsafe_allow_html=True)
+    st.markdown(selected_frame_style({"Patient X": "left", "Patient Y": "right"}.get(current_choice)),
+                unsafe_allow_html=True)
+
+    st.radio("Choose one:", ["Patient X", "Patient Y"], index=None, horizontal=True, key=k_sel)
+
+
+    st.markdown("#### How sure are you?")
+    st.radio(
+        "On a scale of 1–5:",
+        options=[5, 4, 3, 2, 1],          # values are INTs, shown top→bottom as 5→1
+        format_func=lambda x: CONF_LABELS[x],
+        index=None,
+        horizontal=False,
+        key=k_conf,                        # keep your per-pair key
+    )
+
+    st.button("Submit", type="primary", on_click=_submit_answer,
+              args=(st.session_state.idx, k_sel, k_conf))
+    notice = st.session_state.pop("submit_notice", None)
+    if notice:
+        st.warning(notice)
+
+    st.divider()
+
+if hasattr(st, "fragment"):
+    @st.fragment
+    def _pair_panel():
+        with _span("fragment.pair_panel"):
+            _pair_panel_body()
+else:
+    # Fallback for Streamlit versions without st.fragment: the panel reruns with the app
+    def _pair_panel():
+        _pair_panel_body()
+
+def _performance_panel():
+    """Sidebar timings for ADMIN_TOKEN holders: rolling span percentiles per scope, plus Prometheus / JSONL downloads."""
+    session, process = _timings()
+    scopes = {"session": session, "process": process}
+    with st.sidebar.expander("Performance", expanded=False):
+        for scope, rec in scopes.items():
+            rows = rec.stats()
+            st.caption(f"{scope} ({rec.window} most recent samples per span)")
+            if rows:
+                st.dataframe(pd.DataFrame([asdict(r) for r in rows]).set_index("name").round(2),
+                             width="stretch")
+            else:
+                st.write("No spans recorded yet.")
+        group_commit = get_group_commit()
+        if group_commit is not None:
+            st.caption("group commit")
+            st.json(asdict(group_commit.stats()), expanded=False)
+        st.download_button("Download timings (Prometheus)", to_prometheus(scopes).encode("utf-8"),
+                           file_name="timings.prom", mime="text/plain", key="timings_prom")
+        st.download_button("Download timings (JSONL)", to_jsonl(scopes).encode("utf-8"),
+                           file_name="timings.jsonl", mime="application/x-ndjson", key="timings_jsonl")
+        if st.button("Reset session timings", key="timings_reset"):
+            session.clear()
+
+def _is_admin() -> bool:
+    """True once this session opened the app with ?admin=ADMIN_TOKEN; the token is then dropped from the URL."""
+    if "admin" in st.query_params:
+        given = st.query_params["admin"]
+        del st.query_params["admin"]
+        st.session_state.is_admin = bool(ADMIN_TOKEN) and hmac.compare_digest(given.encode(), ADMIN_TOKEN.encode())
+    return st.session_state.get("is_admin", False)
+
 def _start_new_session():
     # jump to upload and clear artifacts safely
     st.session_state.stage = "upload"
     st.session_state.idx = 0
     st.session_state.pair_counter = 0
     st.session_state.results_downloaded = False
-    st.session_state.pop("results_bytes", None)
     st.session_state.pop("results_file_name", None)
     st.rerun()
 
@@ -1032,12 +793,12 @@ if "stage" not in st.session_state:
     st.session_state.stage = "login"   # start at login
 if "user_name" not in st.session_state:
     st.session_state.user_name = None
-if "patient_df" not in st.session_state:
-    st.session_state.patient_df = None
+if "patient_store" not in st.session_state:
+    st.session_state.patient_store = None  # handle to the process-wide PatientStore once started
 if "pairs" not in st.session_state:
     st.session_state.pairs = None
 if "prepared_pairs" not in st.session_state:
-    st.session_state.prepared_pairs = []  # list of dicts with randomized X/Y per pair
+    st.session_state.prepared_pairs = []  # PreparedPairs (lazy, randomized X/Y per pair) once started
 if "idx" not in st.session_state:
     st.session_state.idx = 0
 if "pair_counter" not in st.session_state:
@@ -1054,125 +815,132 @@ if "placed" not in st.session_state:
 # ─────────────────────────────────────────────────────────────
 # Login screen
 # ─────────────────────────────────────────────────────────────
-if st.session_state.get("stage") == "login" or "user_name" not in st.session_state:
-    st.header("Sign in to start")
-    st.caption("Enter your full name in English.")
-
-    name = st.text_input("Your full name in English (required)", value=st.session_state.get("user_name", ""), placeholder="e.g., Dana Levi")
-    if name:
-        if st.button("Continue", type="primary", disabled=(len(name.strip()) < 2)):
-            st.session_state.user_name = name.strip()
-            st.session_state.stage = "upload"
-            st.rerun()
-
-    st.stop()  # don’t render the rest of the app until login is done
-
-# Pages
-st.title("Patients Ranking Research")
+if _is_admin():
+    _performance_panel()
 
-if st.session_state.stage == "upload":
-    st.subheader("Welcome to the Ranking Project!")
-    st.subheader("Let's get started.", divider="gray")
+with _span(f"stage.{st.session_state.stage}"):
+    if st.session_state.get("stage") == "login" or "user_name" not in st.session_state:
+        st.header("Sign in to start")
+        st.caption("Enter your full name in English.")
 
-    st.info("**Step 1** — Load the file you recieved by email")
+        name = st.text_input("Your full name in English (required)", value=st.session_state.get("user_name", ""), placeholder="e.g., Dana Levi")
+        if name:
+            if st.button("Continue", type="primary", disabled=(len(name.strip()) < 2)):
+                st.session_state.user_name = name.strip()
+                st.session_state.stage = "upload"
+                st.rerun()
 
-    # Show status of File A (auto-loaded from repo)
-    try:
-        df_preview = load_patient_df_from_repo(PATIENT_DF_PATH)
-        # st.success(f"File A loaded from repo: **{PATIENT_DF_PATH.name}**  •  Patients: **{len(df_preview)}**")
-    except Exception as e:
-        st.error(f"Problem loading data into app: {e}")
-    # User only uploads File B
-    pairs_file = st.file_uploader("Pairs for ranking (JSON file)", type=["json", "pkl"])
+        st.stop()  # don’t render the rest of the app until login is done
 
-    st.text("")
-    st.text("")
-    st.text("")
+    # Pages
+    st.title("Patients Ranking Research")
 
-    st.info("**Optional** — load previous progress from this round")
+    if st.session_state.stage == "upload":
+        st.subheader("Welcome to the Ranking Project!")
+        st.subheader("Let's get started.", divider="gray")
 
-    progress_file = st.file_uploader("Optional - load previous progress (JSON)", type=["json"], key="progress_upload")
+        st.info("**Step 1** — Load the file you recieved by email")
 
-    if st.button("Start", type="primary", disabled=not pairs_file):
-        # Read File A from repo
+        # Show status of File A (auto-loaded from repo once per process and dataset, see get_patient_store)
+        store_preview = None
         try:
-            df = load_patient_df_from_repo(PATIENT_DF_PATH)
+            with _span("patients.load"):
+                store_preview = get_patient_store()
+            # st.success(f"File A loaded from repo: **{PATIENT_DF_PATH.name}**  •  Patients: **{len(store_preview)}**")
         except Exception as e:
-            st.error(f"Failed to load basic research data from repo: {e}")
-            st.stop()
+            st.error(f"Problem loading data into app: {e}")
+        # User only uploads File B
+        pairs_file = st.file_uploader("Pairs for ranking (JSON file)", type=["json", "pkl", "pairs"])
 
-        # Read File B (pairs)
-        try:
-            pairs = read_pairs_file(pairs_file)
-        except Exception as e:
-            st.error(f"Failed to read pairs PKL: {e}")
-            st.stop()
-
-        st.session_state.input_filename = getattr(pairs_file, "name", "pairs.json")
-
-        # Validate pairs exist in df
-        missing = validate_pairs_in_df(df, pairs)
-        if missing:
-            st.error(f"The following patient_num are missing from patient_df: {missing[:20]}{'...' if len(missing)>20 else ''}")
-            st.stop()
-
-        # Prepare lookup by id
-        by_id = df.set_index("patient_num").to_dict("index")
-
-        # Precompute randomized X/Y orientation per pair (stable through the session)
-        rng = random.Random(42)
-        prepared = []
-        for a, b in pairs:
-            a_dict = normalize_patient({**by_id[a], "patient_num": a})
-            b_dict = normalize_patient({**by_id[b], "patient_num": b})
-            if rng.random() < 0.5:
-                patient_x, patient_y = a_dict, b_dict
-            else:
-                patient_x, patient_y = b_dict, a_dict
-            prepared.append({"a": a, "b": b, "patient_x": patient_x, "patient_y": patient_y})
-
-        # Prime session
-        st.session_state.patient_df = df
-        st.session_state.pairs = pairs
-        st.session_state.prepared_pairs = prepared
-        st.session_state.idx = 0
-        st.session_state.pair_counter = 0
-        st.session_state.results = [None] * len(prepared)
-
-        # --- NEW: if no manual progress file uploaded, try server resume from Supabase ---
-        if progress_file is None:
+        st.text("")
+        st.text("")
+        st.text("")
+
+        st.info("**Optional** — load previous progress from this round")
+
+        progress_file = st.file_uploader("Optional - load previous progress (JSON)", type=["json"], key="progress_upload")
+
+        if st.button("Start", type="primary", disabled=not pairs_file):
+            # Read File A from repo (reuse the store already looked up above for this rerun)
             try:
-                pair_file_name = st.session_state.input_filename
-                snap = sb_load_snapshot(st.session_state.user_name, pair_file_name)
-                if snap:
-                    placed, n, next_idx = apply_snapshot_to_session_smart(snap)
-                    st.session_state.placed = placed
-                    st.success(f"Resumed saved progress: {placed}/{n} answers. Continuing at pair {min(next_idx+1, n)}.")
+                store = store_preview if store_preview is not None else get_patient_store()
             except Exception as e:
-                st.warning(f"Could not load saved progress from server: {e}")
+                st.error(f"Failed to load basic research data from repo: {e}")
+                st.stop()
 
-        if progress_file is not None:
+            # Read File B (pairs)
             try:
-                snapshot = load_progress_json(progress_file)
-                placed, n, next_idx = apply_snapshot_to_session_smart(snapshot)
-                st.session_state.placed = placed
-                st.success(f"Loaded progress: restored {placed}/{n} answers. Resuming at pair {min(next_idx+1, n)}.")
+                with _span("pairs.read"):
+                    pairs = read_pairs_file(pairs_file)
             except Exception as e:
-                st.warning(f"Could not apply progress file: {e}")
+                st.error(f"Failed to read pairs file: {e}")
+                st.stop()
 
-        st.session_state.stage = "explain"
-        st.rerun()
+            st.session_state.input_filename = getattr(pairs_file, "name", "pairs.json")
 
-elif st.session_state.stage == "explain":
-    total = len(st.session_state.prepared_pairs)
-    unique_ids = set()
-    for pr in st.session_state.prepared_pairs:
-        unique_ids.add(pr["a"]); unique_ids.add(pr["b"])
-    n_unique = len(unique_ids)
+            # Validate pairs exist in df
+            missing = validate_pairs_in_df(store.df, pairs)
+            if missing:
+                st.error(f"The following patient_num are missing from patient_df: {missing[:20]}{'...' if len(missing)>20 else ''}")
+                st.stop()
 
-    st.header("Before you begin")
-    st.markdown(
-        """
+            # Pairs are kept as (a, b, orientation bit) arrays; patients are materialized on access.
+            # X/Y orientation is the same random.Random(42) draw per pair as always (stable through the session)
+            with _span("pairs.prepare"):
+                prepared = PreparedPairs(store, pairs)
+
+            # Static card sections for the whole cohort (built or read from .cache/ once per store)
+            try:
+                with _span("cards.fragments"):
+                    st.session_state.card_fragments = store.card_fragments(PATIENT_DF_PATH)
+            except Exception as e:
+                st.session_state.card_fragments = None  # cards just render their sections per request
+                st.warning(f"Could not pre-render patient cards: {e}")
+
+            # Prime session
+            st.session_state.patient_store = store
+            st.session_state.pairs = pairs
+            st.session_state.prepared_pairs = prepared
+            st.session_state.idx = 0
+            st.session_state.pair_counter = 0
+            st.session_state.results = [None] * len(prepared)
+            st.session_state.pair_scheduler = None  # rebuilt from results (incl. any resumed ones) when running starts
+            st.session_state.transitive_skipper = None
+            st.session_state.pair_prefetcher = None  # rendered for the previous pairs; rebuilt on the first pair shown
+
+            # --- NEW: if no manual progress file uploaded, try server resume from Supabase ---
+            if progress_file is None:
+                try:
+                    pair_file_name = st.session_state.input_filename
+                    snap = sb_load_snapshot(st.session_state.user_name, pair_file_name)
+                    if snap:
+                        with _span("snapshot.apply"):
+                            placed, n, next_idx = apply_snapshot_to_session_smart(snap)
+                        st.session_state.placed = placed
+                        st.success(f"Resumed saved progress: {placed}/{n} answers. Continuing at pair {min(next_idx+1, n)}.")
+                except Exception as e:
+                    st.warning(f"Could not load saved progress from server: {e}")
+
+            if progress_file is not None:
+                try:
+                    snapshot = load_progress_json(progress_file)
+                    with _span("snapshot.apply"):
+                        placed, n, next_idx = apply_snapshot_to_session_smart(snapshot)
+                    st.session_state.placed = placed
+                    st.success(f"Loaded progress: restored {placed}/{n} answers. Resuming at pair {min(next_idx+1, n)}.")
+                except Exception as e:
+                    st.warning(f"Could not apply progress file: {e}")
+
+            st.session_state.stage = "explain"
+            st.rerun()
+
+    elif st.session_state.stage == "explain":
+        total = len(st.session_state.prepared_pairs)
+        n_unique = len(st.session_state.prepared_pairs.unique_ids())
+
+        st.header("Before you begin")
+        st.markdown(
+            """
 - All the data in this study is **synthetic**, and only **simulates** real patients.
 - You will see **pairs of patients** side by side (named X and Y).
 
@@ -1188,10 +956,10 @@ elif st.session_state.stage == "explain":
   9. Recommendations this patient currently has on C-Pi, with their estimated **relative cost**
 
     """
-    )
+        )
 
-    st.markdown(
-"""
+        st.markdown(
+    """
 - Note: in this study, we simulate the **dyslipidemia** population in C-Pi. Reccomendations and risk scores should be evaluated in this context.
 
 - Pick which patient should be **prioritized for proactive intervention** (higher on the C-Pi focus list).  
@@ -1200,197 +968,101 @@ elif st.session_state.stage == "explain":
 
 - When you finish all pairs, click **download results** and email us the file.
         """
-    )
-    st.info(f"Pairs to review: **{total - st.session_state.placed}**")    
+        )
+        st.info(f"Pairs to review: **{total - st.session_state.placed}**")    
  
 
-    c1= st.columns([1])
-    if st.button("Start", type="primary"):
-        st.session_state.stage = "running"
-        st.rerun()
-
-elif st.session_state.stage == "running":
-    # st.markdown("For the pairs below, choose which patiets should be prioritized for proactive intervention (higher on the C-Pi focus list)")
-# Top row with a right-aligned help button
-    left_spacer, right_btn = st.columns([1, 0.2])
-    with right_btn:
-        if hasattr(st, "dialog"):
-            if st.button("❓ Instructions", key=f"help_{st.session_state.pair_counter}"):
-                _open_instructions_dialog()
-        else:
-            # Fallback if st.dialog isn’t available: use a popover
-            with st.popover("❓ Instructions", use_container_width=True):
-                _instructions_body()
-
-    total = len(st.session_state.prepared_pairs)
-    if st.session_state.idx >= total:
-        st.session_state.stage = "done"
-        st.session_state.just_finished = True
-        st.rerun()
-
-    pair = st.session_state.prepared_pairs[st.session_state.idx]
-    k_sel  = f"selected_{st.session_state.pair_counter}"
-    k_conf = f"conf_{st.session_state.pair_counter}"
-
-    st.markdown("#### Which patient should be prioritized for proactive intervention?")
-
-    st.caption(f"Pair {st.session_state.idx+1} of {total}")
-
-    # Derive output name from the uploaded file + user
-    uploaded_name = st.session_state.get("input_filename", "pairs.json")
-    user_name = st.session_state.get("user_name")  # from your login step
-    out_name = _compose_output_filename(uploaded_name, user_name)
-
-    # Cache once
-    if "results_file_name" not in st.session_state or not st.session_state.results_file_name:
-        st.session_state.results_file_name = out_name
-    # NEW: save JSON on every page
-    save_progress_ui_json(key_suffix=f"run_{st.session_state.pair_counter}")
-    
-
-    pX = pair["patient_x"]
-    pY = pair["patient_y"]
-
-    cat_order, per_cat_master = build_pair_recs_alignment_plan(pX, pY)
-    current_choice = st.session_state.get(k_sel)
-
-    card_x = patient_card_html("Patient X", pX, current_choice == "Patient X", side="left",
-                            category_order=cat_order, per_category_master=per_cat_master)
-    card_y = patient_card_html("Patient Y", pY, current_choice == "Patient Y", side="right",
-                            category_order=cat_order, per_category_master=per_cat_master)
-
-    st.markdown(f'<div class="pair-grid">{card_x}{card_y}</div>', unsafe_allow_html=True)
-  
-    st.markdown("")
-
-    CONF_LABELS = {
-        5: "5 - completely sure",
-        4: "4 - almost",
-        3: "3 - fairly",
-        2: "2 - slightly",
-        1: "1 - not sure, chose because I had to",
-    }
-
-    st.radio("Choose one:", ["Patient X", "Patient Y"], index=None, horizontal=True, key=k_sel)
-
-
-    st.markdown("#### How sure are you?")
-    st.radio(
-        "On a scale of 1–5:",
-        options=[5, 4, 3, 2, 1],          # values are INTs, shown top→bottom as 5→1
-        format_func=lambda x: CONF_LABELS[x],
-        index=None,
-        horizontal=False,
-        key=k_conf,                        # keep your per-pair key
-    )
-
-    choice = st.session_state.get(k_sel)   # "Patient X" | "Patient Y"
-    conf   = st.session_state.get(k_conf)  # int 1..5
-
-    can_submit = (choice is not None) and (conf is not None)
-    if st.button("Submit", type="primary"):
-        choice = st.session_state.get(k_sel, None)
-        conf   = st.session_state.get(k_conf, None)
-
-        # hard validation
-        if choice not in ("Patient X", "Patient Y"):
-            st.warning("Please choose Patient X or Patient Y before submitting.")
-            st.stop()
-        if conf not in (1, 2, 3, 4, 5):
-            st.warning("Please choose a confidence between 1–5.")
-            st.stop()
-
-        a, b = pair["a"], pair["b"]
-        if choice == "Patient X":
-            chosen_id, other_id = pair["patient_x"]["id"], pair["patient_y"]["id"]
-        elif choice == "Patient Y":
-            chosen_id, other_id = pair["patient_y"]["id"], pair["patient_x"]["id"]
-
-        if   (chosen_id, other_id) == (a, b): out_pair = (a, b)
-        elif (chosen_id, other_id) == (b, a): out_pair = (b, a)
-        else:                                 out_pair = (chosen_id, other_id)
-
-        st.session_state.results[st.session_state.idx] = (out_pair, int(conf))
-        st.session_state.idx += 1
-        st.session_state.pair_counter += 1
-        # --- NEW: autosave snapshot to Supabase ---
-        try:
-            snapshot = _build_results_payload()
-            sb_save_snapshot(
-                user_name=st.session_state.user_name,
-                pair_file=st.session_state.input_filename,
-                snapshot=snapshot,
-            )
-        except Exception as e:
-            st.warning(f"Autosave failed (server): {e}")
-
-        st.rerun()
-
-    st.divider()
-
-elif st.session_state.stage == "done":
-# Build the payload you save (you currently save just the results list)
-    results: List[Tuple[Tuple[int,int], int]] = [r for r in st.session_state.results if r is not None]
-    payload = results  # or switch to _build_results_payload() if you prefer
-
-    # Derive output name from the uploaded file + user
-    uploaded_name = st.session_state.get("input_filename", "pairs.json")
-    user_name = st.session_state.get("user_name")  # from your login step
-    out_name = _compose_output_filename(uploaded_name, user_name)
-
-    # Cache once
-    if "results_file_name" not in st.session_state or not st.session_state.results_file_name:
-        st.session_state.results_file_name = out_name
-
-    if "results_bytes" not in st.session_state or not st.session_state.results_bytes:
-        st.session_state.results_bytes = json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
-
-
-    file_name = st.session_state.results_file_name
-    results_bytes = st.session_state.results_bytes  # guaranteed bytes, not None
-
-    if st.session_state.get("just_finished", False) and not hasattr(st, "dialog"):
-        st.warning("All pairs completed — please click **Download results** now to save your work. "
-                   "If you leave or refresh without downloading, your results will be lost.")
-        st.session_state.just_finished = False
-
-    # ---- Page content ----
-
+        c1= st.columns([1])
+        if st.button("Start", type="primary"):
+            st.session_state.stage = "running"
+            st.rerun()
 
-    # Inline download button (separate key). This also flips the same flag.
-    st.write(f"Completed pairs: {len(results)}")
+    elif st.session_state.stage == "running":
+        # st.markdown("For the pairs below, choose which patiets should be prioritized for proactive intervention (higher on the C-Pi focus list)")
+    # Top row with a right-aligned help button
+        left_spacer, right_btn = st.columns([1, 0.2])
+        with right_btn:
+            if hasattr(st, "dialog"):
+                if st.button("❓ Instructions", key=f"help_{st.session_state.pair_counter}"):
+                    _open_instructions_dialog()
+            else:
+                # Fallback if st.dialog isn’t available: use a popover
+                with st.popover("❓ Instructions", use_container_width=True):
+                    _instructions_body()
+
+        st.markdown("#### Which patient should be prioritized for proactive intervention?")
+        _pair_panel()
+
+    elif st.session_state.stage == "done":
+        # make sure the last answers reached the server before offering the download
+        writer = st.session_state.get("autosave_writer")
+        if writer is not None and AUTOSAVE_MODE == "delta" and st.session_state.get("answers_since_compact"):
+            # fold the round's trailing deltas into the snapshot so a resume is a single read
+            writer.submit({**_build_results_payload(), "delta_seq": int(st.session_state.delta_seq)})
+            st.session_state.answers_since_compact = 0
+        if writer is not None and not writer.flush(timeout=10.0):
+            st.warning(f"Could not save your final progress to the server ({_autosave_status_text()}). "
+                       "Please download your results below.")
+
+    # What the download holds: just the results list, or the snapshot form, which also lists the inferred pairs
+        results: List[Tuple[Tuple[int,int], int]] = [r for r in st.session_state.results if r is not None]
+        as_snapshot = st.session_state.get("transitive_skipper") is not None
+
+        # Derive output name from the uploaded file + user
+        uploaded_name = st.session_state.get("input_filename", "pairs.json")
+        user_name = st.session_state.get("user_name")  # from your login step
+        out_name = _compose_output_filename(uploaded_name, user_name)
+
+        # Cache once
+        if "results_file_name" not in st.session_state or not st.session_state.results_file_name:
+            st.session_state.results_file_name = out_name
+
+        file_name = st.session_state.results_file_name
+
+        if st.session_state.get("just_finished", False) and not hasattr(st, "dialog"):
+            st.warning("All pairs completed — please click **Download results** now to save your work. "
+                       "If you leave or refresh without downloading, your results will be lost.")
+            st.session_state.just_finished = False
+
+        # ---- Page content ----
+
+
+        # Inline download button (separate key). This also flips the same flag.
+        st.write(f"Completed pairs: {len(results)}")
+
+        # encoded (chunk by chunk, see export.py) only when the button is clicked
+        export_fmt = st.radio("File format", list(EXPORT_FORMATS), format_func=lambda f: EXPORT_FORMATS[f].label,
+                              horizontal=True, key="export_format")
+        clicked_inline = st.download_button(
+            "⬇️ Download results",
+            data=_deferred_export(export_fmt, snapshot=as_snapshot),
+            file_name=Path(file_name).stem + EXPORT_FORMATS[export_fmt].suffix,
+            mime=EXPORT_FORMATS[export_fmt].mime,
+            key="dl_inline",
+        )
+        if not clicked_inline:
+            st.warning(
+            "IMPORTANT! Click **download results** now to save your work.\n"
+            "If you leave or refresh without downloading, **your results will be lost**.", icon="🚨"
+        )
 
-    clicked_inline = st.download_button(
-        "⬇️ Download results",
-        data=st.session_state.results_bytes,
-        file_name=st.session_state.results_file_name,
-        mime="application/json",
-        key="dl_inline",
-    )
-    if not clicked_inline:
-        st.warning(
-        "IMPORTANT! Click **download results** now to save your work.\n"
-        "If you leave or refresh without downloading, **your results will be lost**.", icon="🚨"
-    )
+        if clicked_inline:
+            st.session_state.results_downloaded = True
+            st.success("All pairs completed and downloaded. Great work!")
 
-    if clicked_inline:
-        st.session_state.results_downloaded = True
-        st.success("All pairs completed and downloaded. Great work!")
+        st.divider()
 
-    st.divider()
+        # Gate the restart button on the flag
+        if not st.session_state.results_downloaded:
+            st.info("Please download your results to enable starting a new session.")
 
-    # Gate the restart button on the flag
-    if not st.session_state.results_downloaded:
-        st.info("Please download your results to enable starting a new session.")
-
-    if st.button("Start a new session", type="primary",
-                disabled=not st.session_state.results_downloaded,
-                key="restart_btn"):
-        # reset for a fresh run
-        st.session_state.stage = "upload"
-        st.session_state.idx = 0
-        st.session_state.pair_counter = 0
-        st.session_state.results_downloaded = False
-        st.session_state.pop("results_bytes", None)
-        st.session_state.pop("results_file_name", None)
-        st.rerun()  # force rerun so the UI switches immediately
+        if st.button("Start a new session", type="primary",
+                    disabled=not st.session_state.results_downloaded,
+                    key="restart_btn"):
+            # reset for a fresh run
+            st.session_state.stage = "upload"
+            st.session_state.idx = 0
+            st.session_state.pair_counter = 0
+            st.session_state.results_downloaded = False
+            st.session_state.pop("results_file_name", None)
+            st.rerun()  # force rerun so the UI switches immediately
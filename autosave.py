@@ -0,0 +1,295 @@
+"""
+Write-behind autosave of progress snapshots.
+
+Submit hands the newest snapshot to the session's `SnapshotWriter` and returns
+immediately; a background thread does the network write. Snapshots that pile
+up while a write is in flight are coalesced (only the newest is sent, since
+each one supersedes the previous), failures are retried with exponential
+backoff, and `status()` reports pending / last saved at without blocking.
+The worker thread only lives while there is something to write.
+
+With an `append` callable the writer also carries per-answer deltas: these are
+never coalesced, every queued delta is sent (in order, as one batch) before the
+next snapshot. A delta batch whose retries are exhausted is not dropped: it
+stays queued, the writer reports itself stalled, and the next `submit` retries
+it (ahead of whatever that submit brings).
+
+`GroupCommitWriter` is the process-wide stage behind those per-session writers:
+it collects the writes of all sessions for a short window and commits them as
+one multi-row upsert (plus one multi-row delta append), acknowledging each
+caller once its rows are committed.
+"""
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable
+
+
+@dataclass(frozen=True)
+class AutosaveStatus:
+    pending: bool                 # a snapshot or deltas are queued or being written
+    last_saved_at: datetime | None
+    last_error: str | None        # last failure since the last successful save
+    attempts: int                 # failed attempts for the snapshot in flight
+    stalled: bool = False         # retries exhausted with deltas still queued; the next submit retries them
+    unsaved_deltas: int = 0       # deltas queued or in flight
+
+
+class SnapshotWriter:
+    def __init__(self, save: Callable[[dict], None], base_delay: float = 0.5,
+                 max_delay: float = 30.0, max_attempts: int = 8,
+                 append: Callable[[list[dict]], None] | None = None):
+        self._save = save
+        self._append = append
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._max_attempts = max_attempts
+
+        self._cond = threading.Condition()
+        self._pending: dict | None = None
+        self._deltas: list[dict] = []
+        self._in_flight: list[dict] | None = None  # the delta batch being written ([] for a snapshot)
+        self._stalled = False
+        self._thread: threading.Thread | None = None
+        self._last_saved_at: datetime | None = None
+        self._last_error: str | None = None
+        self._attempts = 0
+
+    def submit(self, snapshot: dict | None = None, deltas: list[dict] = ()) -> None:
+        """
+        Queue `snapshot` (replacing any not-yet-written one) and/or append
+        `deltas` to the delta queue. Never blocks on I/O.
+        """
+        if deltas and self._append is None:
+            raise ValueError("this writer was created without an append callable")
+        with self._cond:
+            if snapshot is not None:
+                self._pending = snapshot
+            self._deltas.extend(deltas)
+            self._stalled = False
+            self._cond.notify_all()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="autosave", daemon=True)
+                self._thread.start()
+
+    def status(self) -> AutosaveStatus:
+        with self._cond:
+            return AutosaveStatus(
+                pending=self._pending is not None or bool(self._deltas) or self._in_flight is not None,
+                last_saved_at=self._last_saved_at,
+                last_error=self._last_error,
+                attempts=self._attempts,
+                stalled=self._stalled,
+                unsaved_deltas=len(self._deltas) + len(self._in_flight or ()),
+            )
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait until everything submitted so far is written (or given up). True if nothing is left pending."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._pending is not None or self._deltas or self._in_flight is not None) and not self._stalled:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return self._last_error is None and not self._stalled
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if (self._pending is None and not self._deltas) or self._stalled:
+                    self._thread = None
+                    return
+                deltas, self._deltas = self._deltas, []
+                snapshot = None if deltas else self._pending  # deltas go out first
+                if snapshot is not None:
+                    self._pending = None
+                self._in_flight = deltas
+            try:
+                if deltas:
+                    self._append(deltas)
+                else:
+                    self._save(snapshot)
+            except Exception as e:
+                with self._cond:
+                    self._attempts += 1
+                    self._last_error = str(e) or type(e).__name__
+                    gave_up = self._attempts >= self._max_attempts
+                    if deltas:
+                        self._deltas[:0] = deltas  # keep order ahead of anything queued meanwhile
+                        self._stalled = gave_up    # never dropped: held until the next submit
+                    elif not gave_up and self._pending is None:
+                        self._pending = snapshot  # retry it, unless a newer one already replaced it
+                    delay = min(self._max_delay, self._base_delay * 2 ** (self._attempts - 1))
+                    if gave_up:
+                        self._attempts = 0
+                    self._in_flight = None
+                    self._cond.notify_all()
+                    if not gave_up:
+                        # backoff; a deadline loop, so the notify of every new submit doesn't cut it short
+                        deadline = time.monotonic() + delay
+                        while (remaining := deadline - time.monotonic()) > 0:
+                            self._cond.wait(remaining)
+            else:
+                with self._cond:
+                    self._last_saved_at = datetime.now(timezone.utc)
+                    self._last_error = None
+                    self._attempts = 0
+                    self._in_flight = None
+                    self._cond.notify_all()
+
+
+class GroupCommitBusy(RuntimeError):
+    """The shared commit queue is full; the caller should back off and retry."""
+
+
+@dataclass(frozen=True)
+class GroupCommitStats:
+    queue_length: int             # snapshot keys + delta batches waiting for the next commit
+    batches: int                  # commits done so far
+    rows: int                     # snapshot + delta rows committed so far
+    last_batch_size: int
+    max_batch_size: int
+    errors: int                   # commits that raised
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.rows / self.batches if self.batches else 0.0
+
+
+class GroupCommitWriter:
+    """
+    Shared by every session of the process (see `st.cache_resource` in app.py).
+    `save_snapshot` / `append_deltas` have the store's signatures, so it can
+    stand in for the store in a session's SnapshotWriter; they block the
+    calling (background) thread until the batch holding their rows commits and
+    re-raise that batch's error, so per-session retries and status still work.
+
+    The first write into an empty queue opens a `window`-second batch; the
+    batch is cut early once it holds `max_batch` rows. Snapshots are coalesced
+    per (user_name, pair_file): a newer one replaces a queued one and both
+    callers are acknowledged by the single upsert. At most `max_queue` writes
+    wait at once; beyond that callers get GroupCommitBusy after `timeout`.
+    """
+
+    def __init__(self, store, window: float = 0.05, max_batch: int = 500, max_queue: int = 5000):
+        self._store = store
+        self._window = window
+        self._max_batch = max_batch
+        self._max_queue = max_queue
+
+        self._cond = threading.Condition()
+        self._snapshots: dict[tuple[str, str], tuple[dict, list[Future]]] = {}
+        self._deltas: list[tuple[list[dict], Future]] = []
+        self._opened_at: float | None = None
+        self._thread: threading.Thread | None = None
+
+        self._batches = self._rows = self._last_batch = self._max_seen = self._errors = 0
+
+    def _queue_length(self) -> int:
+        return len(self._snapshots) + len(self._deltas)
+
+    def _enqueue(self, add, timeout: float) -> Future:
+        fut: Future = Future()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._queue_length() >= self._max_queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise GroupCommitBusy(f"commit queue full ({self._max_queue} writes waiting)")
+                self._cond.wait(remaining)
+            add(fut)
+            if self._opened_at is None:
+                self._opened_at = time.monotonic()
+            self._cond.notify_all()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+        return fut
+
+    def save_snapshot(self, user_name: str, pair_file: str, snapshot: dict, timeout: float = 30.0) -> None:
+        key = (user_name, pair_file)
+
+        def add(fut):
+            prev = self._snapshots.pop(key, None)  # re-insert so the key keeps its newest position
+            self._snapshots[key] = (snapshot, (prev[1] if prev else []) + [fut])
+
+        self._enqueue(add, timeout).result(timeout)
+
+    def append_deltas(self, rows: list[dict], timeout: float = 30.0) -> None:
+        if rows:
+            self._enqueue(lambda fut: self._deltas.append((list(rows), fut)), timeout).result(timeout)
+
+    def stats(self) -> GroupCommitStats:
+        with self._cond:
+            return GroupCommitStats(
+                queue_length=self._queue_length(),
+                batches=self._batches,
+                rows=self._rows,
+                last_batch_size=self._last_batch,
+                max_batch_size=self._max_seen,
+                errors=self._errors,
+            )
+
+    def _take_batch(self):
+        snapshots, deltas, n = [], [], 0
+        while self._snapshots and n < self._max_batch:
+            key = next(iter(self._snapshots))
+            snapshot, futs = self._snapshots.pop(key)
+            snapshots.append((key, snapshot, futs))
+            n += 1
+        while self._deltas and (n == 0 or n + len(self._deltas[0][0]) <= self._max_batch):
+            rows, fut = self._deltas.pop(0)
+            deltas.append((rows, fut))
+            n += len(rows)
+        self._opened_at = time.monotonic() if self._queue_length() else None
+        return snapshots, deltas, n
+
+    def _rows_waiting(self) -> int:
+        return len(self._snapshots) + sum(len(rows) for rows, _ in self._deltas)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._queue_length():
+                    self._thread = None
+                    return
+                while self._rows_waiting() < self._max_batch:
+                    remaining = self._opened_at + self._window - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                snapshots, deltas, n = self._take_batch()
+                self._cond.notify_all()  # room in the queue again
+
+            failed = False
+            if snapshots:
+                failed |= self._commit(
+                    lambda: self._store.save_snapshots([(u, f, snap) for (u, f), snap, _ in snapshots]),
+                    [fut for _, _, futs in snapshots for fut in futs],
+                )
+            if deltas:
+                failed |= self._commit(
+                    lambda: self._store.append_deltas([row for rows, _ in deltas for row in rows]),
+                    [fut for _, fut in deltas],
+                )
+            with self._cond:
+                self._batches += 1
+                self._rows += n
+                self._last_batch = n
+                self._max_seen = max(self._max_seen, n)
+                self._errors += failed
+
+    @staticmethod
+    def _commit(write, futures: list[Future]) -> bool:
+        try:
+            write()
+        except Exception as e:
+            for fut in futures:
+                fut.set_exception(e)
+            return True
+        for fut in futures:
+            fut.set_result(None)
+        return False
@@ -0,0 +1,90 @@
+"""
+Consensus over a directory of rater downloads in every export format.
+
+Simulates --raters raters answering overlapping pairs of a shared pairs file
+(hidden Bradley–Terry skills) and writes their downloads twice: once all as
+`<rater>_<pairs>_ranked.json`, once round-robin as .json, .json.gz, .csv and
+.parquet (export.py). Times consensus.run on both directories and checks that
+the mixed one yields the same raters, answers and Fleiss' κ; exits with
+status 1 when it does not.
+
+    python -m benchmarks.bench_consensus [--raters 40] [--pairs 2000] [--answers 1500] [--workers 0]
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from consensus import run
+from export import FORMATS, export_results
+
+
+def _downloads(raters: int, n_pairs: int, answers: int, rng) -> dict[str, list]:
+    """rater name -> results list ([[winner, loser], conf]) over a shared pool of pairs."""
+    skill = rng.normal(0.0, 1.5, 4 * n_pairs)
+    a = rng.integers(0, len(skill), n_pairs)
+    b = (a + rng.integers(1, len(skill), n_pairs)) % len(skill)
+    out = {}
+    for r in range(raters):
+        idx = rng.choice(n_pairs, size=min(answers, n_pairs), replace=False)
+        a_won = rng.random(len(idx)) < 1.0 / (1.0 + np.exp(skill[b[idx]] - skill[a[idx]]))
+        win, lose = np.where(a_won, a[idx], b[idx]) + 1, np.where(a_won, b[idx], a[idx]) + 1
+        conf = rng.integers(1, 6, len(idx))
+        out[f"rater{r:03d}"] = [[[int(w), int(l)], int(c)] for w, l, c in zip(win, lose, conf)]
+    return out
+
+
+def _write(root: Path, downloads: dict[str, list], formats: list[str]) -> None:
+    root.mkdir(parents=True)
+    for k, (name, results) in enumerate(downloads.items()):
+        fmt = formats[k % len(formats)]
+        (root / f"{name}_bench_pairs_ranked{FORMATS[fmt].suffix}").write_bytes(
+            export_results(results, fmt).getvalue())
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--raters", type=int, default=40)
+    ap.add_argument("--pairs", type=int, default=2000, help="pairs in the shared pairs file")
+    ap.add_argument("--answers", type=int, default=1500, help="pairs answered per rater")
+    ap.add_argument("--workers", type=int, default=0, help="consensus.run workers (0 = no pool)")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    downloads = _downloads(args.raters, args.pairs, args.answers, np.random.default_rng(args.seed))
+    summaries = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, formats in (("json", ["json"]), ("mixed", list(FORMATS))):
+            root = Path(tmp) / label
+            _write(root, downloads, formats)
+            t = time.perf_counter()
+            summaries[label] = run(root, workers=args.workers)
+            print(f"{label:6} {len(list(root.iterdir())):>5} files  {time.perf_counter() - t:>7.2f} s")
+
+    json_, mixed = summaries["json"], summaries["mixed"]
+    problems = []
+    for label, tables in summaries.items():
+        if len(tables["errors"]):
+            problems.append(f"{label}: unreadable files: {tables['errors']['error'].tolist()[:3]}")
+    cols = ["rater", "answers", "consensus_agreement"]
+    if not json_["raters"][cols].sort_values("rater").reset_index(drop=True).equals(
+            mixed["raters"][cols].sort_values("rater").reset_index(drop=True)):
+        problems.append("per-rater table differs")
+    for col in ("raters", "answers", "fleiss_kappa", "weighted_fleiss_kappa"):
+        a, b = json_["overall"][col].iloc[0], mixed["overall"][col].iloc[0]
+        if not np.isclose(a, b, equal_nan=True):
+            problems.append(f"{col}: json {a} vs mixed {b}")
+
+    o = json_["overall"].to_dict("records")[0]
+    print(f"raters={o['raters']} answers={o['answers']:,} fleiss_kappa={o['fleiss_kappa']:.4f}")
+    if problems:
+        print("mixed-format directory differs from the all-JSON one:\n  " + "\n  ".join(problems))
+        sys.exit(1)
+    print("mixed-format directory matches the all-JSON one")
+
+
+if __name__ == "__main__":
+    main()
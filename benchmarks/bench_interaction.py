@@ -0,0 +1,84 @@
+"""
+Server CPU time and bytes sent per running-stage interaction, on a real server.
+
+Runs `streamlit run app.py` (sqlite progress backend in a temp dir) and one
+rater over the websocket protocol (see benchmarks/loadtest.py): login, upload,
+then --answers pairs. For every interaction of the running stage, i.e.
+choosing Patient X/Y, choosing a confidence and Submit, it records the server
+process' CPU time and the bytes of the ForwardMsgs it sent, with the browser's
+message cache simulated (cached_message_hashes reported back). CPU time comes
+in clock ticks (usually 10 ms), so only its mean over many answers is shown.
+
+    python -m benchmarks.bench_interaction [--answers 100] [--port 8598]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from benchmarks.loadtest import APP_PATH, Rater, StreamlitServer
+
+STEPS = ("choose patient", "choose confidence", "submit")
+
+
+async def _session(server: StreamlitServer, pairs_file: bytes, answers: int) -> dict[str, list[tuple[float, int]]]:
+    r = Rater(f"127.0.0.1:{server.port}")
+    out = {step: [] for step in STEPS}
+
+    async def measure(step, action):
+        cpu, sent = server.cpu_seconds(), r.bytes_received
+        await action
+        out[step].append((server.cpu_seconds() - cpu, r.bytes_received - sent))
+
+    await r.connect()
+    try:
+        async with httpx.AsyncClient(timeout=60) as http:
+            await r.type_text("Your full name in English (required)", "Bench Rater")
+            await r.click("Continue")
+            await r.upload("Pairs for ranking (JSON file)", "bench_pairs.json", pairs_file, http)
+        await r.click("Start")
+        await r.click("Start")
+        for i in range(answers):
+            await measure("choose patient", r.choose("Choose one:", "Patient X" if i % 2 else "Patient Y"))
+            await measure("choose confidence", r.choose("On a scale of 1–5:", "4 - almost"))
+            await measure("submit", r.click("Submit"))
+            if not r.has("Submit"):
+                break
+    finally:
+        await r.close()
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--answers", type=int, default=100)
+    ap.add_argument("--port", type=int, default=8598)
+    args = ap.parse_args(argv)
+
+    sys.path.insert(0, str(APP_PATH.parent))
+    from pairgen import generate_pairs
+    from pairs_io import write_pairs_json
+    from patient_data import PATIENT_DF_PATH, load_patient_df_from_repo
+
+    pairs = generate_pairs(load_patient_df_from_repo(PATIENT_DF_PATH), 2)
+    with tempfile.TemporaryDirectory() as tmp:
+        write_pairs_json(Path(tmp) / "pairs.json", np.column_stack([pairs.a, pairs.b])[: args.answers + 1])
+        pairs_file = (Path(tmp) / "pairs.json").read_bytes()
+        env = {"PROGRESS_BACKEND": "sqlite", "PROGRESS_SQLITE_PATH": str(Path(tmp) / "progress.sqlite3")}
+        with StreamlitServer(env, None, args.port) as server:
+            out = asyncio.run(_session(server, pairs_file, args.answers))
+
+    print(f"{'interaction':20}{'n':>5}{'CPU ms mean':>13}{'bytes p50':>11}{'bytes max':>11}")
+    for step, rows in out.items():
+        cpu = np.asarray([c for c, _ in rows]) * 1e3
+        sent = np.asarray([b for _, b in rows])
+        print(f"{step:20}{len(rows):>5}{cpu.mean():>13.1f}{int(np.median(sent)):>11,}{int(sent.max()):>11,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Per-session memory of the prepared pairs: the old eager list of per-pair
+patient dicts vs. PreparedPairs with interned PatientRecords.
+
+"after (all touched)" walks every pair once, i.e. the worst case where a rater
+finished the whole round and every patient record has been materialized.
+
+    python -m benchmarks.bench_memory [--pairs 5000] [--seed 0]
+"""
+import argparse
+import random
+import tracemalloc
+
+import numpy as np
+
+from pairs import PreparedPairs
+from patient_data import PATIENT_DF_PATH, load_patient_df_from_repo
+from recs import recs_from_row
+
+
+def _legacy_prepare(df, pairs):
+    """What Start used to keep in session: one full patient dict copy per pair side."""
+    by_id = df.set_index("patient_num").to_dict("index")
+
+    def as_dict(row):
+        return {
+            "id": int(row["patient_num"]), "age": int(row["age"]), "risk": int(row["risk"]),
+            "risk_percentile": int(row["risk_percentile"]), "sex": int(row["sex"]),
+            "bmi": float(row["bmi"]), "adherence": str(row["adherence"]),
+            "smoker": int(row["smoker"]), "socio_economic": int(row["socio_economic"]),
+            "recommendations": recs_from_row(row),
+        }
+
+    rng = random.Random(42)
+    prepared = []
+    for a, b in pairs:
+        a_dict = as_dict({**by_id[a], "patient_num": a})
+        b_dict = as_dict({**by_id[b], "patient_num": b})
+        x, y = (a_dict, b_dict) if rng.random() < 0.5 else (b_dict, a_dict)
+        prepared.append({"a": a, "b": b, "patient_x": x, "patient_y": y})
+    return prepared
+
+
+def _measure(fn):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = fn()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return obj, retained
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--pairs", type=int, default=5000)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    df = load_patient_df_from_repo(PATIENT_DF_PATH)
+    ids = df["patient_num"].to_numpy()
+    rng = np.random.default_rng(args.seed)
+    ab = rng.choice(ids, size=(args.pairs, 2))
+    pairs = [(int(a), int(b)) for a, b in ab if a != b]
+
+    _, legacy = _measure(lambda: _legacy_prepare(df, pairs))
+
+    def lazy_all():
+        pp = PreparedPairs(df, pairs)
+        for i in range(len(pp)):
+            pp[i]
+        return pp
+
+    # warm the process-wide caches (mask -> DLs, mask pair -> plan) so only per-session bytes are counted
+    lazy_all()
+    _, lazy = _measure(lambda: PreparedPairs(df, pairs))
+    _, lazy_touched = _measure(lazy_all)
+
+    print(f"patients={len(df)} pairs={len(pairs)}")
+    print(f"{'':24}{'bytes':>12}{'bytes/pair':>12}")
+    for name, n in (("before (eager dicts)", legacy), ("after (at Start)", lazy), ("after (all touched)", lazy_touched)):
+        print(f"{name:24}{n:>12,}{n / len(pairs):>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
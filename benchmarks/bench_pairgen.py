@@ -0,0 +1,51 @@
+"""
+Pair generation for a synthetic cohort: time to build the pairs and to write
+them as JSON and as .pairs, plus the coverage checks of the result.
+
+    python -m benchmarks.bench_pairgen [--patients 100000] [--pairs 1000000] [--seed 0]
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from pairgen import coverage, generate_pairs, write_pairs
+
+
+def _cohort(n: int, rng: np.random.Generator) -> pd.DataFrame:
+    return pd.DataFrame({
+        "patient_num": np.arange(1, n + 1),
+        "age": rng.integers(30, 90, n),
+        "risk_percentile": rng.integers(0, 101, n),
+        "sex": rng.integers(0, 2, n),
+    })
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--patients", type=int, default=100_000)
+    ap.add_argument("--pairs", type=int, default=1_000_000)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    df = _cohort(args.patients, np.random.default_rng(args.seed))
+    k = max(1, 2 * args.pairs // args.patients)
+    t = time.perf_counter()
+    pairs = generate_pairs(df, k, seed=args.seed)
+    print(f"patients={args.patients} k={k} pairs={len(pairs)}")
+    print(f"{'generate':12}{time.perf_counter() - t:>8.2f}s")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ("pairs.json", "pairs.pairs"):
+            dest = Path(tmp) / name
+            t = time.perf_counter()
+            write_pairs(dest, pairs)
+            print(f"{name:12}{time.perf_counter() - t:>8.2f}s{dest.stat().st_size / 1e6:>8.1f} MB")
+    for key, value in coverage(df, pairs).items():
+        print(f"  {key:16} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Reading a large pairs file: the old whole-file json.loads + list of tuples vs.
+the streaming JSON parser into int32 columns vs. the binary .pairs format
+(viewed in place, checksum verified). Reports wall time and peak traced memory
+(tracemalloc slows everything down, so times are measured in a separate run).
+
+The parser checks run first: the streaming parser against PARSER_CASES (what
+json.load plus int() accepted, and where bad input must be reported), with a
+tiny and the default chunk size. A failing check exits with status 1.
+
+    python -m benchmarks.bench_pairs_io [--pairs 2000000] [--seed 0] [--check-only]
+"""
+import argparse
+import io
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+from pairs_io import PairsFormatError, parse_pairs_json, read_pairs, write_pairs_bin
+
+# input -> the pairs it parses to, or a fragment of the error it must raise
+PARSER_CASES = [
+    (b"[]", []),
+    (b" [ [1, 2] ,\n[3,4] ] ", [[1, 2], [3, 4]]),
+    (b"[[1.0, 2.0], [3, 4.00]]", [[1, 2], [3, 4]]),
+    (b'[["1", "2"]]', [[1, 2]]),
+    (b"[[1, 2],]", "Trailing comma before the closing bracket at byte 8"),
+    (b"[[1, 2] , ]", "Trailing comma before the closing bracket at byte 10"),
+    (b"[[1, 2]", "Unexpected end of file at byte 7"),
+    (b"[[1, 2], [3", "Unexpected end of file at byte 11"),
+    (b"[[1, 2],", "Unexpected end of file at byte 8"),
+    (b"[[1.5, 2]]", "Invalid pair entry at byte 1"),
+    (b"[[1, 2],\n [3, x]]", "Invalid pair entry at byte 10 (line 2)"),
+    (b"[[1, 2, 3]]", "Invalid pair entry at byte 1"),
+    (b"[[1, 99999999999]]", "does not fit in int32"),
+    (b"{}", "Expected a JSON list"),
+]
+
+
+def check_parser() -> list[str]:
+    """The PARSER_CASES that parse_pairs_json gets wrong (with chunks of 3 bytes and the default)."""
+    failures = []
+    for data, expected in PARSER_CASES:
+        for chunk in (3, 1 << 20):
+            try:
+                got = parse_pairs_json(io.BytesIO(data), chunk_bytes=chunk).tolist()
+            except PairsFormatError as e:
+                got = str(e)
+            ok = expected in got if isinstance(expected, str) and isinstance(got, str) else got == expected
+            if not ok:
+                failures.append(f"{data!r} (chunk {chunk}): expected {expected!r}, got {got!r}")
+    return failures
+
+
+def _legacy_read(file):
+    """What read_pairs_file used to do for .json."""
+    data = json.loads(file.read().decode("utf-8"))
+    pairs = []
+    for t in data:
+        if not (isinstance(t, (list, tuple)) and len(t) == 2):
+            raise ValueError(f"Invalid pair entry: {t!r}")
+        a, b = int(t[0]), int(t[1])
+        if a == b:
+            continue
+        pairs.append((a, b))
+    return pairs
+
+
+def _timed(fn, payload: bytes):
+    t = time.perf_counter()
+    out = fn(io.BytesIO(payload))
+    return out, time.perf_counter() - t
+
+
+def _peak(fn, payload: bytes) -> int:
+    tracemalloc.start()
+    fn(io.BytesIO(payload))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--pairs", type=int, default=2_000_000)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--check-only", action="store_true", help="only run the parser checks")
+    args = ap.parse_args(argv)
+
+    failures = check_parser()
+    print(f"parser checks: {len(PARSER_CASES) - len({f.split(' (chunk')[0] for f in failures})}/{len(PARSER_CASES)} ok")
+    if failures:
+        print("  " + "\n  ".join(failures))
+        sys.exit(1)
+    if args.check_only:
+        return
+
+    rng = np.random.default_rng(args.seed)
+    payload = json.dumps(rng.integers(1, 1_000_000, size=(args.pairs, 2)).tolist()).encode()
+    print(f"pairs={args.pairs} file={len(payload) / 1e6:.1f} MB")
+
+    streaming = lambda f: read_pairs(f, "pairs.json")
+    binary = lambda f: read_pairs(f, "pairs.pairs")
+    with tempfile.TemporaryDirectory() as tmp:
+        write_pairs_bin(Path(tmp) / "p.pairs", streaming(io.BytesIO(payload)))
+        binary_payload = (Path(tmp) / "p.pairs").read_bytes()
+
+    print(f"{'':12}{'seconds':>10}{'peak MB':>10}")
+    for name, fn, data in (("before", _legacy_read, payload), ("streaming", streaming, payload),
+                           (".pairs", binary, binary_payload)):
+        _, dt = _timed(fn, data)
+        print(f"{name:12}{dt:>10.2f}{_peak(fn, data) / 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Ranking engines: incremental throughput (answers/s through add()) and the cost
+of a full refit, on a simulated cohort with hidden Bradley–Terry skills.
+Spearman is the rank correlation of the fitted scores with the hidden skills.
+
+    python -m benchmarks.bench_ranking [--patients 1000000] [--answers 5000000] [--incremental 200000]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ranking import MODELS, Comparisons
+
+
+def _simulate(patients: int, answers: int, rng) -> tuple[Comparisons, np.ndarray]:
+    skill = rng.normal(0.0, 1.5, patients)
+    a = rng.integers(0, patients, answers)
+    b = (a + rng.integers(1, patients, answers)) % patients  # never a self-pair
+    a_won = rng.random(answers) < 1.0 / (1.0 + np.exp(skill[b] - skill[a]))
+    win, lose = np.where(a_won, a, b), np.where(a_won, b, a)
+    conf = rng.integers(1, 6, answers).astype(np.int8)
+    return Comparisons(win.astype(np.int64), lose.astype(np.int64), conf), skill
+
+
+def _spearman(engine, skill) -> float:
+    s = engine.scores()
+    rx = np.argsort(np.argsort(s))
+    ry = np.argsort(np.argsort(skill[engine.ids]))
+    return float(np.corrcoef(rx, ry)[0, 1])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--patients", type=int, default=1_000_000)
+    ap.add_argument("--answers", type=int, default=5_000_000)
+    ap.add_argument("--incremental", type=int, default=200_000, help="answers pushed through add() per model")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    comparisons, skill = _simulate(args.patients, args.answers, np.random.default_rng(args.seed))
+    head = Comparisons(*(getattr(comparisons, f)[: args.incremental] for f in ("winner", "loser", "confidence")))
+    print(f"patients={args.patients:,} answers={args.answers:,}")
+
+    print(f"\nincremental add(), first {len(head):,} answers")
+    print(f"{'model':12}{'answers/s':>12}{'us/answer':>12}")
+    for name, cls in MODELS.items():
+        engine = cls()
+        t = time.perf_counter()
+        engine.extend(head)
+        dt = time.perf_counter() - t
+        print(f"{name:12}{len(head) / dt:>12,.0f}{dt / len(head) * 1e6:>12.2f}")
+
+    print(f"\nfull refit, all {args.answers:,} answers")
+    print(f"{'model':12}{'seconds':>10}{'iters':>8}{'spearman':>10}{'top-100 s':>11}")
+    for name, engine in (("bt-newton", MODELS["bt"](method="newton")), ("bt-mm", MODELS["bt"](method="mm")),
+                         ("elo", MODELS["elo"]()), ("trueskill", MODELS["trueskill"]())):
+        t = time.perf_counter()
+        engine.refit(comparisons)
+        dt = time.perf_counter() - t
+        t = time.perf_counter()
+        engine.priority_order(top=100)
+        order_dt = time.perf_counter() - t
+        iters = getattr(engine, "iterations", "-")
+        print(f"{name:12}{dt:>10.2f}{iters:>8}{_spearman(engine, skill):>10.3f}{order_dt:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
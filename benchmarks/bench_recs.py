@@ -0,0 +1,82 @@
+"""
+Micro-benchmark for the recommendation block of the patient cards.
+
+Builds catalogs whose DL sentences are 1x..1000x the real length and times
+per-card rendering (aligned-plan path and fallback path) against each. The
+render column should stay flat; only the one-off compile cost grows with the
+catalog text.
+
+    python -m benchmarks.bench_recs [--cards 20000]
+"""
+import argparse
+import random
+import time
+
+from recs import (
+    _RAW_REC_MAP,
+    compile_rec_catalog,
+    recs_grouped_html_for_patient,
+)
+
+
+def _padded_map(scale: int) -> dict[str, dict]:
+    """Same catalog with each DL stretched by `scale` (category/main/cost kept findable)."""
+    out = {}
+    for key, meta in _RAW_REC_MAP.items():
+        filler = " lorem ipsum" * (scale - 1)
+        cat, rest = meta["DL"].split(" - ", 1)
+        out[key] = {**meta, "DL": f"{cat} - {filler.strip()} {rest}".replace("  ", " ")}
+    return out
+
+
+def _random_patients(raw_map: dict, n: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    dls = [m["DL"] for m in raw_map.values()]
+    return [{"recommendations": [dl for dl in dls if rng.random() < 0.3]} for _ in range(n)]
+
+
+def _plan_for(raw_map: dict, pX: dict, pY: dict):
+    # same shape as recs.build_pair_recs_alignment_plan, against an arbitrary map
+    order = ["Labs", "Imaging", "Treatment", "Consults", "Lifestyle", "Other"]
+    per_cat: dict[str, list[str]] = {}
+    xs, ys = set(pX["recommendations"]), set(pY["recommendations"])
+    for meta in raw_map.values():
+        dl = meta["DL"]
+        if dl in xs or dl in ys:
+            per_cat.setdefault(meta["category"], []).append(dl)
+    return [c for c in order if c in per_cat], per_cat
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--cards", type=int, default=20000)
+    args = ap.parse_args(argv)
+
+    print(f"{'scale':>6} {'avg DL chars':>13} {'compile ms':>11} {'plan us/card':>13} {'fallback us/card':>17}")
+    for scale in (1, 10, 100, 1000):
+        raw = _padded_map(scale)
+        t0 = time.perf_counter()
+        catalog = compile_rec_catalog(raw)
+        compile_ms = (time.perf_counter() - t0) * 1e3
+
+        pats = _random_patients(raw, 256)
+        plans = [_plan_for(raw, pats[i], pats[-i - 1]) for i in range(len(pats))]
+        n = args.cards
+
+        t0 = time.perf_counter()
+        for i in range(n):
+            j = i & 255
+            recs_grouped_html_for_patient(pats[j], *plans[j], catalog=catalog)
+        plan_us = (time.perf_counter() - t0) / n * 1e6
+
+        t0 = time.perf_counter()
+        for i in range(n):
+            recs_grouped_html_for_patient(pats[i & 255], catalog=catalog)
+        fallback_us = (time.perf_counter() - t0) / n * 1e6
+
+        avg_len = sum(len(m["DL"]) for m in raw.values()) / len(raw)
+        print(f"{scale:>6} {avg_len:>13.0f} {compile_ms:>11.2f} {plan_us:>13.2f} {fallback_us:>17.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Bytes the server sends to the browser per rerun, with a budget per Submit.
+
+Runs the app headless (streamlit.testing AppTest) through login, upload of a
+generated pairs file and --answers Submits, and measures every ForwardMsg the
+script enqueues. A browser-side message cache is simulated the way the
+frontend keeps one: cacheable messages (at least global.minCachedMessageSize,
+set in .streamlit/config.toml) already seen are sent as a hash reference. The
+stylesheet should therefore cost its full size once and a reference after.
+
+Exits with status 1 when a Submit's reruns exceed --budget bytes;
+tests/test_render_payload.py runs the same measurement under pytest.
+
+    python -m benchmarks.bench_render_payload [--answers 20] [--budget 8000]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+APP_PATH = Path(__file__).resolve().parent.parent / "app.py"
+
+
+class _Upload(io.BytesIO):
+    name = "bench_pairs.json"
+
+
+# bytes sent to the browser by the reruns of one Submit (tests/test_render_payload.py asserts it)
+SUBMIT_BUDGET = 8_000
+
+
+@contextmanager
+def _metered():
+    """Wrap ScriptRunContext.enqueue while active; yields (list of sent sizes, list of full sizes, stylesheet sends)."""
+    from streamlit.runtime.forward_msg_cache import create_reference_msg, populate_hash_if_needed
+    from streamlit.runtime.scriptrunner_utils.script_run_context import ScriptRunContext
+
+    sent, full, styles = [], [], []
+    client_cache: set[str] = set()
+    orig = ScriptRunContext.enqueue
+
+    def enqueue(self, msg):
+        populate_hash_if_needed(msg)
+        size = msg.ByteSize()
+        full.append(size)
+        if msg.metadata.cacheable and msg.hash in client_cache:
+            size = create_reference_msg(msg).ByteSize()
+        elif msg.metadata.cacheable:
+            client_cache.add(msg.hash)
+        sent.append(size)
+        if msg.WhichOneof("type") == "delta" and str(msg.delta.new_element.markdown.body).startswith("<style>:root"):
+            styles.append(size)
+        return orig(self, msg)
+
+    ScriptRunContext.enqueue = enqueue
+    try:
+        yield sent, full, styles
+    finally:
+        ScriptRunContext.enqueue = orig
+
+
+def measure(answers: int, tmp: Path) -> dict[str, list[int]]:
+    """
+    Drive app.py through login, upload, Start and up to `answers` Submits and
+    return the bytes sent per step: "first" (the first page), "per_click" (radio
+    changes), "per_submit", "per_submit_uncached" (without the message cache)
+    and "styles" (every stylesheet send). The progress backend comes from the
+    environment and .streamlit/config.toml from the working directory.
+    """
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    from pairgen import generate_pairs, write_pairs
+    from patient_data import PATIENT_DF_PATH, load_patient_df_from_repo
+
+    pairs_path = tmp / "pairs.json"
+    write_pairs(pairs_path, generate_pairs(load_patient_df_from_repo(PATIENT_DF_PATH), 4))
+    upload = _Upload(pairs_path.read_bytes())
+    file_uploader = st.file_uploader
+    st.file_uploader = lambda label, *a, key=None, **kw: upload if key is None else None
+    try:
+        with _metered() as (sent, full, styles):
+            at = AppTest.from_file(str(APP_PATH), default_timeout=60)
+
+            def step(action) -> tuple[int, int]:
+                s0, f0 = len(sent), len(full)
+                action()
+                return sum(sent[s0:]), sum(full[f0:])
+
+            first, _ = step(at.run)
+            step(lambda: at.text_input[0].input("Bench User").run())
+            step(lambda: at.button[0].click().run())
+            for _ in range(2):
+                step(lambda: [b for b in at.button if b.label == "Start"][0].click().run())
+
+            per_submit, per_submit_uncached, per_click = [], [], []
+            for i in range(answers):
+                if at.session_state.stage != "running":
+                    break
+                per_click.append(step(lambda: at.radio[0].set_value("Patient X" if i % 2 else "Patient Y").run())[0])
+                per_click.append(step(lambda: at.radio[1].set_value(4).run())[0])
+                sent_b, full_b = step(lambda: [b for b in at.button if b.label == "Submit"][0].click().run())
+                per_submit.append(sent_b)
+                per_submit_uncached.append(full_b)
+    finally:
+        st.file_uploader = file_uploader
+    return {"first": [first], "per_click": per_click, "per_submit": per_submit,
+            "per_submit_uncached": per_submit_uncached, "styles": list(styles)}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--answers", type=int, default=20)
+    ap.add_argument("--budget", type=int, default=SUBMIT_BUDGET, help="max bytes sent per Submit")
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault("PROGRESS_BACKEND", "sqlite")
+    os.environ.setdefault("PROGRESS_SQLITE_PATH", str(Path(tmp) / "progress.sqlite3"))
+    os.chdir(APP_PATH.parent)  # .streamlit/config.toml is read from the working directory
+    sys.path.insert(0, str(APP_PATH.parent))
+
+    m = measure(args.answers, Path(tmp))
+    ms, styles = np.asarray(m["per_submit"]), m["styles"]
+    print(f"first page       {m['first'][0]:>8,} B")
+    print(f"stylesheet       sent {sum(s > 200 for s in styles)}x in full, {sum(s <= 200 for s in styles)}x as a reference")
+    print(f"per radio click  p50 {int(np.median(m['per_click'])):>7,} B")
+    print(f"per Submit       p50 {int(np.median(ms)):>7,} B  max {int(ms.max()):>7,} B  "
+          f"(without the message cache: p50 {int(np.median(m['per_submit_uncached'])):,} B)")
+    print(f"budget           {args.budget:>8,} B per Submit")
+    if ms.max() > args.budget:
+        print("OVER BUDGET")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Resident memory of one app.py server as the number of concurrent sessions grows.
+
+Runs `streamlit run app.py` (sqlite progress backend in a temp dir) on a
+synthetic cohort of --patients rows (patient_df.csv tiled, see
+benchmarks/suite.py) and opens sessions over the websocket protocol (see
+benchmarks/loadtest.py), --concurrency at a time, up to every N in --sessions.
+Each session logs in, uploads its own pairs file, presses Start twice and
+answers --answers pairs, then stays connected, so its session state stays on
+the server. The server's RSS is read from /proc after every level.
+
+With the patient table held once per process (patient_store.py), the growth
+per session is only the session's own pairs, results and widget state.
+
+    python -m benchmarks.bench_session_memory [--patients 200000] [--sessions 1,10,50,100,200]
+        [--pairs 200] [--answers 2] [--concurrency 8] [--port 8599]
+"""
+import argparse
+import asyncio
+import sys
+import tempfile
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from benchmarks.loadtest import APP_PATH, Rater, StreamlitServer, _ints
+from benchmarks.suite import synthetic_cohort, synthetic_pairs
+
+
+async def _open_session(n: int, base: str, pairs_file: bytes, answers: int, http: httpx.AsyncClient) -> Rater:
+    r = Rater(base)
+    await r.connect()
+    await r.type_text("Your full name in English (required)", f"Memory Rater {n}")
+    await r.click("Continue")
+    await r.upload("Pairs for ranking (JSON file)", "memory_pairs.json", pairs_file, http)
+    await r.click("Start")   # upload -> explain
+    await r.click("Start")   # explain -> running
+    for i in range(answers):
+        await r.choose("Choose one:", "Patient X" if i % 2 else "Patient Y")
+        await r.choose("On a scale of 1–5:", "4 - almost")
+        await r.click("Submit")
+    if not r.has("Submit"):
+        raise RuntimeError(f"session {n} did not reach the running stage")
+    return r
+
+
+async def _run(server: StreamlitServer, levels: list[int], pairs_file: bytes, answers: int,
+               concurrency: int) -> list[tuple[int, int]]:
+    base = f"127.0.0.1:{server.port}"
+    rows = [(0, server.rss_bytes())]
+    raters: list[Rater] = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(n):
+        async with gate:
+            raters.append(await _open_session(n, base, pairs_file, answers, http))
+
+    try:
+        async with httpx.AsyncClient(timeout=120) as http:
+            for level in levels:
+                await asyncio.gather(*(one(n) for n in range(len(raters), level)))
+                await asyncio.sleep(1.0)  # let the autosave writers settle
+                rows.append((len(raters), server.rss_bytes()))
+                print(f"{len(raters):>9} sessions  {rows[-1][1] / 2**20:>8.1f} MiB", flush=True)
+    finally:
+        await asyncio.gather(*(r.close() for r in raters), return_exceptions=True)
+    return rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--patients", type=int, default=200_000, help="synthetic cohort size")
+    ap.add_argument("--sessions", type=_ints, default=[1, 10, 50, 100, 200], help="comma-separated session counts")
+    ap.add_argument("--pairs", type=int, default=200, help="pairs in every session's file")
+    ap.add_argument("--answers", type=int, default=2, help="Submits per session before it idles")
+    ap.add_argument("--concurrency", type=int, default=8, help="sessions being opened at once")
+    ap.add_argument("--port", type=int, default=8599)
+    args = ap.parse_args(argv)
+
+    sys.path.insert(0, str(APP_PATH.parent))
+    from pairs_io import write_pairs_json
+    from patient_data import load_patient_df_from_repo
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        csv_path = synthetic_cohort(args.patients, tmp / "patients.csv")
+        pairs = synthetic_pairs(load_patient_df_from_repo(csv_path), args.pairs)
+        write_pairs_json(tmp / "pairs.json", np.column_stack([pairs.a, pairs.b]))
+        pairs_file = (tmp / "pairs.json").read_bytes()
+        env = {"PROGRESS_BACKEND": "sqlite", "PROGRESS_SQLITE_PATH": str(tmp / "progress.sqlite3"),
+               "PATIENT_DF_PATH": str(csv_path)}
+        with StreamlitServer(env, None, args.port) as server:
+            rows = asyncio.run(_run(server, sorted(set(args.sessions)), pairs_file, args.answers,
+                                    args.concurrency))
+
+    idle = rows[0][1]
+    first = rows[1][1] if len(rows) > 1 else idle
+    print(f"\npatients={args.patients} pairs/session={len(pairs)}")
+    print(f"{'sessions':>9}{'RSS MiB':>10}{'vs idle':>10}{'vs 1st':>10}{'KiB/session':>13}")
+    for n, rss in rows:
+        per = (rss - first) / (n - rows[1][0]) / 1024 if n > rows[1][0] else float("nan")
+        print(f"{n:>9}{rss / 2**20:>10.1f}{(rss - idle) / 2**20:>10.1f}{(rss - first) / 2**20:>10.1f}{per:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+"""
+Concurrent-rater load test of one app.py server against a local Supabase stand-in.
+
+Starts a PostgREST stub on 127.0.0.1 (`progress_snapshots` / `progress_deltas`
+in memory, the select/upsert calls SupabaseStore makes, every request delayed
+by --latency-ms plus up to --jitter-ms) and one `streamlit run app.py` whose
+Supabase client points at it. Then, for each N in --sessions, N raters talk to
+that server concurrently over its websocket protocol, the way browser tabs do
+(widget states in BackMsg reruns, uploads through /_stcore/upload_file, cached
+message hashes reported back): login, upload and Start, explain, one Submit per
+pair of an --answers pairs file, done.
+
+A Submit's latency is from the click to the end of the run that renders the
+next pair; throughput is Submits per second across all raters (each answer
+is three reruns: both radios, then Submit). The raters run in this process,
+so on a small machine they compete with the server for CPU.
+
+    python -m benchmarks.loadtest [--sessions 1,2,4,8,16] [--answers 20] [--latency-ms 40] [--jitter-ms 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+import httpx  # pip install -r benchmarks/requirements.txt
+import numpy as np
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.Common_pb2 import FileUploaderState, UploadedFileInfo
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+APP_PATH = Path(__file__).resolve().parent.parent / "app.py"
+PRIMARY_KEYS = {
+    "progress_snapshots": ("user_name", "pair_file"),
+    "progress_deltas": ("user_name", "pair_file", "seq"),
+}
+
+
+class PostgrestStub:
+    """
+    In-memory stand-in for the PostgREST endpoints behind SupabaseStore:
+    GET with eq./gt. filters, order and limit, and POST upserts keyed by the
+    table's primary key. Every request sleeps latency (+ jitter) seconds first.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, port: int = 0):
+        self.latency, self.jitter = latency, jitter
+        self.tables: dict[str, dict[tuple, dict]] = {name: {} for name in PRIMARY_KEYS}
+        self.requests = {"GET": 0, "POST": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="postgrest-stub", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "PostgrestStub":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def select(self, table: str, query: list[tuple[str, str]]) -> list[dict]:
+        with self._lock:
+            rows = list(self.tables[table].values())
+        columns, order, limit = None, None, None
+        for key, value in query:
+            if key == "select":
+                columns = [c.strip() for c in value.split(",")] if value != "*" else None
+            elif key == "order":
+                col, _, direction = value.partition(".")
+                order = (col, direction.startswith("desc"))
+            elif key == "limit":
+                limit = int(value)
+            else:
+                op, _, operand = value.partition(".")
+                if op == "eq":
+                    rows = [r for r in rows if str(r.get(key)) == operand]
+                elif op == "gt":
+                    rows = [r for r in rows if float(r.get(key)) > float(operand)]
+        if order is not None:
+            rows.sort(key=lambda r: r.get(order[0]), reverse=order[1])
+        if limit is not None:
+            rows = rows[:limit]
+        return [{c: r.get(c) for c in columns} if columns else r for r in rows]
+
+    def upsert(self, table: str, rows: list[dict]) -> list[dict]:
+        pk = PRIMARY_KEYS[table]
+        with self._lock:
+            for row in rows:
+                key = tuple(row[c] for c in pk)
+                self.tables[table][key] = {**self.tables[table].get(key, {}), **row}
+        return rows
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body) -> None:
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _route(self):
+                parts = urlsplit(self.path)
+                table = parts.path.rsplit("/", 1)[-1]
+                with stub._lock:
+                    stub.requests[self.command] = stub.requests.get(self.command, 0) + 1
+                time.sleep(stub.latency + random.uniform(0, stub.jitter))
+                return table, parse_qsl(parts.query)
+
+            def do_GET(self):
+                table, query = self._route()
+                if table not in stub.tables:
+                    return self._reply(404, {"message": f"relation {table} does not exist"})
+                self._reply(200, stub.select(table, query))
+
+            def do_POST(self):
+                table, _ = self._route()
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"[]")
+                if table not in stub.tables:
+                    return self._reply(404, {"message": f"relation {table} does not exist"})
+                rows = stub.upsert(table, body if isinstance(body, list) else [body])
+                self._reply(201, rows)
+
+        return Handler
+
+
+def _ints(text: str) -> list[int]:
+    return [int(t) for t in text.split(",") if t.strip()]
+
+
+class StreamlitServer:
+    """`streamlit run app.py` in a subprocess (headless, no XSRF), usable as a context manager."""
+
+    def __init__(self, env: dict, secrets_path: Path | None, port: int):
+        self.port = port
+        self._cmd = [sys.executable, "-m", "streamlit", "run", str(APP_PATH), "--server.headless=true",
+                     f"--server.port={port}", "--server.enableXsrfProtection=false",
+                     "--server.fileWatcherType=none", "--browser.gatherUsageStats=false"]
+        if secrets_path is not None:
+            self._cmd.append(f"--secrets.files={secrets_path}")
+        self._env = {**os.environ, **env}
+        self._proc = None
+
+    def __enter__(self) -> "StreamlitServer":
+        self._proc = subprocess.Popen(self._cmd, cwd=APP_PATH.parent, env=self._env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if self._proc.poll() is not None:
+                raise RuntimeError(f"streamlit exited: {self._proc.stderr.read().decode(errors='replace')[-2000:]}")
+            try:
+                if httpx.get(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=1).status_code == 200:
+                    return self
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise TimeoutError("streamlit did not become healthy within 60 s")
+
+    def cpu_seconds(self) -> float:
+        """CPU time (user + system) the server process has used so far; Linux /proc, clock-tick resolution."""
+        fields = Path(f"/proc/{self._proc.pid}/stat").read_text().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def rss_bytes(self) -> int:
+        """Resident set size of the server process; Linux /proc."""
+        for line in Path(f"/proc/{self._proc.pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+        raise RuntimeError("no VmRSS in /proc status")
+
+    def __exit__(self, *exc) -> None:
+        self._proc.terminate()
+        try:
+            self._proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+
+
+class Rater:
+    """One browser session: keeps the widget states and message cache the frontend would."""
+
+    def __init__(self, base: str):
+        self.base = base
+        self.ws = None
+        self.session_id = ""
+        self.widgets: dict[str, tuple[str, object, str]] = {}  # label -> (element type, proto, fragment id) on the page
+        self.states: dict[str, WidgetState] = {}               # widget id -> value the client holds
+        self.cache: set[str] = set()
+        self.exceptions: list[str] = []
+        self.bytes_received = 0
+
+    async def connect(self) -> None:
+        self.ws = await websockets.connect(f"ws://{self.base}/_stcore/stream", subprotocols=["streamlit"],
+                                           max_size=None, ping_interval=None)
+        await self.rerun()
+
+    async def close(self) -> None:
+        await self.ws.close()
+
+    async def _send(self, msg: BackMsg) -> None:
+        await self.ws.send(msg.SerializeToString())
+
+    async def _recv(self) -> ForwardMsg:
+        msg = ForwardMsg()
+        data = await self.ws.recv()
+        self.bytes_received += len(data)
+        msg.ParseFromString(data)
+        if msg.metadata.cacheable and msg.hash:
+            self.cache.add(msg.hash)
+        return msg
+
+    async def rerun(self, *triggers: str, fragment_id: str = "") -> None:
+        """
+        Send the held widget states (+ button triggers); return when the app
+        finished rendering. `fragment_id` reruns only that fragment, as the
+        frontend does for a widget inside an st.fragment.
+        """
+        back = BackMsg()
+        state = back.rerun_script
+        state.widget_states.widgets.extend(self.states.values())
+        for widget_id in triggers:
+            state.widget_states.widgets.add(id=widget_id, trigger_value=True)
+        state.cached_message_hashes.extend(self.cache)
+        state.fragment_id = fragment_id
+        await self._send(back)
+
+        widgets = dict(self.widgets)
+        while True:
+            msg = await self._recv()
+            kind = msg.WhichOneof("type")
+            if kind == "new_session":
+                self.session_id = msg.new_session.initialize.session_id or self.session_id
+                rerun = set(msg.new_session.fragment_ids_this_run)
+                # a full run replaces the page; a fragment run only what those fragments render
+                widgets = {k: v for k, v in widgets.items() if rerun and v[2] not in rerun}
+            elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                el = msg.delta.new_element
+                el_type = el.WhichOneof("type")
+                proto = getattr(el, el_type) if el_type else None
+                if el_type == "exception":
+                    self.exceptions.append(f"{proto.type}: {proto.message}")
+                elif hasattr(proto, "id") and hasattr(proto, "label") and proto.id:
+                    widgets[proto.label] = (el_type, proto, msg.delta.fragment_id)
+            elif kind == "script_finished":
+                status = msg.script_finished
+                if status == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    continue  # st.rerun(): the server starts the next run itself
+                if status == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    raise RuntimeError("app.py failed to compile")
+                break
+        self.widgets = widgets
+        live = {proto.id for _, proto, _ in widgets.values()}
+        self.states = {k: v for k, v in self.states.items() if k in live}
+        if self.exceptions:
+            raise RuntimeError(self.exceptions[-1])
+
+    def _id(self, label: str) -> str:
+        if label not in self.widgets:
+            raise RuntimeError(f"no widget {label!r} on the page (have {sorted(self.widgets)})")
+        return self.widgets[label][1].id
+
+    def _fragment(self, label: str) -> str:
+        return self.widgets[label][2]
+
+    async def type_text(self, label: str, text: str) -> None:
+        widget_id = self._id(label)
+        self.states[widget_id] = WidgetState(id=widget_id, string_value=text)
+        await self.rerun(fragment_id=self._fragment(label))
+
+    async def choose(self, label: str, option: str) -> None:
+        widget_id = self._id(label)
+        if option not in self.widgets[label][1].options:
+            raise RuntimeError(f"{label!r} has no option {option!r}")
+        self.states[widget_id] = WidgetState(id=widget_id, string_value=option)  # radios send the formatted option
+        await self.rerun(fragment_id=self._fragment(label))
+
+    async def click(self, label: str) -> None:
+        await self.rerun(self._id(label), fragment_id=self._fragment(label))
+
+    async def upload(self, label: str, name: str, data: bytes, http: httpx.AsyncClient) -> None:
+        widget_id = self._id(label)
+        back = BackMsg()
+        back.file_urls_request.request_id = widget_id
+        back.file_urls_request.session_id = self.session_id
+        back.file_urls_request.file_names.append(name)
+        await self._send(back)
+        while True:
+            msg = await self._recv()
+            if msg.WhichOneof("type") == "file_urls_response":
+                urls = msg.file_urls_response.file_urls[0]
+                break
+        res = await http.put(f"http://{self.base}{urls.upload_url}", files={"file": (name, data, "application/json")})
+        res.raise_for_status()
+        info = UploadedFileInfo(name=name, size=len(data), file_id=urls.file_id, file_urls=urls)
+        self.states[widget_id] = WidgetState(id=widget_id, file_uploader_state_value=FileUploaderState(uploaded_file_info=[info]))
+        await self.rerun(fragment_id=self._fragment(label))
+
+    def has(self, label: str) -> bool:
+        return label in self.widgets
+
+
+async def _rater(name: str, base: str, pairs_file: bytes, answers: int, start: asyncio.Barrier,
+                 latencies: list, http: httpx.AsyncClient) -> None:
+    r = Rater(base)
+    await r.connect()
+    try:
+        await r.type_text("Your full name in English (required)", name)
+        await r.click("Continue")
+        await r.upload("Pairs for ranking (JSON file)", "load_pairs.json", pairs_file, http)
+        await r.click("Start")   # upload -> explain
+        await r.click("Start")   # explain -> running
+        await start.wait()
+        for i in range(answers):
+            await r.choose("Choose one:", "Patient X" if i % 2 else "Patient Y")
+            await r.choose("On a scale of 1–5:", "4 - almost")
+            t = time.perf_counter()
+            await r.click("Submit")
+            if r.has("Submit"):
+                latencies.append(time.perf_counter() - t)
+        if r.has("Submit"):
+            raise RuntimeError("still running after every pair was answered")
+    finally:
+        await r.close()
+
+
+async def run_level(n: int, base: str, pairs_file: bytes, answers: int) -> dict:
+    """n concurrent raters; returns the Submit latencies, throughput and errors."""
+    latencies = []
+    start = asyncio.Barrier(n + 1)
+    async with httpx.AsyncClient(timeout=60) as http:
+        tasks = [asyncio.create_task(_rater(f"Load Rater {n}-{j}-{time.time_ns()}", base, pairs_file, answers,
+                                            start, latencies, http)) for j in range(n)]
+        waiter = asyncio.create_task(start.wait())
+        await asyncio.wait([waiter, *tasks], return_when=asyncio.FIRST_COMPLETED)
+        t0 = time.perf_counter()
+        if not waiter.done():  # a rater failed before reaching its first pair
+            await start.abort()
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        wall = time.perf_counter() - t0
+    waiter.cancel()
+    ms = np.asarray(latencies) * 1e3
+    pct = np.percentile(ms, [50, 95, 99]) if len(ms) else [float("nan")] * 3
+    return {
+        "sessions": n, "submits": len(ms), "throughput": len(ms) / wall if wall > 0 else 0.0,
+        "p50": pct[0], "p95": pct[1], "p99": pct[2],
+        "errors": [repr(o) for o in outcomes if isinstance(o, BaseException)],
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--sessions", type=_ints, default=[1, 2, 4, 8, 16], help="comma-separated concurrency levels")
+    ap.add_argument("--answers", type=int, default=20, help="pairs per rater (each one answered)")
+    ap.add_argument("--latency-ms", type=float, default=40.0, help="delay of every stub request")
+    ap.add_argument("--jitter-ms", type=float, default=20.0, help="extra uniform random delay, up to")
+    ap.add_argument("--port", type=int, default=8599, help="port of the streamlit server")
+    args = ap.parse_args(argv)
+
+    sys.path.insert(0, str(APP_PATH.parent))
+    from pairgen import generate_pairs
+    from pairs_io import write_pairs_json
+    from patient_data import PATIENT_DF_PATH, load_patient_df_from_repo
+
+    pairs = generate_pairs(load_patient_df_from_repo(PATIENT_DF_PATH), 2)
+    stub = PostgrestStub(args.latency_ms / 1e3, args.jitter_ms / 1e3).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        write_pairs_json(Path(tmp) / "pairs.json", np.column_stack([pairs.a, pairs.b])[: args.answers])
+        pairs_file = (Path(tmp) / "pairs.json").read_bytes()
+        secrets = Path(tmp) / "secrets.toml"
+        secrets.write_text(f'SUPABASE_URL = "{stub.url}"\nSUPABASE_ANON_KEY = "stub.anon.key"\n', encoding="utf-8")
+
+        print(f"stub {stub.url}  latency {args.latency_ms:g}+{args.jitter_ms:g} ms  pairs/rater {args.answers}")
+        print(f"{'sessions':>8}{'submits':>9}{'submits/s':>11}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        failed = False
+        try:
+            with StreamlitServer({"PROGRESS_BACKEND": "supabase"}, secrets, args.port):
+                for n in args.sessions:
+                    r = asyncio.run(run_level(n, f"127.0.0.1:{args.port}", pairs_file, args.answers))
+                    print(f"{n:>8}{r['submits']:>9}{r['throughput']:>11.1f}"
+                          f"{r['p50']:>9.0f}{r['p95']:>9.0f}{r['p99']:>9.0f}")
+                    for e in r["errors"]:
+                        print(f"  error: {e}")
+                    failed |= bool(r["errors"])
+        finally:
+            stub.stop()
+    print(f"stub requests: {stub.requests['GET']} GET, {stub.requests['POST']} POST; "
+          f"{len(stub.tables['progress_snapshots'])} snapshots stored")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Scale benchmark suite with a stored baseline and a regression gate.
+
+For every (patients, pairs) scale it builds a synthetic cohort (patient_df.csv
+rows tiled to the requested size, written as a CSV) and a pairgen pairs file,
+then measures:
+
+  * directly: load_patient_df_from_repo cold (parse + sidecar write) and warm,
+    normalize_patient over 10k rows, patient_card_html over 500 cards and the
+    results export (export.py) of one answer per pair in every format;
+  * through app.py, run headless with streamlit.testing AppTest on the sqlite
+    progress backend in a temp dir (no Supabase): login, Start with a progress
+    file that answers half the pairs, --answers Submits, then the done page.
+    The app's own timing spans (see timing.py) give read_pairs_file
+    (pairs.read), apply_snapshot_to_session_smart (snapshot.apply), card
+    rendering, payload building and the per-stage times; a Submit's wall time
+    is measured around the click.
+
+Results go to --out as JSON, keyed "<case>@<patients>x<pairs>". Every case
+also present in the baseline file (--baseline, written by --update-baseline on
+the machine that runs the gate) is compared, and the run exits with status 1
+when one got slower by more than --threshold (relative) and --min-delta
+(absolute). A missing baseline, or one that shares no case with the run, is an
+error too, so the gate cannot pass by comparing nothing; --no-baseline only
+measures.
+
+    python -m benchmarks.suite [--patients 1000,1000000] [--pairs 100,100000]
+        [--answers 10] [--repeat 3] [--out bench_results.json]
+        [--baseline benchmarks/baseline.json] [--threshold 0.25]
+        [--update-baseline | --no-baseline]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+APP_PATH = Path(__file__).resolve().parent.parent / "app.py"
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+# fixed sample sizes, so the per-call cases stay comparable across scales and above --min-delta
+NORMALIZE_SAMPLE = 10_000
+RENDER_SAMPLE = 500
+
+# app spans recorded once per run; the others are per rerun and reported as p50
+ONE_SHOT_SPANS = ("patients.load", "pairs.read", "pairs.prepare", "cards.fragments",
+                  "snapshot.apply", "store.load_snapshot")
+PER_RERUN_SPANS = ("stage.running", "fragment.pair_panel", "cards.render", "prefetch.render", "payload.build",
+                   "autosave.submit")
+
+
+class _Upload(io.BytesIO):
+    def __init__(self, data: bytes, name: str):
+        super().__init__(data)
+        self.name = name
+
+
+def _ints(text: str) -> list[int]:
+    return [int(float(t)) for t in text.split(",") if t.strip()]
+
+
+def _median_time(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return statistics.median(times)
+
+
+def synthetic_cohort(n: int, dest: Path) -> Path:
+    """patient_df.csv tiled to n rows with fresh patient_num 1..n, written to dest."""
+    from patient_data import PATIENT_DF_PATH
+
+    base = pd.read_csv(PATIENT_DF_PATH)
+    df = base.iloc[np.arange(n) % len(base)].reset_index(drop=True)
+    df["patient_num"] = np.arange(1, n + 1)
+    df.to_csv(dest, index=False)
+    return dest
+
+
+def synthetic_pairs(df: pd.DataFrame, n_pairs: int):
+    """About n_pairs pairgen pairs over df (truncated to n_pairs)."""
+    from pairgen import generate_pairs
+    from pairs_io import PairColumns
+
+    k = max(2, -(-2 * n_pairs // len(df)))
+    k += k % 2 and len(df) % 2  # an odd k needs an even cohort
+    pairs = generate_pairs(df, k)
+    return PairColumns(pairs.a[:n_pairs], pairs.b[:n_pairs], pairs.x_is_a[:n_pairs])
+
+
+def progress_json(pairs, fraction: float = 0.5, seed: int = 0) -> bytes:
+    """A progress snapshot answering `fraction` of the pairs, half of them stored as (b, a)."""
+    rng = np.random.default_rng(seed)
+    answered = np.flatnonzero(rng.random(len(pairs)) < fraction)
+    flip = rng.random(len(answered)) < 0.5
+    results = [[[int(pairs.b[i]), int(pairs.a[i])] if f else [int(pairs.a[i]), int(pairs.b[i])], 3]
+               for i, f in zip(answered.tolist(), flip.tolist())]
+    return json.dumps({"version": 1, "results": results}).encode("utf-8")
+
+
+def direct_cases(csv_path: Path, df: pd.DataFrame, pairs, repeat: int) -> dict[str, float]:
+    from cards import load_card_fragments, patient_card_html
+    from export import FORMATS, export_results
+    from pairs import PreparedPairs
+    from patient_data import load_patient_df_from_repo, normalize_patient
+    from recs import build_pair_recs_alignment_plan
+
+    out = {}
+    t = time.perf_counter()
+    load_patient_df_from_repo(csv_path)  # no sidecar yet: parse, normalize and write it
+    out["patients.load_cold"] = time.perf_counter() - t
+    out["patients.load_warm"] = _median_time(lambda: load_patient_df_from_repo(csv_path), repeat)
+
+    rows = df.sample(NORMALIZE_SAMPLE, replace=True, random_state=0).to_dict("records")
+    out[f"patient.normalize_x{NORMALIZE_SAMPLE}"] = _median_time(lambda: [normalize_patient(r) for r in rows], repeat)
+
+    fragments = load_card_fragments(df, csv_path)
+    prepared = PreparedPairs(df, pairs)
+    sample = [prepared[i % len(prepared)] for i in range(RENDER_SAMPLE)]
+    plans = [build_pair_recs_alignment_plan(p["patient_x"], p["patient_y"]) for p in sample]
+
+    def render():
+        for p, (order, master) in zip(sample, plans):
+            patient_card_html("Patient X", p["patient_x"], False, side="left", category_order=order,
+                              per_category_master=master, fragments=fragments)
+    out[f"cards.render_x{RENDER_SAMPLE}"] = _median_time(render, repeat)
+
+    answers = [((int(a), int(b)), 3) for a, b in zip(pairs.a.tolist(), pairs.b.tolist())]
+    for fmt in FORMATS:
+        out[f"export.{fmt}"] = _median_time(lambda: export_results(answers, fmt), repeat)
+    return out
+
+
+def app_cases(csv_path: Path, pairs_path: Path, progress: bytes, answers: int) -> dict[str, float]:
+    """Drive app.py through a round; returns the app's span timings plus the Submit wall time."""
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    import patient_data
+
+    patient_data.PATIENT_DF_PATH = csv_path  # app.py reads it on every rerun
+    uploads = {None: _Upload(pairs_path.read_bytes(), pairs_path.name),
+               "progress_upload": _Upload(progress, "progress.json")}
+    st.file_uploader = lambda label, *a, key=None, **kw: uploads.get(key)
+    for u in uploads.values():
+        u.seek(0)
+
+    at = AppTest.from_file(str(APP_PATH), default_timeout=600)
+    at.run()
+    at.text_input[0].input("Bench User").run()
+    at.button[0].click().run()
+    for _ in range(2):  # upload -> explain -> running
+        [b for b in at.button if b.label == "Start"][0].click().run()
+
+    submits = []
+    for i in range(answers):
+        if at.session_state.stage != "running":
+            break
+        at.radio[0].set_value("Patient X" if i % 2 else "Patient Y").run()
+        at.radio[1].set_value(4).run()
+        t = time.perf_counter()
+        [b for b in at.button if b.label == "Submit"][0].click().run()
+        submits.append(time.perf_counter() - t)
+
+    at.session_state["idx"] = len(at.session_state.prepared_pairs)  # skip ahead to the done page
+    at.run()
+    if at.session_state.stage != "done":
+        raise RuntimeError(f"app ended in stage {at.session_state.stage!r}, not 'done'")
+
+    out = {"app.submit": statistics.median(submits)} if submits else {}
+    for s in at.session_state.timings.stats():
+        if s.name in ONE_SHOT_SPANS:
+            out[f"app.{s.name}"] = s.max_ms / 1e3
+        elif s.name in PER_RERUN_SPANS:
+            out[f"app.{s.name}"] = s.p50_ms / 1e3
+    return out
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta: float) -> list[str]:
+    """Print the comparison table; returns the keys that regressed."""
+    regressed = []
+    print(f"\n{'case':52}{'baseline':>12}{'now':>12}{'ratio':>8}")
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        old, new = baseline[key]["seconds"], results[key]["seconds"]
+        ratio = new / old if old > 0 else float("inf")
+        bad = new > old * (1 + threshold) and new - old > min_delta
+        if bad:
+            regressed.append(key)
+        print(f"{key:52}{old * 1e3:>10.3f}ms{new * 1e3:>10.3f}ms{ratio:>7.2f}x{'  REGRESSED' if bad else ''}")
+    return regressed
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--patients", type=_ints, default=[1_000, 1_000_000], help="comma-separated cohort sizes")
+    ap.add_argument("--pairs", type=_ints, default=[100, 100_000], help="comma-separated pair counts")
+    ap.add_argument("--answers", type=int, default=10, help="Submits per app run")
+    ap.add_argument("--repeat", type=int, default=3, help="runs per direct case (median)")
+    ap.add_argument("--out", type=Path, default=Path("bench_results.json"))
+    ap.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    ap.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown")
+    ap.add_argument("--min-delta", type=float, default=0.001, help="ignore slowdowns below this many seconds")
+    mode = ap.add_mutually_exclusive_group()
+    mode.add_argument("--update-baseline", action="store_true", help="write the results as the new baseline")
+    mode.add_argument("--no-baseline", action="store_true", help="only measure, do not compare")
+    ap.add_argument("--skip-app", action="store_true", help="only the direct cases")
+    args = ap.parse_args(argv)
+    args.out, args.baseline = args.out.resolve(), args.baseline.resolve()
+    if not (args.update_baseline or args.no_baseline or args.baseline.exists()):
+        ap.error(f"no baseline at {args.baseline}; create one with --update-baseline "
+                 f"or only measure with --no-baseline")
+
+    tmp = Path(tempfile.mkdtemp())
+    os.environ.setdefault("PROGRESS_BACKEND", "sqlite")
+    os.environ.setdefault("PROGRESS_SQLITE_PATH", str(tmp / "progress.sqlite3"))
+    os.chdir(APP_PATH.parent)  # .streamlit/config.toml is read from the working directory
+    sys.path.insert(0, str(APP_PATH.parent))
+
+    from pairgen import write_pairs
+    from patient_data import load_patient_df_from_repo
+
+    results = {}
+    for n_patients in args.patients:
+        csv_path = synthetic_cohort(n_patients, tmp / f"patients_{n_patients}.csv")
+        df = load_patient_df_from_repo(csv_path, use_cache=False)
+        for n_pairs in args.pairs:
+            scale = f"{n_patients}x{n_pairs}"
+            pairs = synthetic_pairs(df, n_pairs)
+            pairs_path = tmp / f"pairs_{scale}.json"
+            write_pairs(pairs_path, pairs)
+            for cache in (tmp / ".cache").glob(f"patients_{n_patients}.csv*"):
+                cache.unlink()  # every scale measures a cold first load
+
+            t = time.perf_counter()
+            cases = direct_cases(csv_path, df, pairs, args.repeat)
+            if not args.skip_app:
+                cases.update(app_cases(csv_path, pairs_path, progress_json(pairs), args.answers))
+            print(f"{scale:>16}  {len(cases)} cases in {time.perf_counter() - t:.1f}s")
+            for case, seconds in cases.items():
+                results[f"{case}@{scale}"] = {"case": case, "patients": n_patients, "pairs": len(pairs),
+                                              "seconds": seconds}
+
+    report = {
+        "generated_utc": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    args.out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"wrote {len(results)} results to {args.out}")
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"baseline updated: {args.baseline}")
+        return
+    if args.no_baseline:
+        return
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))["results"]
+    if not baseline.keys() & results.keys():
+        print(f"\nthe baseline at {args.baseline} has none of these cases; run at its scales "
+              f"or refresh it with --update-baseline")
+        sys.exit(1)
+    regressed = compare(results, baseline, args.threshold, args.min_delta)
+    if regressed:
+        print(f"\n{len(regressed)} case(s) slower than the baseline by more than "
+              f"{args.threshold:.0%} and {args.min_delta * 1e3:g} ms")
+        sys.exit(1)
+    print("\nno regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+Patient card HTML.
+
+A card is the frame + badge (depend on X/Y side and selection), the static
+Demographics / Predicted Risk / Behavioral Factors sections (depend only on the
+patient row) and the recommendations block (depends on the pair's alignment
+plan). `build_card_fragments` renders the static sections for a whole cohort in
+one vectorized pass into an id-indexed `CardFragments` store, persisted next to
+the dataset sidecar, so per-request work is just the frame and the recs block.
+"""
+import itertools
+import re
+import string
+from dataclasses import dataclass
+from os import PathLike
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from patient_data import cache_paths, current_dataset_sha256, read_meta, read_sidecar, write_sidecar
+from recs import recs_grouped_html_for_patient
+
+# bump whenever the templates or the colorization below change
+CARD_RENDER_VERSION = 2
+
+_HTML_COMMENT = re.compile(r"<!--.*?-->", re.S)
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+
+
+def minify_html(markup: str) -> str:
+    """
+    Drop comments and the indentation / line breaks between tags. Only
+    whitespace that contains a newline is removed, so spaces between inline
+    elements on one line (which render) are kept.
+    """
+    markup = _HTML_COMMENT.sub("", markup)
+    return re.sub(r">\s*\n\s*<", "><", markup).strip()
+
+
+def minify_css(css: str) -> str:
+    """Drop comments and insignificant whitespace (not before ":", which would turn "a :hover" into "a:hover")."""
+    css = re.sub(r"\s+", " ", _CSS_COMMENT.sub("", css))
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    return re.sub(r":\s+", ":", css).replace(";}", "}").strip()
+
+
+def _map_level(val, mapping: dict, fallback: str = "unknown") -> str:
+    return mapping.get(val, fallback)
+
+# 1) Add these small helpers and rules near your function (or at top of the file)
+ABNORMAL_RULES = {
+    # "risk_band": {"medium": "orange", "high": "red"},
+    # "smoker": {"yes": "red"}, # can comment back in for coloring
+    # "adherence": {"low": "red"}, # can comment back in for coloring
+    # BMI handled by thresholds below
+}
+
+_SES_LEVELS = {1: "low", 2: "medium", 3: "high"}
+_ADHERENCE_NA = "not applicable (no chronic meds)"
+
+def _colorize(val: str, color: str | None) -> str:
+    return f'<span class="val {color}">{val}</span>' if color else f'<span class="val_bold">{val}</span>'
+
+def _abnormal_color(name: str, value_str: str, value_num: float | None = None) -> str | None:
+    """
+    Returns a color name if abnormal, else None.
+    name: one of {'risk_band','smoker','ses','adherence','bmi'}
+    value_str: normalized, lowercase string label of the value to check
+    value_num: numeric value for thresholded checks (e.g., BMI)
+    """
+    if name == "bmi":
+        if value_num is None:
+            return None
+         # can comment back in for coloring
+        # if value_num >= 30:
+        #     return "red"
+        # if value_num >= 25:
+        #     return "orange"
+        return None
+
+    if name == "risk_percentile":
+        if value_num is None:
+            return None
+        # # 33–65.999... => orange, 66–100 => red
+         # can comment back in for coloring
+        # if 85 <= value_num < 95:
+        #     return "orange"
+        # if 95 <= value_num <= 100:
+        #     return "red"
+        return None
+
+    rules = ABNORMAL_RULES.get(name, {})
+    return rules.get(value_str)  # returns color or None
+
+def percentile_label(p):
+    # for suffix logic, use the integer part
+    n = int(round(p))
+    last_two = n % 100
+    if 11 <= last_two <= 13:
+        suf = "th"
+    else:
+        last = n % 10
+        suf = {1: "st", 2: "nd", 3: "rd"}.get(last, "th")
+
+    # format number nicely (no trailing .0 if whole)
+    num_str = f"{p:g}"
+
+    return suf + ' percentile'
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Templates
+
+_HEAD_TMPL = minify_html("""<div class="frame {side}{sel_class}"></div>
+
+<div class="card-badge cell badge {side}">{label}</div>
+
+""")
+
+# the static sections; {side} is left as a token in stored fragments (see _SIDE_TOKEN)
+_STATIC_TMPL = minify_html("""<div class="section cell sec-demo {side}">
+  <div class="section-title">Demographics</div>
+  <div class="row row-3">
+    <div><span class="item-label">Age:</span> {age}</div>
+    <div><span class="item-label">Sex:</span> {sex_label}</div>
+    <div><span class="item-label">Socio-economic:</span> {ses_label}</div>
+  </div>
+</div>
+
+<div class="section cell sec-risk {side}">
+  <div class="section-title">Predicted Risk</div>
+  <div class="row row-2 rm-top">
+<!--<div><span class="item-label-2"><span class="item-label">SCORE2</span>(10-year CVD risk):</span> {risk}%</div>-->
+<!--<div><span class="item-label">Risk percentile for age:</span>{risk_percentile}{risk_percentile_lbl}</div>-->
+    <div><span class="item-label-2"><span class="item-label">SCORE2</span>(10-year CVD risk):</span><span class="risk-pct">{risk}%</span></div>
+    <div><span class="item-label">Risk for age:</span> {risk_percentile_disp}{risk_percentile_lbl}</div>
+<!-- <div><span class="item-label-2"><span class="item-label">SCORE2</span>(10-year CVD risk):</span>  {risk_pct_span}</div>    <div><span class="item-label">Risk band for age:</span> risk_band_disp</div>  -->
+  </div>
+</div>
+<div class="section cell sec-mods {side}">
+  <div class="section-title">Behavioral Factors</div>
+  <div class="row row-3">
+    <div><span class="item-label">BMI:</span> {bmi_disp}</div>
+    <div><span class="item-label">Smoker:</span> {smoker_disp}</div>
+    <div><span class="item-label">Adherence:</span> {adherence_disp}</div>
+  </div>
+</div>
+
+""")
+
+_RECS_TMPL = minify_html("""<div class="section section-recs cell sec-recs {side}">
+  <div class="section-title">C-Pi recommendations</div>
+  <ul class="recs">{recs_html}</ul>
+</div>""")
+
+_SIDE_TOKEN = "%SIDE%"
+
+
+# Each static field as (source columns, value -> display); the same function
+# serves a single patient dict and, once per distinct value, a whole DataFrame.
+
+def _risk_pct_color(risk_percentile) -> str | None:
+    return _abnormal_color("risk_percentile", "", int(risk_percentile))
+
+def _risk_pct_span(risk, risk_percentile) -> str:
+    # Optionally color the SCORE2 % with the same color
+    color = _risk_pct_color(risk_percentile)
+    return (f'<span class="risk-pct {color}">{int(risk)}%</span>' if color else
+            f'<span class="risk-pct">{int(risk)}%</span>')
+
+def _smoker_disp(smoker) -> str:
+    label = "yes" if int(smoker) == 1 else "no"
+    return _colorize(label, _abnormal_color("smoker", label))
+
+def _adherence_disp(adherence) -> str:
+    val = str(adherence)
+    # only color adherence if it's one of the graded labels (not the 'not applicable...' string)
+    if val == "none":
+        return _ADHERENCE_NA
+    return _colorize(val, _abnormal_color("adherence", val))
+
+def _bmi_disp(bmi) -> str:
+    bmi_val = float(bmi)
+    return _colorize(f"{bmi_val:.1f}", _abnormal_color("bmi", "", bmi_val))
+
+_STATIC_FIELD_SPECS = {
+    "age":                  (("age",), lambda v: int(v)),
+    "sex_label":            (("sex",), lambda v: "male" if int(v) == 1 else "female"),
+    "ses_label":            (("socio_economic",), lambda v: _map_level(int(v), _SES_LEVELS)),
+    "risk":                 (("risk",), lambda v: int(v)),
+    "risk_percentile":      (("risk_percentile",), lambda v: int(v)),
+    "risk_percentile_lbl":  (("risk_percentile",), lambda v: percentile_label(int(v))),
+    "risk_percentile_disp": (("risk_percentile",), lambda v: _colorize(int(v), _risk_pct_color(v))),
+    "risk_pct_span":        (("risk", "risk_percentile"), _risk_pct_span),
+    "bmi_disp":             (("bmi",), _bmi_disp),
+    "smoker_disp":          (("smoker",), _smoker_disp),
+    "adherence_disp":       (("adherence",), _adherence_disp),
+}
+
+
+def _static_fields(p: dict) -> dict:
+    """Per-patient values for _STATIC_TMPL (scalar path, one patient dict)."""
+    p = {"adherence": "none", **p}
+    return {name: fn(*(p[c] for c in cols)) for name, (cols, fn) in _STATIC_FIELD_SPECS.items()}
+
+
+def static_sections_html(p: dict, side: str) -> str:
+    return _STATIC_TMPL.format(side=side, **_static_fields(p))
+
+
+def patient_card_html(label: str, p: dict, selected: bool, side: str,
+                      category_order: list[str] | None = None,
+                      per_category_master: dict[str, list[str]] | None = None,
+                      fragments: "CardFragments | None" = None) -> str:
+    """
+    Full card HTML. With `fragments`, the static sections come from the
+    pre-rendered store (when it has this patient) instead of being rebuilt.
+    """
+    static = fragments.get(p["id"], side) if fragments is not None and "id" in p else None
+    if static is None:
+        static = static_sections_html(p, side)
+    recs_html = recs_grouped_html_for_patient(
+        p, category_order=category_order, per_category_master=per_category_master
+    )
+    return (
+        _HEAD_TMPL.format(side=side, sel_class=" selected" if selected else "", label=label)
+        + static
+        + _RECS_TMPL.format(side=side, recs_html=recs_html)
+    )
+
+
+def selected_frame_style(side: str | None) -> str:
+    """
+    <style> that marks the frame on `side` ("left"/"right") as chosen, "" for
+    none. Kept out of the card HTML so choosing a patient leaves the cards
+    byte-identical, i.e. a cache reference instead of a resend.
+    """
+    if side is None:
+        return ""
+    return (f"<style>.pair-grid .frame.{side}{{background:var(--card-selected-bg);"
+            f"border-color:var(--card-selected-border)}}</style>")
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Bulk pre-rendering
+
+def _static_field_column(df: pd.DataFrame, cols: tuple[str, ...], fn) -> np.ndarray:
+    """fn over the rows of df[cols], evaluated once per distinct value (or value tuple)."""
+    if len(cols) == 1:
+        codes, uniq = pd.factorize(df[cols[0]])
+        rendered = [str(fn(u)) for u in uniq]
+    else:
+        codes, uniq = pd.MultiIndex.from_frame(df[list(cols)]).factorize()
+        rendered = [str(fn(*u)) for u in uniq]
+    return np.asarray(rendered, dtype=object)[codes]
+
+
+def _split_template(tmpl: str) -> tuple[list[str], list[str]]:
+    """Split a named-field template into literal runs and field names (len(literals) == len(fields) + 1)."""
+    literals, fields = [""], []
+    for literal, field, _, _ in string.Formatter().parse(tmpl):
+        literals[-1] += literal
+        if field is not None:
+            fields.append(field)
+            literals.append("")
+    return literals, fields
+
+
+_STATIC_LITERALS, _STATIC_FIELDS = _split_template(_STATIC_TMPL)
+
+
+def render_static_sections(df: pd.DataFrame) -> pd.Series:
+    """
+    _STATIC_TMPL for a whole (normalized) patient DataFrame: every field is
+    computed as a column (from its distinct values), then each row is one
+    "".join over the interleaved literal runs and field columns.
+    """
+    streams = [itertools.repeat(_STATIC_LITERALS[0])]
+    for name, literal in zip(_STATIC_FIELDS, _STATIC_LITERALS[1:]):
+        if name == "side":
+            streams.append(itertools.repeat(_SIDE_TOKEN))
+        else:
+            streams.append(_static_field_column(df, *_STATIC_FIELD_SPECS[name]).tolist())
+        streams.append(itertools.repeat(literal))
+    return pd.Series(list(map("".join, zip(*streams))), index=df.index, dtype=object)
+
+
+@dataclass(frozen=True)
+class CardFragments:
+    """Static card sections indexed by patient_num (ids sorted, looked up by bisection)."""
+    ids: np.ndarray
+    html: pa.ChunkedArray
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get(self, patient_num: int, side: str) -> str | None:
+        i = int(np.searchsorted(self.ids, patient_num))
+        if i >= len(self.ids) or self.ids[i] != patient_num:
+            return None
+        return self.html[i].as_py().replace(_SIDE_TOKEN, side)
+
+    def to_table(self) -> pa.Table:
+        return pa.table({"patient_num": self.ids, "static_html": self.html})
+
+    @classmethod
+    def from_table(cls, table: pa.Table) -> "CardFragments":
+        return cls(ids=table.column("patient_num").to_numpy(), html=table.column("static_html"))
+
+
+def build_card_fragments(df: pd.DataFrame, chunk_rows: int = 100_000) -> CardFragments:
+    """Render the whole cohort, `chunk_rows` at a time to bound the temporary columns."""
+    order = np.argsort(df["patient_num"].to_numpy(), kind="stable")
+    ids = df["patient_num"].to_numpy().astype(np.int64)[order]
+    chunks = []
+    for start in range(0, len(order), chunk_rows):
+        part = df.iloc[order[start:start + chunk_rows]]
+        chunks.append(pa.array(render_static_sections(part).to_numpy(), type=pa.large_string()))
+    html = pa.chunked_array(chunks, type=pa.large_string())
+    return CardFragments(ids=ids, html=html)
+
+
+def load_card_fragments(df: pd.DataFrame, source_path: Path | str | PathLike) -> CardFragments:
+    """
+    Fragments for the dataset at `source_path` (whose normalized table is `df`),
+    read from the `.cards` sidecar when it matches the dataset's sha256 and the
+    current CARD_RENDER_VERSION, else rendered and written back. Without a
+    table sidecar that still matches the source's size and mtime the dataset's
+    hash is unknown, so the fragments are rendered and not cached.
+    """
+    source_path = Path(source_path)
+    digest = current_dataset_sha256(source_path)
+    data_path, meta_path = cache_paths(source_path, ".cards")
+    meta = read_meta(meta_path)
+    if digest and meta and meta.get("sha256") == digest and meta.get("version") == CARD_RENDER_VERSION:
+        try:
+            return CardFragments.from_table(read_sidecar(data_path))
+        except (OSError, pa.ArrowInvalid, KeyError):
+            pass
+
+    frags = build_card_fragments(df)
+    if digest:
+        try:
+            write_sidecar(frags.to_table(), data_path, meta_path,
+                          {"version": CARD_RENDER_VERSION, "sha256": digest, "rows": len(frags)},
+                          single_batch=False)
+        except OSError:
+            pass
+    return frags
@@ -0,0 +1,350 @@
+"""
+Consensus ranking and inter-rater agreement over a directory of answer files.
+
+Every rater downloads `<user>_<pairs file>_ranked.json` (the results list, or
+the same answers as .json.gz, .csv or .parquet, see export.FORMATS) and
+possibly progress snapshots (`rankings_<timestamp>.json`, or a snapshot
+exported from the progress store, optionally with deltas folded in). All of
+them are read with `ranking.read_results`; the files of one rater are merged
+with the later answer to a pair winning, so a snapshot plus the final download
+count once.
+
+Rater names come from the file names: the export suffix, `_ranked` and the
+pairs-file part shared by every `*_ranked.*` (or `--pair-file`) are stripped.
+Snapshots carry no user name, so they belong to the sub-directory they sit in
+(one directory per rater), or to their own stem at the top level.
+
+The consensus is a Bradley–Terry fit over every rater's answers. Agreement is
+measured on the pairs two raters both answered (orientation-free: the label is
+"the lower patient_num won"):
+
+- per rater pair: raw agreement, Kendall's τ of the two judgments (2·p_o − 1),
+  Cohen's κ, and the confidence-weighted versions (each shared pair weighs
+  w₁·w₂ with w = confidence / 5);
+- across all raters: Fleiss' κ over every pair answered at least twice, plain
+  and confidence-weighted;
+- per rater: agreement with the consensus order and Kendall's τ_b between the
+  rater's own Bradley–Terry scores and the consensus scores.
+
+Parsing and the per-rater statistics run in a process pool. The summary is
+written as Parquet tables into the --out directory: consensus, raters,
+agreement (one row per rater pair) and overall. An --out inside DIR is left
+out of the scan, so a second run does not read the first one's tables.
+
+    python -m consensus DIR [--out consensus_summary] [--workers N] [--pair-file STEM]
+"""
+import argparse
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from export import FORMATS as EXPORT_FORMATS
+from ranking import BradleyTerryRanking, Comparisons, read_results
+
+RANKED_SUFFIX = "_ranked"
+# longest first, so "x.json.gz" is stripped to "x" and not matched as ".gz"
+ANSWER_SUFFIXES = tuple(sorted({f.suffix for f in EXPORT_FORMATS.values()}, key=len, reverse=True))
+
+
+def find_answer_files(root: Path, exclude: Path | None = None) -> list[Path]:
+    """
+    Every file under root with an export suffix (.json, .json.gz, .csv,
+    .parquet), in a stable order, skipping anything inside `exclude` (the
+    summary's own output directory).
+    """
+    paths = [p for p in Path(root).rglob("*") if p.is_file() and p.name.lower().endswith(ANSWER_SUFFIXES)]
+    if exclude is None:
+        return sorted(paths)
+    skip = Path(exclude).resolve()
+    inside: dict[Path, bool] = {}  # one resolve per directory, not per file
+    for p in paths:
+        if p.parent not in inside:
+            inside[p.parent] = p.parent.resolve().is_relative_to(skip)
+    return sorted(p for p in paths if not inside[p.parent])
+
+
+def answer_stem(path: Path) -> str:
+    """The file name without its whole export suffix ("x_ranked.json.gz" -> "x_ranked")."""
+    name = path.name
+    for suffix in ANSWER_SUFFIXES:
+        if name.lower().endswith(suffix):
+            return name[: -len(suffix)]
+    return path.stem
+
+
+def _common_suffix(stems: list[str]) -> str:
+    """Longest "_"-delimited suffix shared by all stems that still leaves a non-empty prefix."""
+    parts = [s.split("_") for s in stems]
+    n = 0
+    while all(len(p) > n + 1 for p in parts) and len({p[-1 - n] for p in parts}) == 1:
+        n += 1
+    return "_".join(parts[0][len(parts[0]) - n:]) if n else ""
+
+
+def rater_names(paths: list[Path], root: Path, pair_file: str | None = None) -> list[str]:
+    """One rater name per path (see the module docstring)."""
+    root = Path(root)
+    stems = [answer_stem(p) for p in paths]
+    ranked = [s[: -len(RANKED_SUFFIX)] for s in stems if s.endswith(RANKED_SUFFIX)]
+    if pair_file is None:
+        suffix = _common_suffix(ranked) if len(set(ranked)) > 1 else ""
+    else:
+        suffix = re.sub(r"[^a-z0-9._-]+", "_", Path(pair_file).stem.lower())  # as app._slugify
+    names = []
+    for p, stem in zip(paths, stems):
+        if stem.endswith(RANKED_SUFFIX):
+            stem = stem[: -len(RANKED_SUFFIX)]
+            if suffix and stem.endswith("_" + suffix):
+                stem = stem[: -len(suffix) - 1]
+            names.append(stem)
+        elif p.parent != root:
+            names.append(p.parent.relative_to(root).as_posix())
+        else:
+            names.append(stem)
+    return names
+
+
+def _read_file(path: str):
+    """Pool task: (path, mtime, comparisons or None, error or None)."""
+    try:
+        return path, os.stat(path).st_mtime, read_results(path), None
+    except (OSError, ValueError) as e:  # json.JSONDecodeError is a ValueError
+        return path, 0.0, None, str(e)
+
+
+def latest_answers(comparisons: Comparisons) -> Comparisons:
+    """Drop repeated answers to the same unordered pair, keeping the last one."""
+    lo = np.minimum(comparisons.winner, comparisons.loser)
+    hi = np.maximum(comparisons.winner, comparisons.loser)
+    keep = ~pd.DataFrame({"lo": lo, "hi": hi}).duplicated(keep="last").to_numpy()
+    if keep.all():
+        return comparisons
+    return Comparisons(comparisons.winner[keep], comparisons.loser[keep], comparisons.confidence[keep])
+
+
+def kendall_tau_b(x: np.ndarray, y: np.ndarray, block: int = 1024) -> float:
+    """Kendall's τ_b (ties in either variable handled), O(n²) in row blocks of O(block·n) memory."""
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n < 2:
+        return float("nan")
+    s = 0
+    for i in range(0, n, block):
+        s += int((np.sign(x[i:i + block, None] - x) * np.sign(y[i:i + block, None] - y)).sum())
+    n0 = n * (n - 1) / 2
+    tx = sum(t * (t - 1) / 2 for t in np.unique(x, return_counts=True)[1].tolist())
+    ty = sum(t * (t - 1) / 2 for t in np.unique(y, return_counts=True)[1].tolist())
+    denom = np.sqrt((n0 - tx) * (n0 - ty))
+    return float(s / 2 / denom) if denom else float("nan")
+
+
+def _kappa(po, p1, p2):
+    """Cohen's κ for a binary label from observed agreement and the two raters' positive rates."""
+    pe = p1 * p2 + (1 - p1) * (1 - p2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(pe < 1, (po - pe) / (1 - pe), np.nan)
+
+
+def answer_table(raters: dict[str, Comparisons]) -> pd.DataFrame:
+    """One row per (rater, unordered pair): rater (categorical), lo, hi, lo_won, weight."""
+    names = list(raters)
+    comps = [raters[r] for r in names]
+    allc = Comparisons.concat(comps)
+    lo = np.minimum(allc.winner, allc.loser)
+    return pd.DataFrame({
+        "rater": pd.Categorical.from_codes(np.repeat(np.arange(len(names)), [len(c) for c in comps]), names),
+        "lo": lo,
+        "hi": np.maximum(allc.winner, allc.loser),
+        "lo_won": allc.winner == lo,
+        "weight": allc.confidence / 5.0,
+    })
+
+
+def pairwise_agreement(answers: pd.DataFrame) -> pd.DataFrame:
+    """One row per pair of raters with at least one shared pair."""
+    cols = ["rater_a", "rater_b", "shared_pairs", "agreement", "kendall_tau", "cohen_kappa",
+            "weighted_agreement", "weighted_kendall_tau", "weighted_cohen_kappa"]
+    t = answers.assign(code=answers["rater"].cat.codes)[["code", "lo", "hi", "lo_won", "weight"]]
+    m = t.merge(t, on=["lo", "hi"], suffixes=("_1", "_2"))
+    m = m[m["code_1"] < m["code_2"]]
+    if m.empty:
+        return pd.DataFrame({c: [] for c in cols})
+    w = m["weight_1"].to_numpy() * m["weight_2"].to_numpy()
+    y1, y2 = m["lo_won_1"].to_numpy(), m["lo_won_2"].to_numpy()
+    g = pd.DataFrame({
+        "code_1": m["code_1"].to_numpy(), "code_2": m["code_2"].to_numpy(),
+        "n": 1, "agree": y1 == y2, "y1": y1, "y2": y2,
+        "w": w, "w_agree": w * (y1 == y2), "w_y1": w * y1, "w_y2": w * y2,
+    }).groupby(["code_1", "code_2"], sort=True).sum()
+    n, wsum = g["n"].to_numpy(), g["w"].to_numpy()
+    po, p1, p2 = g["agree"] / n, g["y1"] / n, g["y2"] / n
+    wpo, wp1, wp2 = g["w_agree"] / wsum, g["w_y1"] / wsum, g["w_y2"] / wsum
+    names = answers["rater"].cat.categories
+    return pd.DataFrame({
+        "rater_a": names[g.index.get_level_values(0)],
+        "rater_b": names[g.index.get_level_values(1)],
+        "shared_pairs": n,
+        "agreement": po.to_numpy(),
+        "kendall_tau": 2 * po.to_numpy() - 1,
+        "cohen_kappa": _kappa(po.to_numpy(), p1.to_numpy(), p2.to_numpy()),
+        "weighted_agreement": wpo.to_numpy(),
+        "weighted_kendall_tau": 2 * wpo.to_numpy() - 1,
+        "weighted_cohen_kappa": _kappa(wpo.to_numpy(), wp1.to_numpy(), wp2.to_numpy()),
+    }, columns=cols)
+
+
+def fleiss_kappa(answers: pd.DataFrame, weighted: bool = False) -> tuple[float, int]:
+    """
+    Fleiss' κ over the pairs answered by at least two raters (variable number of
+    raters per pair), and how many such pairs there are. Weighted, every two
+    ratings of a pair agree with weight w₁·w₂ and the category rates use the weights.
+    """
+    w = answers["weight"].to_numpy() if weighted else np.ones(len(answers))
+    y = answers["lo_won"].to_numpy()
+    g = pd.DataFrame({"lo": answers["lo"], "hi": answers["hi"], "raters": 1,
+                      "n": w, "k": w * y, "sq": w * w, "sq_k": w * w * y}).groupby(["lo", "hi"]).sum()
+    g = g[g["raters"] >= 2]
+    if g.empty:
+        return float("nan"), 0
+    n, k, sq, sq_k = (g[c].to_numpy() for c in ("n", "k", "sq", "sq_k"))
+    # weighted share of agreeing ordered rater pairs (r ≠ s) within each item
+    p_i = (k * k - sq_k + (n - k) ** 2 - (sq - sq_k)) / (n * n - sq)
+    p = k.sum() / n.sum()
+    pe = p * p + (1 - p) * (1 - p)
+    kappa = (p_i.mean() - pe) / (1 - pe) if pe < 1 else float("nan")
+    return float(kappa), len(g)
+
+
+_consensus: pd.Series | None = None
+
+
+def _init_consensus(ids: np.ndarray, scores: np.ndarray) -> None:
+    global _consensus
+    _consensus = pd.Series(scores, index=ids)
+
+
+def _rater_stats(task) -> dict:
+    """Pool task: statistics of one rater against the consensus (set by _init_consensus)."""
+    rater, files, comp = task
+    own = BradleyTerryRanking().refit(comp)
+    cons = _consensus.reindex(own.ids).to_numpy()
+    beats = _consensus.reindex(comp.winner).to_numpy() > _consensus.reindex(comp.loser).to_numpy()
+    weight = comp.confidence / 5.0
+    return {
+        "rater": rater,
+        "files": files,
+        "answers": len(comp),
+        "patients": len(own),
+        "mean_confidence": float(comp.confidence.mean()) if len(comp) else float("nan"),
+        "consensus_agreement": float(beats.mean()) if len(comp) else float("nan"),
+        "weighted_consensus_agreement": float((weight * beats).sum() / weight.sum()) if len(comp) else float("nan"),
+        "kendall_tau_consensus": kendall_tau_b(own.scores(), cons),
+    }
+
+
+def _pool_map(fn, items, workers: int, chunksize: int = 1, **pool_kwargs):
+    if workers == 0:
+        if "initializer" in pool_kwargs:
+            pool_kwargs["initializer"](*pool_kwargs.get("initargs", ()))
+        return list(map(fn, items))
+    with ProcessPoolExecutor(max_workers=workers, **pool_kwargs) as pool:
+        return list(pool.map(fn, items, chunksize=chunksize))
+
+
+def run(root: Path, workers: int | None = None, pair_file: str | None = None,
+        exclude: Path | None = None) -> dict[str, pd.DataFrame]:
+    """
+    The whole pipeline; returns the summary tables. workers=None uses every
+    CPU, 0 runs everything in this process. Files inside `exclude` (the
+    output directory) are not read.
+    """
+    root = Path(root)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    paths = find_answer_files(root, exclude)
+    chunk = max(1, len(paths) // (4 * max(workers, 1)))
+    read = _pool_map(_read_file, [str(p) for p in paths], workers, chunksize=chunk)
+    errors = [f"{path}: {err}" for path, _, _, err in read if err is not None]
+    read = [r for r in read if r[3] is None]
+
+    by_rater: dict[str, list[tuple[float, str, Comparisons]]] = {}
+    for name, (path, mtime, comp, _) in zip(rater_names([Path(r[0]) for r in read], root, pair_file), read):
+        by_rater.setdefault(name, []).append((mtime, path, comp))
+    raters, files = {}, {}
+    for name, parts in by_rater.items():
+        parts.sort(key=lambda t: (t[0], t[1]))  # oldest first, so the latest answer wins
+        raters[name] = latest_answers(Comparisons.concat(c for _, _, c in parts))
+        files[name] = len(parts)
+
+    engine = BradleyTerryRanking().refit(Comparisons.concat(raters.values()))
+    consensus = engine.table()
+    answers = answer_table(raters)
+    seen = pd.DataFrame({
+        "rater": np.concatenate([answers["rater"].cat.codes.to_numpy()] * 2),
+        "patient_num": np.concatenate([answers["lo"].to_numpy(), answers["hi"].to_numpy()]),
+    }).drop_duplicates()
+    n_raters = seen.groupby("patient_num").size()
+    consensus["raters"] = n_raters.reindex(consensus["patient_num"]).to_numpy(np.int32)
+
+    tasks = [(name, files[name], raters[name]) for name in raters]
+    stats = _pool_map(_rater_stats, tasks, workers, chunksize=max(1, len(tasks) // (4 * max(workers, 1))),
+                      initializer=_init_consensus, initargs=(engine.ids, engine.scores()))
+
+    fleiss, items = fleiss_kappa(answers)
+    wfleiss, _ = fleiss_kappa(answers, weighted=True)
+    overall = pd.DataFrame([{
+        "files": len(paths), "unreadable_files": len(errors), "raters": len(raters),
+        "answers": len(answers), "patients": len(engine), "pairs_with_multiple_raters": items,
+        "fleiss_kappa": fleiss, "weighted_fleiss_kappa": wfleiss,
+    }])
+    return {
+        "consensus": consensus,
+        "raters": pd.DataFrame(stats),
+        "agreement": pairwise_agreement(answers),
+        "overall": overall,
+        "errors": pd.DataFrame({"error": errors}),
+    }
+
+
+def write_summary(tables: dict[str, pd.DataFrame], out: Path) -> list[Path]:
+    """One Parquet file per table (the "errors" list is only printed)."""
+    out = Path(out)
+    out.mkdir(parents=True, exist_ok=True)
+    written = []
+    for name, df in tables.items():
+        if name == "errors":
+            continue
+        dest = out / f"{name}.parquet"
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), dest)
+        written.append(dest)
+    return written
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Consensus ranking and inter-rater agreement over a directory of answer files.")
+    ap.add_argument("root", help="directory with *_ranked.* downloads and progress snapshots")
+    ap.add_argument("--out", default="consensus_summary", help="directory for the Parquet tables")
+    ap.add_argument("--workers", type=int, default=None, help="process pool size (0 = no pool; default: all CPUs)")
+    ap.add_argument("--pair-file", help="pairs file the raters worked on, stripped from the file names")
+    args = ap.parse_args(argv)
+
+    tables = run(Path(args.root), workers=args.workers, pair_file=args.pair_file, exclude=Path(args.out))
+    for line in tables["errors"]["error"]:
+        print(f"skipped {line}")
+    o = tables["overall"].to_dict("records")[0]
+    print(f"{o['files']:,} files, {o['raters']:,} raters, {o['answers']:,} answers, {o['patients']:,} patients")
+    print(f"Fleiss' kappa {o['fleiss_kappa']:.3f} (confidence-weighted {o['weighted_fleiss_kappa']:.3f}) "
+          f"over {o['pairs_with_multiple_raters']:,} pairs answered more than once")
+    print(tables["raters"].to_string(index=False, max_rows=20))
+    for path in write_summary(tables, Path(args.out)):
+        print(f"wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
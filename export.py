@@ -0,0 +1,129 @@
+"""
+Export of a rater's results as compact JSON, gzip-compressed JSON, CSV or Parquet.
+
+The app passes `st.download_button` a callable, so an export is only built
+when a download is actually requested, never on a rerun. Every format is
+encoded CHUNK_ROWS answers at a time straight into the output buffer: there is
+no indented copy of the payload, no full-size intermediate string next to the
+encoded bytes, and a gzip or Parquet export only ever holds its compressed
+form. (Streamlit keeps the finished file in its media store until the browser
+fetched it, so the bytes do not go out to the socket in chunks.)
+
+JSON keeps the structure of the earlier downloads, the results list or the
+progress snapshot dict, without the indentation. CSV and Parquet have one row
+per answer, with the columns winner, loser, confidence and inferred. Inferred
+pairs (see transitivity.py) have no confidence. `ranking.read_results` reads
+all four formats.
+"""
+import csv
+import io
+import json
+import zlib
+from collections.abc import Iterator
+from dataclasses import dataclass
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CHUNK_ROWS = 10_000
+COLUMNS = ("winner", "loser", "confidence", "inferred")
+PARQUET_SCHEMA = pa.schema([("winner", pa.int64()), ("loser", pa.int64()),
+                            ("confidence", pa.int8()), ("inferred", pa.bool_())])
+
+
+@dataclass(frozen=True)
+class ExportFormat:
+    label: str
+    suffix: str
+    mime: str
+
+
+FORMATS = {
+    "json": ExportFormat("JSON", ".json", "application/json"),
+    "json.gz": ExportFormat("JSON (gzip)", ".json.gz", "application/gzip"),
+    "csv": ExportFormat("CSV", ".csv", "text/csv"),
+    "parquet": ExportFormat("Parquet", ".parquet", "application/vnd.apache.parquet"),
+}
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _iter_json_list(items: list) -> Iterator[bytes]:
+    yield b"["
+    for start in range(0, len(items), CHUNK_ROWS):
+        chunk = _dumps(items[start:start + CHUNK_ROWS])[1:-1]
+        yield (f",{chunk}" if start else chunk).encode("utf-8")
+    yield b"]"
+
+
+def iter_json(payload) -> Iterator[bytes]:
+    """The payload (results list or snapshot dict) as compact JSON; its lists are encoded in chunks."""
+    if not isinstance(payload, dict):
+        yield from _iter_json_list(payload)
+        return
+    yield b"{"
+    for n, (key, value) in enumerate(payload.items()):
+        yield f"{',' if n else ''}{_dumps(key)}:".encode("utf-8")
+        if isinstance(value, list):
+            yield from _iter_json_list(value)
+        else:
+            yield _dumps(value).encode("utf-8")
+    yield b"}"
+
+
+def iter_gzip(chunks: Iterator[bytes], level: int = 6) -> Iterator[bytes]:
+    z = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks:
+        if out := z.compress(chunk):
+            yield out
+    yield z.flush()
+
+
+def iter_columns(payload) -> Iterator[dict[str, list]]:
+    """The answers, then the inferred pairs, as COLUMNS of at most CHUNK_ROWS rows."""
+    results = payload["results"] if isinstance(payload, dict) else payload
+    inferred = payload.get("inferred", []) if isinstance(payload, dict) else []
+    for start in range(0, len(results), CHUNK_ROWS):
+        chunk = results[start:start + CHUNK_ROWS]
+        yield {"winner": [int(pair[0]) for pair, _ in chunk], "loser": [int(pair[1]) for pair, _ in chunk],
+               "confidence": [int(conf) for _, conf in chunk], "inferred": [False] * len(chunk)}
+    for start in range(0, len(inferred), CHUNK_ROWS):
+        chunk = inferred[start:start + CHUNK_ROWS]
+        yield {"winner": [int(w) for w, _ in chunk], "loser": [int(l) for _, l in chunk],
+               "confidence": [None] * len(chunk), "inferred": [True] * len(chunk)}
+
+
+def iter_csv(payload) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(COLUMNS)
+    for cols in iter_columns(payload):
+        writer.writerows(zip(*(cols[c] for c in COLUMNS)))
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue().encode("utf-8")  # the header of an empty export
+
+
+def write_parquet(payload, sink) -> None:
+    """One row group per chunk of answers."""
+    with pq.ParquetWriter(sink, PARQUET_SCHEMA) as writer:
+        for cols in iter_columns(payload):
+            writer.write_table(pa.table(cols, schema=PARQUET_SCHEMA))
+
+
+def export_results(payload, fmt: str) -> io.BytesIO:
+    """The payload encoded as FORMATS[fmt], ready to be handed to st.download_button."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r} (expected one of {', '.join(FORMATS)}).")
+    out = io.BytesIO()
+    if fmt == "parquet":
+        write_parquet(payload, out)
+    else:
+        chunks = iter_csv(payload) if fmt == "csv" else iter_json(payload)
+        for chunk in iter_gzip(chunks) if fmt == "json.gz" else chunks:
+            out.write(chunk)
+    out.seek(0)
+    return out
@@ -0,0 +1,165 @@
+"""
+Generating pairs_for_ranking files from the patient table.
+
+The patients (read through `load_patient_df_from_repo`, so the same
+normalization and cache as the app) are put on a ring sorted by stratum: sex,
+then age band, then risk_percentile band, shuffled within each stratum. Pair
+(i, i + d) is formed for every position i and every offset d of a fixed set of
+k // 2 distinct offsets below n / 2 (plus the diametric offset n / 2 when k is
+odd). That is a circulant graph, so by construction:
+
+- every patient appears in exactly k pairs;
+- no unordered pair repeats (distinct offsets d < n / 2 never give the same
+  {i, i + d} twice);
+- each offset makes every patient X once and Y once, so X/Y is balanced exactly
+  (within one for odd k);
+- small offsets (1, 2, ...) pair neighbours on the ring, i.e. patients of the
+  same or an adjacent stratum; `cross_fraction` of the offsets are drawn from
+  [n / 8, n / 2) instead and pair distant strata, which keeps the comparison
+  graph connected across strata for the global ranking.
+
+The pair order is shuffled. The X/Y side is encoded in the written order
+relative to the app's seeded orientation draw (`pairs.orientation_bits`), so a
+JSON file shows each pair with the intended X; a .pairs file also stores the
+orientation column. Everything is a handful of numpy passes over n·k / 2 pairs.
+
+    python -m pairgen -o pairs_for_ranking.pairs [--patients patient_df.csv] [--k 20 | --pairs N]
+                      [--age-bands 45,55,65,75] [--risk-bands 25,50,75] [--cross 0.25] [--seed 0]
+"""
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from pairs import ORIENTATION_SEED, orientation_bits
+from pairs_io import PAIRS_SUFFIX, PairColumns, write_pairs_bin, write_pairs_json
+from patient_data import PATIENT_DF_PATH, load_patient_df_from_repo
+
+AGE_BANDS = (45, 55, 65, 75)
+RISK_BANDS = (25, 50, 75)
+
+
+def strata(df: pd.DataFrame, age_bands=AGE_BANDS, risk_bands=RISK_BANDS) -> np.ndarray:
+    """Stratum code per patient: (sex, age band, risk_percentile band), in that sort order."""
+    age = np.searchsorted(np.asarray(age_bands), df["age"].to_numpy(), side="right")
+    risk = np.searchsorted(np.asarray(risk_bands), df["risk_percentile"].to_numpy(), side="right")
+    _, sex = np.unique(df["sex"].to_numpy(), return_inverse=True)
+    return (sex * (len(age_bands) + 1) + age) * (len(risk_bands) + 1) + risk
+
+
+def _offsets(n: int, k: int, cross_fraction: float, rng: np.random.Generator) -> np.ndarray:
+    """k // 2 distinct ring offsets in [1, n / 2): the first ones local, a cross_fraction share far."""
+    half = k // 2
+    top = (n - 1) // 2  # largest offset d with d < n - d
+    if half > top:
+        raise ValueError(f"k={k} needs more than {2 * top + 1} patients (have {n}).")
+    n_cross = min(int(round(cross_fraction * half)), half)
+    local = np.arange(1, half - n_cross + 1)
+    lo = max(len(local) + 1, n // 8)
+    pool = np.arange(lo, top + 1)
+    if len(pool) < n_cross:  # small cohorts: take whatever offsets are left
+        pool = np.arange(len(local) + 1, top + 1)
+    far = rng.choice(pool, n_cross, replace=False) if n_cross else np.empty(0, np.int64)
+    return np.concatenate([local, np.sort(far)]).astype(np.int64)
+
+
+def generate_pairs(df: pd.DataFrame, k: int, age_bands=AGE_BANDS, risk_bands=RISK_BANDS,
+                   cross_fraction: float = 0.25, seed: int = 0,
+                   orientation_seed: int = ORIENTATION_SEED) -> PairColumns:
+    """
+    n·k / 2 pairs over df's patients (see the module docstring); x_is_a is the
+    orientation the app draws with orientation_seed, and a/b are ordered so
+    that patient_x is the one the generator put on the X side.
+    """
+    n = len(df)
+    if k < 1:
+        raise ValueError("k must be >= 1")
+    if k % 2 and n % 2:
+        raise ValueError(f"An odd k needs an even number of patients (have {n}).")
+    rng = np.random.default_rng(seed)
+    ids = df["patient_num"].to_numpy()
+    ring = ids[np.lexsort((rng.random(n), strata(df, age_bands, risk_bands)))]
+
+    pos = np.arange(n)
+    xs, ys = [], []
+    for d in _offsets(n, k, cross_fraction, rng).tolist():
+        xs.append(ring)
+        ys.append(ring[(pos + d) % n])
+    if k % 2:
+        half = n // 2
+        first, second = ring[:half], ring[half:]
+        flip = pos[:half] % 2 == 1  # alternate sides so X counts differ by at most one
+        xs.append(np.where(flip, second, first))
+        ys.append(np.where(flip, first, second))
+    x, y = np.concatenate(xs), np.concatenate(ys)
+
+    order = rng.permutation(len(x))
+    x, y = x[order], y[order]
+    x_is_a = orientation_bits(len(x), orientation_seed)
+    a = np.where(x_is_a, x, y).astype(np.int32)
+    b = np.where(x_is_a, y, x).astype(np.int32)
+    return PairColumns(a, b, x_is_a)
+
+
+def coverage(df: pd.DataFrame, pairs: PairColumns, age_bands=AGE_BANDS, risk_bands=RISK_BANDS) -> dict:
+    """Appearances and X share per patient, duplicate count and within-stratum share of the pairs."""
+    ids = df["patient_num"].to_numpy()
+    index = pd.Index(ids)
+    ai, bi = index.get_indexer(pairs.a), index.get_indexer(pairs.b)
+    x_is_a = pairs.x_is_a if pairs.x_is_a is not None else np.ones(len(pairs), dtype=bool)
+    appear = np.bincount(ai, minlength=len(ids)) + np.bincount(bi, minlength=len(ids))
+    as_x = np.bincount(np.where(x_is_a, ai, bi), minlength=len(ids))
+    code = strata(df, age_bands, risk_bands)
+    lo, hi = np.minimum(pairs.a, pairs.b), np.maximum(pairs.a, pairs.b)
+    return {
+        "pairs": len(pairs),
+        "patients": len(ids),
+        "appearances_min": int(appear.min()),
+        "appearances_max": int(appear.max()),
+        "x_minus_y_max": int(np.abs(2 * as_x - appear).max()),
+        "duplicate_pairs": int(pd.DataFrame({"lo": lo, "hi": hi}).duplicated().sum()),
+        "within_stratum": float((code[ai] == code[bi]).mean()) if len(pairs) else 0.0,
+    }
+
+
+def write_pairs(path: str | Path, pairs: PairColumns) -> None:
+    """Write .pairs (with the orientation column) or, for any other suffix, JSON."""
+    if Path(path).suffix.lower() == PAIRS_SUFFIX:
+        write_pairs_bin(path, pairs)
+    else:
+        write_pairs_json(path, pairs)
+
+
+def _bands(text: str) -> tuple[int, ...]:
+    return tuple(int(v) for v in text.split(",") if v.strip())
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Generate a pairs_for_ranking file from the patient table.")
+    ap.add_argument("-o", "--output", required=True, help="output file (.json or .pairs)")
+    ap.add_argument("--patients", default=str(PATIENT_DF_PATH), help="patient table (File A)")
+    size = ap.add_mutually_exclusive_group()
+    size.add_argument("--k", type=int, help="pairs per patient (default 20)")
+    size.add_argument("--pairs", type=int, help="target number of pairs (k = 2·pairs / patients)")
+    ap.add_argument("--age-bands", type=_bands, default=AGE_BANDS, help="age cut points, e.g. 45,55,65,75")
+    ap.add_argument("--risk-bands", type=_bands, default=RISK_BANDS, help="risk_percentile cut points")
+    ap.add_argument("--cross", type=float, default=0.25, help="share of offsets pairing distant strata")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--orientation-seed", type=int, default=ORIENTATION_SEED,
+                    help="orientation seed the app will use (42)")
+    args = ap.parse_args(argv)
+
+    df = load_patient_df_from_repo(args.patients)
+    k = args.k if args.k is not None else (max(1, 2 * args.pairs // len(df)) if args.pairs else 20)
+    t = time.perf_counter()
+    pairs = generate_pairs(df, k, args.age_bands, args.risk_bands, args.cross, args.seed, args.orientation_seed)
+    write_pairs(args.output, pairs)
+    print(f"wrote {args.output} in {time.perf_counter() - t:.2f}s")
+    for key, value in coverage(df, pairs, args.age_bands, args.risk_bands).items():
+        print(f"  {key:16} {value:,}" if isinstance(value, int) else f"  {key:16} {value:.3f}")
+
+
+if __name__ == "__main__":
+    main()
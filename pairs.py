@@ -0,0 +1,94 @@
+"""
+The session's pairs, prepared for the running stage.
+
+`PreparedPairs` keeps only the pair endpoints and one orientation bit per pair
+(plus a code into the shared alignment plans) as flat arrays. Patients are
+materialized from the patient store when a pair is actually accessed, so
+pressing Start is O(number of pairs) over small ints, whatever the cohort width.
+Each patient is built once per process as an immutable `PatientRecord` (see
+patient_store) and that one record is shared by every pair and every session it
+appears in. Pairs read from a `.pairs` file (see pairs_io) stay views into the
+mapped file.
+"""
+import random
+from collections.abc import Sequence
+
+import numpy as np
+import pandas as pd
+
+from pairs_io import pair_columns
+from patient_data import PatientRecord
+from patient_store import PatientStore
+from recs import build_pair_plan_index
+
+ORIENTATION_SEED = 42
+
+
+def orientation_bits(n: int, seed: int = ORIENTATION_SEED) -> np.ndarray:
+    """
+    x_is_a[i] == (random.Random(seed).random() < 0.5) for the i-th draw, i.e.
+    exactly the X/Y assignment of the original per-pair loop. numpy's MT19937
+    is loaded with the state of Python's generator, so the draws (and doubles)
+    are bit-identical while being generated in one vectorized call.
+    """
+    state = random.Random(seed).getstate()[1]
+    rs = np.random.RandomState()
+    rs.set_state(("MT19937", np.asarray(state[:624], dtype=np.uint32), state[624]))
+    return rs.random_sample(n) < 0.5
+
+
+def pair_orientation(cols, seed: int = ORIENTATION_SEED) -> np.ndarray:
+    """
+    The seeded X/Y draw for `cols`. After unique_pairs dropped duplicates it is
+    made over the list that still had them and then filtered (cols.draw_index),
+    so each pair gets the same bit as before duplicates were removed.
+    """
+    if cols.draw_index is None:
+        return orientation_bits(len(cols), seed)
+    if not len(cols):
+        return np.zeros(0, dtype=bool)
+    return orientation_bits(int(cols.draw_index[-1]) + 1, seed)[cols.draw_index]
+
+
+class PreparedPairs(Sequence):
+    """
+    Lazy list of prepared pairs. Item i is the same dict the eager version
+    stored: {"a", "b", "patient_x", "patient_y", "plan"}, built on access,
+    with patient_x / patient_y being the interned records. A plain DataFrame
+    gets a store of its own.
+    """
+
+    def __init__(self, patients: PatientStore | pd.DataFrame, pairs, seed: int = ORIENTATION_SEED):
+        cols = pair_columns(pairs)
+        self.a = cols.a  # kept as given: mapped .pairs columns are not copied
+        self.b = cols.b
+        # the file's own orientation column wins over the seeded draw
+        self.x_is_a = pair_orientation(cols, seed) if cols.x_is_a is None else cols.x_is_a
+
+        self.store = patients if isinstance(patients, PatientStore) else PatientStore(patients)
+
+        masks = self.store.column("rec_mask")
+        a_pos, b_pos = self.store.positions(self.a), self.store.positions(self.b)
+        if (a_pos < 0).any() or (b_pos < 0).any():
+            raise KeyError("pairs reference patient_num values missing from the patient table")
+        x_masks = np.where(self.x_is_a, masks[a_pos], masks[b_pos])
+        y_masks = np.where(self.x_is_a, masks[b_pos], masks[a_pos])
+        self._plan_codes, self._plans = build_pair_plan_index(x_masks, y_masks)
+
+    def __len__(self) -> int:
+        return len(self.a)
+
+    def patient(self, patient_num: int) -> PatientRecord:
+        return self.store.patient(patient_num)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        a, b = int(self.a[i]), int(self.b[i])
+        pa_, pb_ = self.patient(a), self.patient(b)
+        patient_x, patient_y = (pa_, pb_) if self.x_is_a[i] else (pb_, pa_)
+        return {"a": a, "b": b, "patient_x": patient_x, "patient_y": patient_y,
+                "plan": self._plans[self._plan_codes[i]]}
+
+    def unique_ids(self) -> np.ndarray:
+        return np.unique(np.concatenate([self.a, self.b]))
@@ -0,0 +1,410 @@
+"""
+Reading pairs files into compact int32 columns.
+
+JSON is parsed as a stream: the upload is read in fixed-size chunks, the
+complete entries of each chunk are checked against the `[[a, b], ...]` grammar
+(one regex over the whitespace-stripped bytes) and their numbers go straight
+into an `array('i')` buffer via numpy's text parser, so memory stays close to
+8 bytes per pair instead of a Python list of tuples. What json.load plus
+int(a), int(b) accepted is accepted, except non-integral numbers: integers,
+integral floats ("12.0") and quoted integers. A malformed entry or a trailing
+comma is reported by byte offset and line, a truncated file at its end. Pickles still have to be loaded whole, but
+are converted to the array in one numpy call.
+
+The binary `.pairs` format (layout below) holds the same pairs as two int32
+columns plus an optional orientation column; it is read without copying,
+through numpy.memmap for files on disk or the upload's own buffer.
+`python -m pairs_io SRC...` converts .json / .pkl files to it.
+
+Whatever the format, self-pairs are dropped and unordered duplicates ({a, b}
+seen before, in either order) are removed, keeping the first occurrence. The
+X/Y draw is still made over the list with the duplicates (see
+PairColumns.draw_index), so every pair keeps the side it was shown on before
+duplicates were removed and saved progress for such files lines up.
+"""
+import argparse
+import json
+import pickle
+import re
+import struct
+import zlib
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from patient_data import write_atomic
+
+CHUNK_BYTES = 1 << 20
+_MAX_ENTRY_BYTES = 1 << 16  # an unfinished entry longer than this is an error, not a chunk boundary
+
+_INT32_MIN, _INT32_MAX = np.iinfo(np.int32).min, np.iinfo(np.int32).max
+
+# a patient_num: an integer, an integral float ("12.0") or a quoted integer, as int() accepted them before
+_NUM = rb'(?:-?\d+(?:\.0+)?|"-?\d+")'
+# complete entries, each followed by its comma (exact grammar; used to locate errors and the tail)
+_ITEMS = re.compile(rb"(?:\s*\[\s*%s\s*,\s*%s\s*\]\s*,)*" % (_NUM, _NUM))
+# the same once whitespace is stripped, which is what the fast path checks (plain integers first)
+_COMPACT_INTS = re.compile(rb"(?:\[-?\d+,-?\d+\],)*")
+_COMPACT_ITEMS = re.compile(rb"(?:\[%s,%s\],)*" % (_NUM, _NUM))
+# what may remain at EOF: an optional last entry and the closing bracket
+_TAIL = re.compile(rb"\s*(?:\[\s*(%s)\s*,\s*(%s)\s*\]\s*)?\]\s*" % (_NUM, _NUM))
+# a proper prefix of one more entry, or of the closing bracket: the file ended early
+_TRUNCATED = re.compile(rb'\s*(?:\[\s*(?:"?-?[\d.]*"?\s*(?:,\s*(?:"?-?[\d.]*"?\s*(?:\]\s*)?)?)?)?)?')
+_HEAD = re.compile(rb"(?:\xef\xbb\xbf)?\s*\[")
+_WS = b" \t\r\n"
+_BRACKETS_TO_SPACES = bytes.maketrans(b'[],"', b"    ")
+
+
+class PairsFormatError(ValueError):
+    """A pairs file that does not parse; the message says where."""
+
+
+def _where(offset: int, line: int) -> str:
+    return f"byte {offset} (line {line})"
+
+
+def _read_chunk(file, n: int) -> bytes:
+    data = file.read(n)
+    return data.encode("utf-8") if isinstance(data, str) else data
+
+
+def _items_end(data: bytes, pos: int) -> int:
+    """Offset just past the last `],` in data[pos:], i.e. the end of the complete entries (pos if none)."""
+    i = data.rfind(b"]", pos)
+    for _ in range(3):  # skip the list's closing "]" and the last entry's, which have no comma after them
+        if i < 0:
+            break
+        j = i + 1
+        while j < len(data) and data[j] in _WS:
+            j += 1
+        if j < len(data) and data[j] == 0x2C:  # ","
+            return j + 1
+        i = data.rfind(b"]", pos, i)
+    return pos
+
+
+def _parse_items(region: bytes) -> np.ndarray | None:
+    """Numbers of a run of complete `[a, b],` entries, or None if it is not exactly that."""
+    compact = region.translate(None, _WS)
+    if _COMPACT_INTS.fullmatch(compact) is not None:
+        dtype = np.int64
+    elif _COMPACT_ITEMS.fullmatch(compact) is not None:
+        # integral floats (the grammar only allows ".0") are read as floats and cast by the caller
+        dtype = np.float64 if b"." in compact else np.int64
+    else:
+        return None
+    nums = np.fromstring(region.translate(_BRACKETS_TO_SPACES), dtype=dtype, sep=" ")
+    # whitespace inside a number ("1 2") survives the compact check but not the count
+    return nums if len(nums) == 2 * compact.count(b"]") else None
+
+
+def parse_pairs_json(file, chunk_bytes: int = CHUNK_BYTES) -> np.ndarray:
+    """Stream a JSON list of [a, b] into an (n, 2) int32 array (raw: no filtering)."""
+    buf = array("i")
+    pending = _read_chunk(file, chunk_bytes)
+    head = _HEAD.match(pending)
+    if head is None:
+        raise PairsFormatError(f"Expected a JSON list of [a, b] pairs at {_where(0, 1)}.")
+    pos, offset, line = head.end(), 0, 1  # offset/line: of pending[0] within the file
+    eof = items = False
+    while True:
+        end = _items_end(pending, pos)
+        if end > pos:
+            nums = _parse_items(pending[pos:end])
+            if nums is None:
+                end = _ITEMS.match(pending, pos).end()  # slow path: stop at the bad entry
+                break
+            if nums.min() < _INT32_MIN or nums.max() > _INT32_MAX:
+                bad = int(np.flatnonzero((nums < _INT32_MIN) | (nums > _INT32_MAX))[0])
+                raise PairsFormatError(f"patient_num {nums[bad]} does not fit in int32 (pair #{len(buf) // 2 + bad // 2}).")
+            buf.frombytes(nums.astype(np.int32).tobytes())
+            items = True
+        if eof or len(pending) - end > _MAX_ENTRY_BYTES:
+            break  # the tail check below either accepts the rest or reports where it goes wrong
+        # keep the unfinished entry, read on
+        line += pending.count(b"\n", 0, end)
+        offset += end
+        more = _read_chunk(file, chunk_bytes)
+        eof = not more
+        pending, pos = pending[end:] + more, 0
+
+    tail = _TAIL.match(pending, end)
+    if tail is None or tail.end() != len(pending):
+        if eof and _TRUNCATED.fullmatch(pending, end):
+            where = _where(offset + len(pending), line + pending.count(b"\n"))
+            raise PairsFormatError(f"Unexpected end of file at {where}: the list of pairs is not closed.")
+        bad = tail.end() if tail else end + len(pending[end:]) - len(pending[end:].lstrip())
+        where = _where(offset + bad, line + pending.count(b"\n", 0, bad))
+        raise PairsFormatError(f"Invalid pair entry at {where}: expected [a, b] with integer patient_num values.")
+    if tail.group(1) is None and items:
+        bad = end + len(pending[end:]) - len(pending[end:].lstrip())
+        where = _where(offset + bad, line + pending.count(b"\n", 0, bad))
+        raise PairsFormatError(f"Trailing comma before the closing bracket at {where}.")
+    if tail.group(1) is not None:
+        last = [int(float(g.strip(b'"'))) for g in tail.group(1, 2)]
+        if not all(_INT32_MIN <= v <= _INT32_MAX for v in last):
+            raise PairsFormatError(f"patient_num does not fit in int32 (pair #{len(buf) // 2}).")
+        buf.extend(last)
+    return np.frombuffer(buf, dtype=np.int32).reshape(-1, 2)
+
+
+def pairs_from_sequence(data) -> np.ndarray:
+    """A loaded list/tuple of (a, b) (e.g. from a pickle) as an (n, 2) int32 array (raw: no filtering)."""
+    if not isinstance(data, (list, tuple, np.ndarray)):
+        raise PairsFormatError("pairs_for_ranking must be a list/tuple of (a, b).")
+    try:
+        arr = np.asarray(data, dtype=np.int64)
+    except (TypeError, ValueError):
+        arr = None
+    if arr is None or arr.ndim != 2 or arr.shape[1] != 2:
+        if len(data) == 0:
+            return np.empty((0, 2), dtype=np.int32)
+        for i, t in enumerate(data):
+            if not (isinstance(t, (list, tuple, np.ndarray)) and len(t) == 2):
+                raise PairsFormatError(f"Invalid pair entry #{i}: expected (a, b), got {type(t).__name__} of length {len(t) if hasattr(t, '__len__') else '?'}.")
+            try:
+                int(t[0]), int(t[1])
+            except (TypeError, ValueError):
+                raise PairsFormatError(f"Invalid pair entry #{i}: patient_num values must be integers.") from None
+        raise PairsFormatError("pairs_for_ranking must be a list/tuple of (a, b).")
+    if arr.size and (arr.min() < _INT32_MIN or arr.max() > _INT32_MAX):
+        bad = int(np.flatnonzero(((arr < _INT32_MIN) | (arr > _INT32_MAX)).any(axis=1))[0])
+        raise PairsFormatError(f"Invalid pair entry #{bad}: patient_num does not fit in int32.")
+    return arr.astype(np.int32)
+
+
+@dataclass(frozen=True)
+class PairColumns:
+    """
+    A pairs list as columns: a[i], b[i] (int32) and, when the file carries one,
+    the X/Y orientation x_is_a[i]. The arrays may be read-only views into a
+    mapped file or an upload buffer. When unique_pairs dropped duplicates,
+    draw_index[i] is the pair's position among the file's non-self pairs, the
+    list the seeded X/Y draw is made over (see pairs.pair_orientation).
+    """
+    a: np.ndarray
+    b: np.ndarray
+    x_is_a: np.ndarray | None = None
+    draw_index: np.ndarray | None = None
+
+    def __len__(self) -> int:
+        return len(self.a)
+
+    def to_array(self) -> np.ndarray:
+        return np.column_stack([self.a, self.b])
+
+
+def pair_columns(pairs) -> PairColumns:
+    """PairColumns of a PairColumns, an (n, 2) array or a list of (a, b)."""
+    if isinstance(pairs, PairColumns):
+        return pairs
+    ab = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    return PairColumns(ab[:, 0], ab[:, 1])
+
+
+def unique_pairs(pairs: PairColumns) -> PairColumns:
+    """
+    Drop self-pairs and repeated unordered pairs (first occurrence wins, order
+    kept). Returns `pairs` itself when there is nothing to drop, so mapped
+    columns stay zero-copy. Dropping duplicates records each kept pair's
+    draw_index, so the X/Y draw does not shift for the pairs after them.
+    """
+    a, b = pairs.a, pairs.b
+    lo = np.minimum(a, b).astype(np.int64)
+    hi = np.maximum(a, b).astype(np.int64)
+    keys = (lo << 32) | (hi & 0xFFFFFFFF)
+    self_pair = lo == hi
+    dup = pd.Series(keys).duplicated(keep="first").to_numpy() & ~self_pair  # hash table, O(n)
+    drop = dup | self_pair
+    if not drop.any():
+        return pairs
+    keep = ~drop
+    draw_index = pairs.draw_index
+    if dup.any() and draw_index is None:
+        # self-pairs never took part in the draw, duplicates did
+        draw_index = np.cumsum(~self_pair) - 1
+    return PairColumns(a[keep], b[keep], None if pairs.x_is_a is None else pairs.x_is_a[keep],
+                       None if draw_index is None else draw_index[keep])
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Binary pairs format (.pairs)
+#
+# Little-endian, 32-byte header followed by the columns, each contiguous:
+#
+#   offset  size  field
+#        0     8  magic        b"CPIPAIRS"
+#        8     2  version      uint16, currently 1
+#       10     2  flags        uint16, bit 0: the orientation column is present,
+#                                      bit 1: pairs are known to be filtered (see below)
+#       12     4  header_size  uint32, offset of the first column (32)
+#       16     8  count        uint64, number of pairs n
+#       24     4  crc32        uint32, zlib.crc32 of everything after the header
+#       28     4  reserved     0
+#       32   4n  a            int32[n]
+#     32+4n  4n  b            int32[n]
+#     32+8n   n  x_is_a       uint8[n], 1 = a is shown as patient X (only with flag bit 0)
+#
+# write_pairs_bin sets bit 1 when the pairs have no self-pairs and no repeated
+# unordered pairs, so readers can skip that O(n) hashing pass; files without
+# it are filtered on read like any other format. Columns start at 4-byte
+# aligned offsets, so they map straight onto numpy arrays.
+
+PAIRS_MAGIC = b"CPIPAIRS"
+PAIRS_VERSION = 1
+PAIRS_SUFFIX = ".pairs"
+FLAG_ORIENTATION = 1
+FLAG_UNIQUE = 2
+_HEADER = struct.Struct("<8sHHIQII")
+
+
+def _body_size(count: int, flags: int) -> int:
+    return 8 * count + (count if flags & FLAG_ORIENTATION else 0)
+
+
+def write_pairs_bin(path: str | Path, pairs, x_is_a: np.ndarray | None = None) -> None:
+    """Write `pairs` (PairColumns, (n, 2) array or list of (a, b)) as a .pairs file, atomically."""
+    cols = pair_columns(pairs)
+    if x_is_a is None:
+        x_is_a = cols.x_is_a
+    a = np.ascontiguousarray(cols.a, dtype="<i4")
+    b = np.ascontiguousarray(cols.b, dtype="<i4")
+    if not (np.array_equal(a, cols.a) and np.array_equal(b, cols.b)):
+        raise PairsFormatError("patient_num does not fit in int32.")
+    parts = [a.data, b.data]
+    flags = FLAG_UNIQUE if len(unique_pairs(PairColumns(a, b))) == len(a) else 0
+    if x_is_a is not None:
+        parts.append(np.ascontiguousarray(x_is_a, dtype=np.uint8).data)
+        flags |= FLAG_ORIENTATION
+    crc = 0
+    for part in parts:
+        crc = zlib.crc32(part, crc)
+    header = _HEADER.pack(PAIRS_MAGIC, PAIRS_VERSION, flags, _HEADER.size, len(a), crc, 0)
+
+    def write(tmp: Path) -> None:
+        with open(tmp, "wb") as f:
+            f.write(header)
+            for part in parts:
+                f.write(part)
+
+    write_atomic(Path(path), write)
+
+
+def write_pairs_json(path: str | Path, pairs) -> None:
+    """Write `pairs` as the `[[a, b], ...]` JSON list the app uploads, atomically."""
+    cols = pair_columns(pairs)
+    data = json.dumps(np.column_stack([cols.a, cols.b]).tolist(), separators=(",", ":"))
+    write_atomic(Path(path), lambda tmp: tmp.write_text(data, encoding="utf-8"))
+
+
+def read_pairs_bin(source, verify: bool = True) -> PairColumns:
+    """
+    Columns of a .pairs file without copying them: `source` is a path (mapped
+    with numpy.memmap) or an in-memory upload (BytesIO / bytes, viewed through
+    its buffer). `verify` checks the CRC32, which reads but does not copy the body.
+    """
+    return _read_pairs_bin(source, verify)[0]
+
+
+def _read_pairs_bin(source, verify: bool) -> tuple[PairColumns, int]:
+    if isinstance(source, (str, Path)):
+        buf = np.memmap(source, dtype=np.uint8, mode="r")
+    elif hasattr(source, "getvalue"):
+        # BytesIO built from bytes (as uploads are) hands back that same object: no copy
+        buf = np.frombuffer(source.getvalue(), dtype=np.uint8)
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        buf = np.frombuffer(source, dtype=np.uint8)
+    else:
+        buf = np.frombuffer(source.read(), dtype=np.uint8)
+
+    if len(buf) < _HEADER.size:
+        raise PairsFormatError(f"Not a pairs file: {len(buf)} bytes, shorter than the {_HEADER.size}-byte header.")
+    magic, version, flags, header_size, count, crc, _ = _HEADER.unpack_from(buf, 0)
+    if magic != PAIRS_MAGIC:
+        raise PairsFormatError(f"Not a pairs file: bad magic {magic!r} at byte 0.")
+    if version != PAIRS_VERSION:
+        raise PairsFormatError(f"Unsupported pairs file version {version} at byte 8 (expected {PAIRS_VERSION}).")
+    if header_size < _HEADER.size or header_size % 4:
+        raise PairsFormatError(f"Bad header size {header_size} at byte 12.")
+    expected = header_size + _body_size(count, flags)
+    if len(buf) != expected:
+        raise PairsFormatError(f"Pairs file is {len(buf)} bytes; the header (count {count}) says {expected}.")
+    body = buf[header_size:]
+    if verify and zlib.crc32(body) != crc:
+        raise PairsFormatError("Pairs file checksum mismatch (corrupted or truncated).")
+
+    a = body[: 4 * count].view("<i4")
+    b = body[4 * count: 8 * count].view("<i4")
+    x_is_a = None
+    if flags & FLAG_ORIENTATION:
+        x_is_a = body[8 * count:]
+        if verify and x_is_a.max(initial=0) > 1:
+            raise PairsFormatError("Pairs file orientation column holds values other than 0/1.")
+        x_is_a = x_is_a.view(np.bool_)
+    return PairColumns(a, b, x_is_a), flags
+
+
+def read_pairs(file, name: str | None = None) -> PairColumns:
+    """
+    Pairs from an uploaded .pairs (mapped), .json (streamed) or .pkl (default
+    for other suffixes) file, self-pairs and unordered duplicates removed.
+    """
+    suffix = Path(name if name is not None else getattr(file, "name", "")).suffix.lower()
+    if suffix == PAIRS_SUFFIX:
+        pairs, flags = _read_pairs_bin(file, verify=True)
+        if flags & FLAG_UNIQUE and len(pairs):
+            return pairs
+    elif suffix == ".json":
+        pairs = pair_columns(parse_pairs_json(file))
+    else:
+        try:
+            data = pickle.load(file)
+        except Exception as e:
+            raise PairsFormatError(f"Failed to parse PKL: {e}") from e
+        pairs = pair_columns(pairs_from_sequence(data))
+    pairs = unique_pairs(pairs)
+    if not len(pairs):
+        raise PairsFormatError("No valid pairs found in the file.")
+    return pairs
+
+
+def convert_pairs_file(src: str | Path, dst: str | Path | None = None,
+                       orientation_seed: int | None = None) -> Path:
+    """
+    Convert a .json / .pkl pairs file to .pairs (next to it unless `dst` is
+    given). With `orientation_seed` the X/Y draw the app would make with that
+    seed is stored in the orientation column; without it a file that had
+    duplicates loses their draw positions, so its pairs may be shown on other
+    sides than when the source file itself is uploaded.
+    """
+    src = Path(src)
+    dst = Path(dst) if dst is not None else src.with_suffix(PAIRS_SUFFIX)
+    with open(src, "rb") as f:
+        pairs = read_pairs(f, src.name)
+    x_is_a = None
+    if orientation_seed is not None:
+        from pairs import pair_orientation  # deferred: pulls in the patient/recs modules
+        x_is_a = pair_orientation(pairs, orientation_seed)
+    write_pairs_bin(dst, pairs, x_is_a)
+    return dst
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Convert .json / .pkl pairs files to the binary .pairs format.")
+    ap.add_argument("src", nargs="+", help="pairs files to convert")
+    ap.add_argument("-o", "--output", help="output path (only with a single input)")
+    ap.add_argument("--orientation-seed", type=int, default=None,
+                    help="also store the X/Y orientation drawn with this seed (the app uses 42)")
+    args = ap.parse_args(argv)
+    if args.output and len(args.src) > 1:
+        ap.error("--output needs exactly one input file")
+    for src in args.src:
+        dst = convert_pairs_file(src, args.output, args.orientation_seed)
+        print(f"{src} -> {dst} ({len(read_pairs_bin(dst, verify=False)):,} pairs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Loading of the patient table (File A) with an on-disk columnar cache.
+
+The first load parses the CSV/XLSX/PKL and runs the dtype normalization, then
+writes the typed table to an uncompressed Arrow IPC sidecar under
+`.cache/` next to the source. Later loads memory-map the sidecar instead of
+re-parsing, so reruns stay in the low milliseconds even for millions of rows.
+
+The sidecar is keyed by the source's size, mtime and sha256: a stat that still
+matches skips hashing entirely, a touched-but-identical file only refreshes the
+metadata, and any content change rebuilds the cache.
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from collections.abc import Mapping
+from dataclasses import dataclass
+from os import PathLike
+from pathlib import Path
+from typing import ClassVar
+
+import pandas as pd
+import pyarrow as pa
+
+from recs import NO_RECS, dls_for_mask, rec_mask_from_row, rec_masks
+
+# bump when the normalization below changes, so old sidecars get rebuilt
+CACHE_VERSION = 2
+CACHE_DIR_NAME = ".cache"
+
+PATIENT_DF_PATH = (Path(__file__).parent / "patient_df.csv").resolve()
+
+REQUIRED_COLUMNS = {"patient_num", "age", "risk", "risk_percentile", "sex", "adherence", "bmi", "smoker", "socio_economic"}
+
+
+def _read_source(path: Path) -> pd.DataFrame:
+    suf = path.suffix.lower()
+    if suf == ".csv":
+        return pd.read_csv(path)
+    if suf == ".xlsx":
+        # pip install openpyxl
+        return pd.read_excel(path, engine="openpyxl")
+    if suf == ".xls":
+        # pip install xlrd==1.2.0  (or convert to .xlsx)
+        return pd.read_excel(path, engine="xlrd")
+    if suf in (".pkl", ".pickle"):
+        return pd.read_pickle(path)
+    raise ValueError(f"Unsupported File A extension: {suf}")
+
+
+def normalize_patient_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Validate required columns and cast everything to the types the app expects."""
+    df.columns = [str(c) for c in df.columns]
+    missing = REQUIRED_COLUMNS - set(df.columns)
+    if missing:
+        raise ValueError(f"patient_df missing required columns: {missing}")
+
+    rec_cols = [c for c in df.columns if re.fullmatch(r"rec\d+", c)]
+    # Ensure rec1..rec21 exist and are ints
+    for i in range(1, len(rec_cols) + 1):
+        col = f"rec{i}"
+        if col not in df.columns:
+            df[col] = 0
+        df[col] = df[col].fillna(0).astype(int)
+
+    df["patient_num"] = df["patient_num"].astype(int)
+    df["age"] = df["age"].astype(int)
+    df["risk"] = df["risk"].astype(int)
+    df["risk_percentile"] = df["risk_percentile"].astype(int)
+    df["sex"] = df["sex"].astype(int)
+    df["bmi"] = df["bmi"].astype(float)
+    df["adherence"] = df["adherence"].astype(str)
+    # df["diabetes"] = df["diabetes"].astype(int)
+    df["smoker"] = df["smoker"].astype(int)
+    df["socio_economic"] = df["socio_economic"].astype(int)
+    # packed rec1..recN flags (see recs.py), cached alongside the typed columns
+    df["rec_mask"] = rec_masks(df)
+    return df
+
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while chunk := fh.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_paths(path: Path, tag: str = "") -> tuple[Path, Path]:
+    """Return (data, meta) sidecar paths for a source file; `tag` names derived artifacts."""
+    cache_dir = path.parent / CACHE_DIR_NAME
+    return cache_dir / f"{path.name}{tag}.arrow", cache_dir / f"{path.name}{tag}.meta.json"
+
+
+def read_meta(meta_path: Path) -> dict | None:
+    try:
+        return json.loads(meta_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def write_atomic(dest: Path, write) -> None:
+    """Call write(tmp) on a temporary sibling of dest, then rename it over dest."""
+    # per thread, not just per process: sessions are threads and may build the same sidecar at once
+    tmp = dest.with_name(dest.name + f".tmp{os.getpid()}.{threading.get_ident()}")
+    try:
+        write(tmp)
+        os.replace(tmp, dest)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _write_ipc(table: pa.Table, dest: Path) -> None:
+    with pa.OSFile(str(dest), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def write_sidecar(table: pa.Table, data_path: Path, meta_path: Path, meta: dict,
+                  single_batch: bool = True) -> None:
+    """Atomically write an Arrow table + its JSON meta into the cache dir."""
+    data_path.parent.mkdir(parents=True, exist_ok=True)
+    if single_batch:
+        # one uncompressed record batch, so every column maps to a single contiguous buffer
+        table = table.combine_chunks()
+    write_atomic(data_path, lambda p: _write_ipc(table, p))
+    write_atomic(meta_path, lambda p: p.write_text(json.dumps(meta), encoding="utf-8"))
+
+
+def read_sidecar(data_path: Path) -> pa.Table:
+    """Memory-map a sidecar written by write_sidecar (no decoding, no copy)."""
+    return pa.ipc.open_file(pa.memory_map(str(data_path))).read_all()
+
+
+def dataset_sha256(path: Path | str | PathLike) -> str | None:
+    """sha256 of the source as recorded by the current table sidecar, if there is one."""
+    meta = read_meta(cache_paths(Path(path))[1])
+    if meta and meta.get("version") == CACHE_VERSION:
+        return meta.get("sha256")
+    return None
+
+
+def current_dataset_sha256(path: Path | str | PathLike) -> str | None:
+    """dataset_sha256, but None unless the source still has the size and mtime recorded with it (one stat)."""
+    path = Path(path)
+    meta = read_meta(cache_paths(path)[1])
+    if not meta or meta.get("version") != CACHE_VERSION:
+        return None
+    try:
+        st_ = path.stat()
+    except OSError:
+        return None
+    if meta.get("size") == st_.st_size and meta.get("mtime_ns") == st_.st_mtime_ns:
+        return meta.get("sha256")
+    return None
+
+
+def _read_cache(data_path: Path) -> pd.DataFrame:
+    """
+    Memory-map the sidecar. Numeric columns are zero-copy views of the mapping
+    (read-only: assign new columns rather than writing into existing ones).
+    """
+    table = read_sidecar(data_path)
+    cols = {}
+    for name, col in zip(table.column_names, table.columns):
+        try:
+            cols[name] = col.chunk(0).to_numpy(zero_copy_only=True) if col.num_chunks == 1 else col.to_numpy()
+        except pa.ArrowInvalid:
+            cols[name] = col.to_pandas()  # strings
+    return pd.DataFrame(cols, copy=False)
+
+
+def load_patient_df_from_repo(path: Path | str | PathLike, use_cache: bool = True) -> pd.DataFrame:
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"File A not found at: {path}")
+    if not use_cache:
+        return normalize_patient_df(_read_source(path))
+
+    data_path, meta_path = cache_paths(path)
+    st_ = path.stat()
+    meta = read_meta(meta_path)
+    if meta and meta.get("version") == CACHE_VERSION and data_path.exists():
+        # fast path: nothing about the source changed since the cache was built
+        if meta.get("size") == st_.st_size and meta.get("mtime_ns") == st_.st_mtime_ns:
+            try:
+                return _read_cache(data_path)
+            except (OSError, pa.ArrowInvalid):
+                pass  # truncated/corrupt sidecar: fall through and rebuild
+        # touched (git checkout, copy) but same bytes: refresh the key, keep the data
+        digest = file_sha256(path)
+        if meta.get("sha256") == digest:
+            meta.update(size=st_.st_size, mtime_ns=st_.st_mtime_ns)
+            try:
+                write_atomic(meta_path, lambda p: p.write_text(json.dumps(meta), encoding="utf-8"))
+            except OSError:
+                pass
+            try:
+                return _read_cache(data_path)
+            except (OSError, pa.ArrowInvalid):
+                pass
+    else:
+        digest = None
+
+    df = normalize_patient_df(_read_source(path))
+    meta = {
+        "version": CACHE_VERSION,
+        "source": path.name,
+        "size": st_.st_size,
+        "mtime_ns": st_.st_mtime_ns,
+        "sha256": digest or file_sha256(path),
+        "rows": int(len(df)),
+    }
+    try:
+        write_sidecar(pa.Table.from_pandas(df, preserve_index=False), data_path, meta_path, meta)
+    except OSError:
+        # read-only checkout: still serve the parsed table, just without a sidecar
+        pass
+    return df
+
+
+@dataclass(frozen=True, slots=True)
+class PatientRecord(Mapping):
+    """
+    Immutable, slotted patient record. Recommendations are not stored: they are
+    derived from rec_mask and shared with every other patient that has the same
+    mask. Also a read-only mapping over the same keys as the old patient dicts,
+    so `p["age"]`, `p.get("recommendations")` etc. keep working.
+    """
+    id: int
+    age: int
+    risk: int
+    risk_percentile: int
+    sex: int
+    bmi: float
+    adherence: str
+    smoker: int
+    socio_economic: int
+    rec_mask: int
+
+    _KEYS: ClassVar[tuple[str, ...]] = (
+        "id", "age", "risk", "risk_percentile", "sex", "bmi", "adherence",
+        "smoker", "socio_economic", "recommendations", "rec_mask",
+    )
+
+    @property
+    def recommendations(self) -> tuple[str, ...]:
+        return dls_for_mask(self.rec_mask) or (NO_RECS,)
+
+    def __getitem__(self, key: str):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self) -> int:
+        return len(self._KEYS)
+
+
+def normalize_patient(row_dict: dict) -> PatientRecord:
+    """One patient row (raw or normalized) -> PatientRecord."""
+    mask = int(row_dict["rec_mask"]) if "rec_mask" in row_dict else rec_mask_from_row(row_dict)
+    return PatientRecord(
+        id=int(row_dict.get("patient_num")),
+        age=int(row_dict.get("age")),
+        risk=int(row_dict.get("risk")),
+        risk_percentile=int(row_dict.get("risk_percentile")),
+        # risk_band=int(row_dict.get("risk_band")),
+        sex=int(row_dict.get("sex")),
+        bmi=float(row_dict.get("bmi")),
+        adherence=sys.intern(str(row_dict.get("adherence"))),
+        # diabetes=int(row_dict.get("diabetes")),
+        smoker=int(row_dict.get("smoker")),
+        socio_economic=int(row_dict.get("socio_economic")),
+        rec_mask=mask,
+    )
@@ -0,0 +1,65 @@
+"""
+The patient table as one read-only store shared by every session of a process.
+
+A `PatientStore` owns the normalized table, its patient_num index, the column
+arrays, the interned `PatientRecord`s and the card fragments. The app builds
+one per dataset sha256 through `st.cache_resource`; sessions only keep a
+reference to it (through their PreparedPairs), so memory does not grow with
+the number of concurrent raters.
+
+Nothing in the store is written after construction except the two memo
+tables (records and fragments), which only ever gain entries that are
+identical whichever session builds them first.
+"""
+import threading
+from os import PathLike
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cards import CardFragments, load_card_fragments
+from patient_data import PatientRecord, normalize_patient
+
+
+def _read_only(arr: np.ndarray) -> np.ndarray:
+    view = arr.view()
+    view.flags.writeable = False
+    return view
+
+
+class PatientStore:
+    def __init__(self, df: pd.DataFrame, sha256: str | None = None):
+        self.df = df
+        self.sha256 = sha256
+        self.index = pd.Index(df["patient_num"].to_numpy())
+        self._columns = {c: _read_only(df[c].to_numpy()) for c in df.columns}
+        self._records: dict[int, PatientRecord] = {}  # interned per patient_num
+        self._fragments: CardFragments | None = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def column(self, name: str) -> np.ndarray:
+        return self._columns[name]
+
+    def positions(self, patient_nums) -> np.ndarray:
+        """Row of every patient_num, -1 where it is not in the table."""
+        return self.index.get_indexer(patient_nums)
+
+    def patient(self, patient_num: int) -> PatientRecord:
+        rec = self._records.get(patient_num)
+        if rec is None:
+            pos = self.index.get_loc(patient_num)
+            rec = normalize_patient({c: col[pos] for c, col in self._columns.items()})
+            # sessions racing on the same patient build equal records; all of them keep the first
+            rec = self._records.setdefault(patient_num, rec)
+        return rec
+
+    def card_fragments(self, source_path: Path | str | PathLike) -> CardFragments:
+        """The cohort's static card sections (see cards.load_card_fragments), loaded once."""
+        with self._lock:
+            if self._fragments is None:
+                self._fragments = load_card_fragments(self.df, source_path)
+            return self._fragments
@@ -0,0 +1,107 @@
+"""
+Look-ahead rendering of the next pairs in the running stage.
+
+While the rater reads pair idx, a background thread renders pairs idx+1 …
+idx+K (alignment plan plus both unselected cards) into a per-session buffer,
+so showing the next pair after a Submit is a dictionary lookup. The worker
+thread only lives while the window has pairs left to render.
+
+`ahead(idx)` moves the window to idx … idx+K: entries outside it are dropped
+and a render finishing for a pair that left the window is discarded. A resume
+that jumps idx, or an adaptive / transitive order that does not go on to
+idx+1, therefore never reads a stale entry; such pairs miss and are rendered
+inline. An entry depends only on its pair index, the prepared pairs and the
+card fragments, which are fixed for one prefetcher (the app makes a new one at
+every Start).
+"""
+import threading
+from dataclasses import dataclass
+from typing import Callable
+
+from cards import CardFragments, patient_card_html
+from recs import build_pair_recs_alignment_plan
+
+
+@dataclass(frozen=True)
+class RenderedPair:
+    category_order: list[str]
+    per_category_master: dict[str, list[str]]
+    card_x: str
+    card_y: str
+
+
+def render_pair(pair: dict, fragments: CardFragments | None = None) -> RenderedPair:
+    """The alignment plan and both cards (unselected, see cards.selected_frame_style) of one prepared pair."""
+    pX, pY = pair["patient_x"], pair["patient_y"]
+    cat_order, per_cat_master = pair.get("plan") or build_pair_recs_alignment_plan(pX, pY)
+    card_x = patient_card_html("Patient X", pX, False, side="left", category_order=cat_order,
+                               per_category_master=per_cat_master, fragments=fragments)
+    card_y = patient_card_html("Patient Y", pY, False, side="right", category_order=cat_order,
+                               per_category_master=per_cat_master, fragments=fragments)
+    return RenderedPair(cat_order, per_cat_master, card_x, card_y)
+
+
+class PairPrefetcher:
+    def __init__(self, pairs, fragments: CardFragments | None = None, depth: int = 3,
+                 render: Callable[[dict, CardFragments | None], RenderedPair] = render_pair):
+        self._pairs = pairs
+        self._fragments = fragments
+        self.depth = depth
+        self._render = render
+
+        self._cond = threading.Condition()
+        self._buffer: dict[int, RenderedPair] = {}
+        self._failed: set[int] = set()  # render raised: left to the inline path
+        self._window = range(0)
+        self._thread: threading.Thread | None = None
+        self.hits = 0
+        self.misses = 0
+
+    def take(self, i: int) -> RenderedPair | None:
+        """Pair i if it is buffered, else None (render it inline and `put` it)."""
+        with self._cond:
+            entry = self._buffer.get(i)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def put(self, i: int, entry: RenderedPair) -> None:
+        """Keep an inline render of the current pair (followed by `ahead(i)`), so its reruns hit."""
+        with self._cond:
+            self._buffer[i] = entry
+
+    def ahead(self, idx: int) -> None:
+        """Move the window to idx … idx+depth and render what it is missing in the background."""
+        window = range(idx, min(idx + self.depth + 1, len(self._pairs)))
+        with self._cond:
+            if window == self._window:
+                return
+            self._window = window
+            for i in [i for i in self._buffer if i not in window]:
+                del self._buffer[i]
+            self._failed.intersection_update(window)
+            if self._next_missing() is not None and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name="pair-prefetch", daemon=True)
+                self._thread.start()
+
+    def _next_missing(self) -> int | None:
+        return next((i for i in self._window if i not in self._buffer and i not in self._failed), None)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                i = self._next_missing()
+                if i is None:
+                    self._thread = None
+                    return
+            try:
+                entry = self._render(self._pairs[i], self._fragments)
+            except Exception:
+                with self._cond:
+                    self._failed.add(i)
+                continue
+            with self._cond:
+                if i in self._window:  # the window may have moved on while rendering
+                    self._buffer[i] = entry
@@ -0,0 +1,443 @@
+"""
+Global patient ranking from the collected answers.
+
+Every answer is one comparison ((winner, loser), confidence): the winner is
+the patient the rater prioritized. The engines below turn a stream of them into
+a score per patient, a priority order (highest score first) and a per-patient
+uncertainty:
+
+- `EloRanking`: classic Elo, K scaled by confidence. Sequential by definition,
+  so a refit replays the log.
+- `BradleyTerryRanking`: P(i over j) = σ(θi − θj) with a Gaussian prior. Each
+  answer is folded in with one O(1) diagonal Newton step for the two patients;
+  `refit()` solves the whole log in vectorized passes, either by Newton or by
+  Hunter's MM iterations (MM regularizes with virtual games instead of the
+  Gaussian prior). Uncertainty is the Laplace standard deviation.
+- `TrueSkillRanking`: Gaussian belief (μ, σ) per patient with the two-player,
+  no-draw TrueSkill update, partially applied by confidence; refit replays.
+
+`add()` is O(1) amortized for all three (patients are interned into growable
+arrays on first sight), so the engines scale to 10^6 patients; ordering is an
+argsort on demand. `read_results()` accepts everything the app writes: the
+downloaded results in every export format, progress snapshots (with or without
+folded deltas) and progress_deltas rows.
+
+    python -m ranking rankings.json [more.json ...] [--model bt] [--top 20] [--csv out.csv]
+"""
+import argparse
+import gzip
+import json
+import math
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class Comparisons:
+    """Answers as columns: winner[k] was preferred over loser[k] with confidence[k] (1..5)."""
+    winner: np.ndarray
+    loser: np.ndarray
+    confidence: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.winner)
+
+    @classmethod
+    def from_results(cls, items) -> "Comparisons":
+        """From [[winner, loser], conf] items (the results list) or progress_deltas rows."""
+        win, lose, conf = [], [], []
+        for k, item in enumerate(items):
+            try:
+                if isinstance(item, dict):
+                    w, l, c = item["a"], item["b"], item["confidence"]
+                else:
+                    (w, l), c = item
+                win.append(int(w)), lose.append(int(l)), conf.append(int(c))
+            except (TypeError, ValueError, KeyError):
+                raise ValueError(f"Invalid result entry #{k}: expected [[winner, loser], confidence].") from None
+        return cls(np.asarray(win, dtype=np.int64), np.asarray(lose, dtype=np.int64),
+                   np.asarray(conf, dtype=np.int8))
+
+    @classmethod
+    def concat(cls, parts) -> "Comparisons":
+        parts = list(parts)
+        if not parts:
+            return cls(np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int8))
+        return cls(*(np.concatenate([getattr(p, f) for p in parts]) for f in ("winner", "loser", "confidence")))
+
+
+def read_results(source) -> Comparisons:
+    """
+    Comparisons from a results download (list of [[winner, loser], conf]), a
+    progress snapshot ({"results": [...], ...}) or a list of progress_deltas
+    rows. `source` is a path, an open file, or the already-parsed JSON value.
+    Paths may also be the app's other exports (see export.py): .json.gz, .csv
+    or .parquet, whose inferred rows are skipped like a snapshot's "inferred".
+    """
+    if isinstance(source, (str, Path)):
+        name = str(source).lower()
+        if name.endswith((".csv", ".parquet")):
+            df = pd.read_parquet(source) if name.endswith(".parquet") else pd.read_csv(source)
+            if not {"winner", "loser", "confidence", "inferred"} <= set(df.columns):
+                raise ValueError("Expected the columns winner, loser, confidence, inferred.")
+            df = df[~df["inferred"].astype(bool)]
+            return Comparisons(df["winner"].to_numpy(np.int64), df["loser"].to_numpy(np.int64),
+                               df["confidence"].to_numpy(np.int8))
+        with (gzip.open if name.endswith(".gz") else open)(source, "rb") as f:
+            data = json.load(f)
+    elif hasattr(source, "read"):
+        data = json.load(source)
+    else:
+        data = source
+    if isinstance(data, dict):
+        if "results" not in data:
+            raise ValueError("Progress snapshot has no 'results'.")
+        data = data["results"]
+    if not isinstance(data, list):
+        raise ValueError("Expected a results list or a progress snapshot.")
+    return Comparisons.from_results(data)
+
+
+class _Growable:
+    """Append-only numpy column with amortized O(1) appends."""
+
+    def __init__(self, dtype, fill=0, capacity: int = 1024):
+        self._data = np.full(capacity, fill, dtype=dtype)
+        self._fill = fill
+        self.n = 0
+
+    def grow_to(self, n: int) -> None:
+        if n > len(self._data):
+            new = np.full(max(n, 2 * len(self._data)), self._fill, dtype=self._data.dtype)
+            new[: self.n] = self._data[: self.n]
+            self._data = new
+        self.n = max(self.n, n)
+
+    def append(self, value) -> None:
+        self.grow_to(self.n + 1)
+        self._data[self.n - 1] = value
+
+    @property
+    def raw(self) -> np.ndarray:
+        """The backing array (valid prefix: [:n]); writes go through."""
+        return self._data
+
+    def view(self) -> np.ndarray:
+        return self._data[: self.n]
+
+
+class RankingEngine(ABC):
+    """
+    Shared bookkeeping: patient interning, the answer log and the outputs.
+    Subclasses keep their per-patient state in `_Growable` columns listed in
+    `_state()` and implement `_update(w, l, weight)` and `_refit()`.
+    """
+
+    def __init__(self):
+        self._slot: dict[int, int] = {}
+        self._ids = _Growable(np.int64)
+        self._games = _Growable(np.int32)
+        self._log_w = _Growable(np.int32)
+        self._log_l = _Growable(np.int32)
+        self._log_c = _Growable(np.int8)
+
+    # -- patients & log -------------------------------------------------------
+    def _state(self) -> list[_Growable]:
+        return []
+
+    def _index(self, patient_num: int) -> int:
+        i = self._slot.get(patient_num)
+        if i is None:
+            i = self._slot[patient_num] = self._ids.n
+            self._ids.append(patient_num)
+            self._games.grow_to(i + 1)
+            for col in self._state():
+                col.grow_to(i + 1)
+        return i
+
+    def _index_many(self, patient_nums: np.ndarray) -> np.ndarray:
+        """Vectorized _index: interns the unseen ids in bulk, returns the slots."""
+        uniq = pd.unique(patient_nums)
+        new = uniq[pd.Index(self._ids.view()).get_indexer(uniq) < 0]
+        if len(new):
+            start, end = self._ids.n, self._ids.n + len(new)
+            self._ids.grow_to(end)
+            self._ids.raw[start:end] = new
+            self._slot.update(zip(new.tolist(), range(start, end)))
+            for col in [self._games, *self._state()]:
+                col.grow_to(end)
+        return pd.Index(self._ids.view()).get_indexer(patient_nums).astype(np.int32)
+
+    @staticmethod
+    def weight(confidence) -> float:
+        return confidence / 5.0
+
+    def add(self, winner: int, loser: int, confidence: int = 5) -> None:
+        """Fold one answer in: O(1) amortized."""
+        w, l = self._index(int(winner)), self._index(int(loser))
+        self._log_w.append(w), self._log_l.append(l), self._log_c.append(confidence)
+        games = self._games.raw
+        games[w] += 1
+        games[l] += 1
+        self._update(w, l, self.weight(confidence))
+
+    def extend(self, comparisons: Comparisons) -> None:
+        """Add a batch in order (incremental updates, no refit)."""
+        for w, l, c in zip(comparisons.winner.tolist(), comparisons.loser.tolist(), comparisons.confidence.tolist()):
+            self.add(w, l, c)
+
+    def refit(self, comparisons: Comparisons | None = None) -> "RankingEngine":
+        """
+        Recompute every score from the whole log; with `comparisons` they are
+        appended to the log first (bulk load without per-answer updates).
+        """
+        if comparisons is not None and len(comparisons):
+            m = len(comparisons)
+            slots = self._index_many(np.concatenate([comparisons.winner, comparisons.loser]))
+            w, l = slots[:m], slots[m:]
+            k = self._log_w.n
+            for col, values in ((self._log_w, w), (self._log_l, l), (self._log_c, comparisons.confidence)):
+                col.grow_to(k + len(values))
+                col.raw[k: k + len(values)] = values
+            n = self._ids.n
+            self._games.raw[:n] += (np.bincount(w, minlength=n) + np.bincount(l, minlength=n)).astype(np.int32)
+        self._refit()
+        return self
+
+    @abstractmethod
+    def _update(self, w: int, l: int, weight: float) -> None:
+        ...
+
+    @abstractmethod
+    def _refit(self) -> None:
+        ...
+
+    # -- outputs ---------------------------------------------------------------
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids.view()
+
+    def __len__(self) -> int:
+        return self._ids.n
+
+    @property
+    def n_comparisons(self) -> int:
+        return self._log_w.n
+
+    @abstractmethod
+    def scores(self) -> np.ndarray:
+        ...
+
+    @abstractmethod
+    def uncertainty(self) -> np.ndarray:
+        """Standard deviation of each score, in the score's units."""
+
+    def priority_order(self, top: int | None = None) -> np.ndarray:
+        """patient_num, most prioritized first (ties by first appearance)."""
+        s = self.scores()
+        if top is not None and top < len(s):
+            part = np.argpartition(-s, top)[:top]
+            order = part[np.lexsort((part, -s[part]))]
+        else:
+            order = np.lexsort((np.arange(len(s)), -s))
+        return self.ids[order]
+
+    def table(self) -> pd.DataFrame:
+        """One row per patient in priority order: patient_num, rank, score, uncertainty, comparisons."""
+        s = self.scores()
+        order = np.lexsort((np.arange(len(s)), -s))
+        return pd.DataFrame({
+            "patient_num": self.ids[order],
+            "rank": np.arange(1, len(s) + 1),
+            "score": s[order],
+            "uncertainty": self.uncertainty()[order],
+            "comparisons": self._games.view()[order],
+        })
+
+
+class EloRanking(RankingEngine):
+    def __init__(self, k: float = 32.0, base: float = 1500.0, scale: float = 400.0):
+        self.k, self.base, self.scale = k, base, scale
+        self._rating = _Growable(np.float64, fill=base)
+        self._info = _Growable(np.float64)  # Fisher information of each rating, for uncertainty()
+        super().__init__()
+
+    def _state(self):
+        return [self._rating, self._info]
+
+    def _update(self, w, l, weight):
+        r, info = self._rating.raw, self._info.raw
+        expected = 1.0 / (1.0 + 10.0 ** ((r[l] - r[w]) / self.scale))
+        delta = self.k * weight * (1.0 - expected)
+        r[w] += delta
+        r[l] -= delta
+        fisher = weight * expected * (1.0 - expected)
+        info[w] += fisher
+        info[l] += fisher
+
+    def _refit(self):
+        n = self._ids.n
+        self._rating.raw[:n] = self.base
+        self._info.raw[:n] = 0.0
+        update, weight = self._update, self.weight
+        for w, l, c in zip(self._log_w.view().tolist(), self._log_l.view().tolist(), self._log_c.view().tolist()):
+            update(w, l, weight(c))
+
+    def scores(self):
+        return self._rating.view().copy()
+
+    def uncertainty(self):
+        # 1/sqrt(information) in logits, converted to rating points; a unit prior keeps it finite
+        return (self.scale / math.log(10)) / np.sqrt(1.0 + self._info.view())
+
+
+def _sigmoid(x):
+    return 0.5 * (1.0 + np.tanh(0.5 * x))
+
+
+class BradleyTerryRanking(RankingEngine):
+    def __init__(self, prior_var: float = 1.0, method: str = "newton", tol: float = 1e-6, max_iter: int = 500):
+        if method not in ("newton", "mm"):
+            raise ValueError(f"method must be 'newton' or 'mm', not {method!r}")
+        self.prior_var, self.method, self.tol, self.max_iter = prior_var, method, tol, max_iter
+        self._theta = _Growable(np.float64)
+        self._hess = _Growable(np.float64, fill=1.0 / prior_var)
+        self.iterations = 0
+        super().__init__()
+
+    def _state(self):
+        return [self._theta, self._hess]
+
+    def _update(self, w, l, weight):
+        theta, hess = self._theta.raw, self._hess.raw
+        p = 1.0 / (1.0 + math.exp(theta[l] - theta[w]))
+        g = weight * (1.0 - p)
+        c = weight * p * (1.0 - p)
+        hess[w] += c
+        hess[l] += c
+        theta[w] += g / hess[w]
+        theta[l] -= g / hess[l]
+
+    def _refit(self):
+        n = self._ids.n
+        win, lose = self._log_w.view(), self._log_l.view()
+        wt = self._log_c.view() / 5.0
+        theta = self._theta.raw[:n].copy()
+        if self.method == "mm":
+            theta = self._mm(theta, win, lose, wt, n)
+        else:
+            theta = self._newton(theta, win, lose, wt, n)
+        self._theta.raw[:n] = theta
+        p = _sigmoid(theta[win] - theta[lose])
+        c = wt * p * (1.0 - p)
+        self._hess.raw[:n] = np.bincount(win, c, n) + np.bincount(lose, c, n) + 1.0 / self.prior_var
+
+    def _newton(self, theta, win, lose, wt, n):
+        for it in range(1, self.max_iter + 1):
+            p = _sigmoid(theta[win] - theta[lose])
+            g = wt * (1.0 - p)
+            c = wt * p * (1.0 - p)
+            grad = np.bincount(win, g, n) - np.bincount(lose, g, n) - theta / self.prior_var
+            hess = np.bincount(win, c, n) + np.bincount(lose, c, n) + 1.0 / self.prior_var
+            step = grad / hess
+            theta = theta + step
+            if np.abs(step).max(initial=0.0) < self.tol:
+                break
+        self.iterations = it
+        return theta
+
+    def _mm(self, theta, win, lose, wt, n):
+        """
+        Hunter's MM on π = exp(θ). The prior enters as one virtual win and one
+        virtual loss (weight 1/prior_var each) against a reference player with
+        π = 1, which keeps never-beaten / never-winning patients finite.
+        """
+        a = 1.0 / self.prior_var
+        wins = np.bincount(win, wt, n) + a
+        pi = np.exp(theta)
+        for it in range(1, self.max_iter + 1):
+            inv = wt / (pi[win] + pi[lose])
+            denom = np.bincount(win, inv, n) + np.bincount(lose, inv, n) + 2.0 * a / (pi + 1.0)
+            new = wins / denom
+            step = np.abs(np.log(new) - np.log(pi)).max(initial=0.0)
+            pi = new
+            if step < self.tol:
+                break
+        self.iterations = it
+        return np.log(pi)
+
+    def scores(self):
+        return self._theta.view().copy()
+
+    def uncertainty(self):
+        return 1.0 / np.sqrt(self._hess.view())
+
+
+class TrueSkillRanking(RankingEngine):
+    def __init__(self, mu: float = 25.0, sigma: float = 25.0 / 3, beta: float = 25.0 / 6, tau: float = 0.0):
+        self.mu0, self.sigma0, self.beta, self.tau = mu, sigma, beta, tau
+        self._mu = _Growable(np.float64, fill=mu)
+        self._var = _Growable(np.float64, fill=sigma * sigma)
+        super().__init__()
+
+    def _state(self):
+        return [self._mu, self._var]
+
+    def _update(self, w, l, weight):
+        mu, var = self._mu.raw, self._var.raw
+        tau2 = self.tau * self.tau
+        vw, vl = var[w] + tau2, var[l] + tau2
+        c2 = 2.0 * self.beta * self.beta + vw + vl
+        c = math.sqrt(c2)
+        t = (mu[w] - mu[l]) / c
+        # v = φ(t)/Φ(t), the TrueSkill "win" correction
+        cdf = 0.5 * math.erfc(-t / math.sqrt(2.0))
+        pdf = math.exp(-0.5 * t * t) / math.sqrt(2.0 * math.pi)
+        v = pdf / cdf if cdf > 1e-300 else -t
+        shrink = v * (v + t)
+        mu[w] += weight * vw / c * v
+        mu[l] -= weight * vl / c * v
+        var[w] = vw * (1.0 - weight * vw / c2 * shrink)
+        var[l] = vl * (1.0 - weight * vl / c2 * shrink)
+
+    def _refit(self):
+        n = self._ids.n
+        self._mu.raw[:n] = self.mu0
+        self._var.raw[:n] = self.sigma0 * self.sigma0
+        update, weight = self._update, self.weight
+        for w, l, c in zip(self._log_w.view().tolist(), self._log_l.view().tolist(), self._log_c.view().tolist()):
+            update(w, l, weight(c))
+
+    def scores(self):
+        return self._mu.view().copy()
+
+    def uncertainty(self):
+        return np.sqrt(self._var.view())
+
+
+MODELS = {"elo": EloRanking, "bt": BradleyTerryRanking, "trueskill": TrueSkillRanking}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Rank patients from results downloads and/or progress snapshots.")
+    ap.add_argument("files", nargs="+", help="results / snapshot JSON files")
+    ap.add_argument("--model", choices=sorted(MODELS), default="bt")
+    ap.add_argument("--top", type=int, default=20, help="rows to print (0 = all)")
+    ap.add_argument("--csv", help="write the full table here")
+    args = ap.parse_args(argv)
+
+    comparisons = Comparisons.concat(read_results(f) for f in args.files)
+    engine = MODELS[args.model]().refit(comparisons)
+    table = engine.table()
+    print(f"{len(comparisons):,} comparisons, {len(engine):,} patients, model={args.model}")
+    print(table if not args.top else table.head(args.top))
+    if args.csv:
+        table.to_csv(args.csv, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+C-Pi recommendation catalog and the recommendation block of the patient cards.
+
+The styled `<li>` markup for every recommendation is compiled once, when the
+catalog is built (at import for the default one), into immutable lookups.
+Rendering a card then only concatenates precomputed fragments, so its cost does
+not depend on how long the catalog sentences are.
+
+A patient's recommendations are also packed into one integer bitmask (bit i is
+the i-th key of the catalog, i.e. rec{i+1}), so pair alignment plans come from
+AND/XOR against per-category masks instead of string membership tests.
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping
+
+import numpy as np
+
+_RAW_REC_MAP = {
+    "rec1":  {"DL": "Labs - for screening: lipid panel (cost 2)", "category": "Labs", "main": "lipid panel", "cost": "(cost 2)"},
+    "rec2":  {"DL": "Labs - for treatment monitoring: liver enzymes (cost 1)", "category": "Labs", "main": "liver enzymes", "cost": "(cost 1)"},
+    "rec3":  {"DL": "Labs - for risk stratification / screening:  Lp(a) (cost 6)", "category": "Labs", "main": "Lp(a)", "cost": "(cost 6)"},
+    "rec4":  {"DL": "Labs - for treatment monitoring: LDL (cost 2)",  "category": "Labs", "main": "LDL", "cost": "(cost 2)"},
+    "rec5":  {"DL": "Imaging - for risk stratification: carotid doppler (cost 20)",  "category": "Imaging", "main": "carotid doppler", "cost": "(cost 20)"},
+    "rec6":  {"DL": "Treatment - initiate first-line: low dose statin (yearly cost 200)", "category": "Treatment", "main": "low dose statin", "cost": "(yearly cost 200)"},
+    "rec7":  {"DL": "Treatment - initiate advanced treatment: high dose statin (yearly cost 200)", "category": "Treatment", "main": "high dose statin", "cost": "(yearly cost 200)"},
+    "rec8":  {"DL": "Treatment - prescribe advanced treatment: PCSK9 (yearly cost 20,000)", "category": "Treatment", "main": "PCSK9", "cost": "(yearly cost 20,000)"},
+    "rec9":  {"DL": "Treatment - upgrade: high dose statin (yearly cost 200)", "category": "Treatment", "main": "high dose statin", "cost": "(yearly cost 200)"},
+    "rec10": {"DL": "Treatment - replacement d/t contraindication: switch to PCSK9 (yearly cost 20,000)",  "category": "Treatment", "main": "PCSK9", "cost": "(yearly cost 20,000)"},
+    "rec11": {"DL": "Consults - hepatology consult: d/t high liver enzymes after statin initiation (cost 5)", "category": "Consults", "main": "hepatology", "cost": "(cost 5)"},
+    "rec12": {"DL": "Lifestyle - dietitian: package of nutritional consultation sessions (cost 20)",  "category": "Lifestyle", "main": "nutritional consultation", "cost": "(cost 20)"},
+    "rec13": {"DL": "Treatment - discuss pros/cons of statins vs. lifestyle changes in gray-zone patients (cost 2)",  "category": "Treatment", "main": "discuss pros/cons", "cost": "(cost 2)"},
+    "rec14": {"DL": "Lifestyle - consult about exercise, nutrition, and smoking (cost 2)",  "category": "Lifestyle", "main": "exercise, nutrition, and smoking", "cost": "(cost 2)"},
+    "rec15": {"DL": 'Lifestyle - reccomend the AHA "Heart & Stroke Helper" app to track lipids, meds and lifestyle (cost 0)',  "category": "Lifestyle", "main": '"Heart & Stroke Helper" app', "cost": "(cost 0)"}
+}
+
+_CATEGORY_ORDER = ["Labs", "Imaging", "Treatment", "Consults", "Lifestyle", "Other"]
+
+NO_RECS = "no active recommendations"
+_NO_RECS_LI = f"<li>{NO_RECS}</li>"
+
+
+def _style_dl(dl: str, cat: str, main: str, cost: str) -> str:
+    """
+    Full DL sentence with:
+      - category in <span class="rec-cat">…</span>  (underlined via CSS)
+      - main     in <span class="rec-main">…</span> (bold via CSS)
+      - cost     in <span class="rec-cost">…</span> (italic via CSS)
+    Only used while compiling a catalog, never per render.
+    """
+    s = dl
+    s = re.sub(r'^' + re.escape(cat) + r'(?=\s*-\s*)',
+               f'<span class="rec-cat">{cat}</span>', s, count=1)
+    if main:
+        s = re.sub(re.escape(main), f'<span class="rec-main">{main}</span>', s, count=1)
+    if cost:
+        s = re.sub(re.escape(cost), f'<span class="rec-cost">{cost}</span>', s, count=1)
+    return s
+
+
+@dataclass(frozen=True)
+class RecCatalog:
+    """Precompiled, read-only view of a rec map (key -> DL/category/main/cost)."""
+    keys: tuple[str, ...]                      # rec1..recN, map order
+    dls: tuple[str, ...]                       # DL sentence per key, map order
+    category_of: Mapping[str, str]             # DL -> category
+    dls_by_category: Mapping[str, tuple[str, ...]]  # category -> DLs in map order
+    li_first: Mapping[str, str]                # DL -> '<li class="cat-start">…</li>'
+    li_next: Mapping[str, str]                 # DL -> '<li class="">…</li>'
+    bit_of: Mapping[str, int]                  # DL -> 1 << position in map order
+    category_masks: Mapping[str, int]          # category -> OR of its DLs' bits
+
+
+def compile_rec_catalog(raw_map: dict[str, dict]) -> RecCatalog:
+    if len(raw_map) > 32:
+        raise ValueError(f"rec catalog has {len(raw_map)} entries; rec masks are uint32 (max 32).")
+    keys, dls = [], []
+    category_of, by_cat, li_first, li_next = {}, {}, {}, {}
+    bit_of, cat_masks = {}, {}
+    for pos, (key, meta) in enumerate(raw_map.items()):
+        dl = meta["DL"]
+        cat = meta.get("category", "Other")
+        styled = _style_dl(dl, cat, meta.get("main", ""), meta.get("cost", ""))
+        keys.append(key)
+        dls.append(dl)
+        category_of[dl] = cat
+        by_cat.setdefault(cat, []).append(dl)
+        li_first[dl] = f'<li class="cat-start">{styled}</li>'
+        li_next[dl] = f'<li class="">{styled}</li>'
+        bit_of[dl] = 1 << pos
+        cat_masks[cat] = cat_masks.get(cat, 0) | (1 << pos)
+    return RecCatalog(
+        keys=tuple(keys),
+        dls=tuple(dls),
+        category_of=MappingProxyType(category_of),
+        dls_by_category=MappingProxyType({c: tuple(v) for c, v in by_cat.items()}),
+        li_first=MappingProxyType(li_first),
+        li_next=MappingProxyType(li_next),
+        bit_of=MappingProxyType(bit_of),
+        category_masks=MappingProxyType(cat_masks),
+    )
+
+
+REC_CATALOG = compile_rec_catalog(_RAW_REC_MAP)
+
+
+def recs_grouped_html_for_patient(
+    p: dict,
+    category_order: list[str] | None = None,
+    per_category_master: dict[str, list[str]] | None = None,
+    catalog: RecCatalog = REC_CATALOG,
+) -> str:
+    """
+    Render FULL DL sentences with styled parts, aligned by a shared plan:
+    - category_order: order of categories (common first)
+    - per_category_master: for each category, the ordered list of DLs (common first,
+      then the side-unique ones). Rows the patient doesn't have are skipped, but
+      still count for which row opens the category.
+    """
+    chosen = set(p.get("recommendations") or [])
+    order = category_order or _CATEGORY_ORDER
+
+    parts = []
+    # if we have a master plan: iterate exact rows; else fall back to simple grouping
+    if per_category_master:
+        li_first, li_next = catalog.li_first, catalog.li_next
+        for cat in order:
+            first_in_cat = True
+            for dl in per_category_master.get(cat, ()):
+                if dl in chosen:
+                    parts.append(li_first[dl] if first_in_cat else li_next[dl])
+                first_in_cat = False
+        return "".join(parts)
+
+    # (fallback — not used when we pass a plan)
+    # flat, grouped by global order
+    li_first = catalog.li_first
+    for cat in order:
+        for dl in catalog.dls_by_category.get(cat, ()):
+            if dl in chosen:
+                parts.append(li_first[dl])
+    return "".join(parts) or _NO_RECS_LI
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Rec bitmasks
+
+def rec_mask_from_row(row_dict: dict) -> int:
+    """Pack the rec1..recN flags of a raw patient row into one int."""
+    mask = 0
+    for pos, key in enumerate(REC_CATALOG.keys):
+        val = row_dict.get(key, 0)
+        try:
+            val = int(val)
+        except Exception:
+            pass
+        if val:
+            mask |= 1 << pos
+    return mask
+
+
+def rec_masks(df) -> np.ndarray:
+    """Vectorized rec_mask_from_row over a whole patient DataFrame (uint32, one per row)."""
+    out = np.zeros(len(df), dtype=np.uint32)
+    for pos, key in enumerate(REC_CATALOG.keys):
+        if key in df.columns:
+            out |= (df[key].to_numpy() != 0).astype(np.uint32) << np.uint32(pos)
+    return out
+
+
+def _mask_of(p: dict) -> int:
+    mask = p.get("rec_mask")
+    if mask is not None:
+        return int(mask)
+    # older dicts (e.g. built before rec_mask existed): derive from the DL list
+    bit_of = REC_CATALOG.bit_of
+    return sum(bit_of.get(dl, 0) for dl in set(p.get("recommendations") or []))
+
+
+@lru_cache(maxsize=1 << 15)
+def dls_for_mask(mask: int) -> tuple[str, ...]:
+    """DL sentences for the set bits of `mask`, in map order."""
+    dls = REC_CATALOG.dls
+    return tuple(dls[i] for i in range(len(dls)) if mask >> i & 1)
+
+
+def recs_by_category_for_patient(p: dict) -> dict[str, list[str]]:
+    mask = _mask_of(p)
+    out: dict[str, list[str]] = {}
+    for cat, cat_mask in REC_CATALOG.category_masks.items():
+        if mask & cat_mask:
+            out[cat] = list(dls_for_mask(mask & cat_mask))
+    return out
+
+
+@lru_cache(maxsize=1 << 16)
+def plan_from_masks(x_mask: int, y_mask: int):
+    """
+    Alignment plan for an (X, Y) pair of rec masks. Per category:
+    common = X & Y, X-only = X & (X ^ Y), Y-only = Y & (X ^ Y).
+    Cached, so repeated mask pairs cost one dict lookup. The returned
+    structures are shared between callers and must not be mutated.
+    """
+    common, rest = [], []
+    per_cat: dict[str, tuple[str, ...]] = {}
+    diff = x_mask ^ y_mask
+    cat_masks = REC_CATALOG.category_masks
+    for cat in _CATEGORY_ORDER:
+        cm = cat_masks.get(cat, 0)
+        xs, ys = x_mask & cm, y_mask & cm
+        if not (xs or ys):
+            continue
+        (common if xs and ys else rest).append(cat)
+        per_cat[cat] = dls_for_mask(xs & ys) + dls_for_mask(xs & diff) + dls_for_mask(ys & diff)
+    return tuple(common + rest), MappingProxyType(per_cat)
+
+
+def build_pair_recs_alignment_plan(pX: dict, pY: dict):
+    return plan_from_masks(_mask_of(pX), _mask_of(pY))
+
+
+def build_pair_plan_index(x_masks: np.ndarray, y_masks: np.ndarray) -> tuple[np.ndarray, list]:
+    """
+    Plans for a whole list of (X, Y) pairs in one pass: mask pairs are packed
+    into uint64 keys and deduplicated with np.unique, so only distinct
+    combinations are planned. Returns (per-pair code, plans), plans[code[i]]
+    being the plan of pair i.
+    """
+    keys = (np.asarray(x_masks, dtype=np.uint64) << np.uint64(32)) | np.asarray(y_masks, dtype=np.uint64)
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    plans = [plan_from_masks(int(k) >> 32, int(k) & 0xFFFFFFFF) for k in uniq.tolist()]
+    return inverse.astype(np.int32), plans
+
+
+def build_pair_plans(x_masks: np.ndarray, y_masks: np.ndarray) -> list:
+    """build_pair_plan_index, expanded to one plan per pair."""
+    codes, plans = build_pair_plan_index(x_masks, y_masks)
+    return [plans[i] for i in codes.tolist()]
+
+
+def recs_from_row(row_dict: dict) -> list[str]:
+    return list(dls_for_mask(rec_mask_from_row(row_dict))) or [NO_RECS]
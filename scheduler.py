@@ -0,0 +1,146 @@
+"""
+Adaptive ordering of the session's pairs (PAIR_ORDER = "adaptive").
+
+Instead of walking the uploaded file top to bottom, the next pair is the
+unanswered one whose outcome is most informative given the answers so far.
+Patients get a Bradley–Terry skill θ (P(i preferred over j) = σ(θi − θj)),
+fitted by a few warm-started diagonal Newton steps on the confidence-weighted
+answers with a N(0, prior_var) prior; the curvature at the optimum gives each
+patient's variance (diagonal Laplace approximation).
+
+A candidate (i, j) is scored by the expected information gain about the skills
+from its answer, the BALD closed form for a probit link (σ(x) ≈ Φ(x·√(π/8))):
+
+    IG = h(Φ(μ / √(1 + s²))) − C / √(s² + C²) · exp(−μ² / (2 (s² + C²)))
+
+with μ, s² the (probit-scaled) mean and variance of θi − θj, h the binary
+entropy in bits and C² = π ln2 / 2. Pairs that are already predictable (large
+|μ| relative to s) or between well-known patients score low. Everything is
+vectorized over the candidate pool, so a pick costs a few numpy passes.
+"""
+import math
+
+import numpy as np
+
+from pairs_io import pair_columns
+
+_PROBIT = math.sqrt(math.pi / 8)      # σ(x) ≈ Φ(_PROBIT · x)
+_C2 = math.pi * math.log(2) / 2
+
+
+def confidence_weight(conf) -> np.ndarray:
+    """Answer weight for confidence 1..5: a "5 - completely sure" counts fully, a "1" a fifth."""
+    return np.asarray(conf, dtype=np.float64) / 5.0
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 0.5 * (1.0 + np.tanh(0.5 * x))
+
+
+def _entropy_bits(p: np.ndarray) -> np.ndarray:
+    p = np.clip(p, 1e-12, 1 - 1e-12)
+    return -(p * np.log2(p) + (1 - p) * np.log2(1 - p))
+
+
+def expected_information_gain(mu: np.ndarray, var: np.ndarray) -> np.ndarray:
+    """BALD score of comparisons whose logit difference is ~ N(mu, var)."""
+    m = _PROBIT * mu
+    s2 = _PROBIT * _PROBIT * var
+    p_bar = _sigmoid(m / (_PROBIT * np.sqrt(1.0 + s2)))
+    return _entropy_bits(p_bar) - np.sqrt(_C2 / (s2 + _C2)) * np.exp(-m * m / (2.0 * (s2 + _C2)))
+
+
+class ActivePairScheduler:
+    """
+    Picks the next pair of a fixed list (the session's prepared pairs) by
+    expected information gain. `record(i, winner, conf)` adds an answer,
+    `next_index()` returns the pair to show next (None when all are answered).
+
+    With more than `pool_size` unanswered pairs, each pick scores a fresh
+    random sample of that size (seeded, so a session replays identically).
+    """
+
+    def __init__(self, pairs, prior_var: float = 1.0, newton_steps: int = 3,
+                 pool_size: int = 20_000, seed: int = 0):
+        cols = pair_columns(pairs)
+        self.ids, inverse = np.unique(np.concatenate([cols.a, cols.b]), return_inverse=True)
+        n = len(cols)
+        self._ai, self._bi = inverse[:n], inverse[n:]
+        self._a = np.asarray(cols.a)
+        self.answered = np.zeros(n, dtype=bool)
+        self.skipped = np.zeros(n, dtype=bool)  # taken out of the pool without an answer (see skip)
+        self.n_answered = 0
+
+        # answers, in order: winner / loser as dense patient indices, and weight
+        self._win = np.empty(n, dtype=np.intp)
+        self._lose = np.empty(n, dtype=np.intp)
+        self._w = np.empty(n, dtype=np.float64)
+
+        if newton_steps < 1:
+            raise ValueError("newton_steps must be >= 1")
+        self.prior_var = prior_var
+        self.newton_steps = newton_steps
+        self.pool_size = pool_size
+        self._rng = np.random.default_rng(seed)
+        self.theta = np.zeros(len(self.ids))
+        self.var = np.full(len(self.ids), prior_var)
+        self._stale = False
+
+    @classmethod
+    def from_results(cls, pairs, results, **kwargs) -> "ActivePairScheduler":
+        """Scheduler with the session's `results` (list aligned with pairs, None = unanswered) already recorded."""
+        sched = cls(pairs, **kwargs)
+        for i, r in enumerate(results):
+            if r is not None:
+                (winner, _loser), conf = r
+                sched.record(i, winner, conf)
+        return sched
+
+    def record(self, i: int, winner: int, conf: int) -> None:
+        """Pair i was answered: `winner` (a patient_num of that pair) was preferred, with confidence conf."""
+        if self.answered[i] and not self.skipped[i]:
+            return
+        self.skipped[i] = False
+        a_won = int(winner) == int(self._a[i])
+        k = self.n_answered
+        self._win[k], self._lose[k] = (self._ai[i], self._bi[i]) if a_won else (self._bi[i], self._ai[i])
+        self._w[k] = confidence_weight(conf)
+        self.answered[i] = True
+        self.n_answered = k + 1
+        self._stale = True
+
+    def skip(self, i: int) -> None:
+        """Take pair i out of the pool without an answer; a later record(i, ...) still counts."""
+        if not self.answered[i]:
+            self.answered[i] = True
+            self.skipped[i] = True
+
+    def _refit(self) -> None:
+        """Warm-started diagonal Newton steps for the MAP skills, then Laplace variances."""
+        k = self.n_answered
+        win, lose, w = self._win[:k], self._lose[:k], self._w[:k]
+        n = len(self.ids)
+        theta = self.theta
+        for _ in range(self.newton_steps):
+            p = _sigmoid(theta[win] - theta[lose])           # P(observed winner wins)
+            g = w * (1.0 - p)
+            c = w * p * (1.0 - p)
+            grad = np.bincount(win, g, n) - np.bincount(lose, g, n) - theta / self.prior_var
+            hess = np.bincount(win, c, n) + np.bincount(lose, c, n) + 1.0 / self.prior_var
+            theta = theta + grad / hess
+        self.theta = theta
+        self.var = 1.0 / hess
+        self._stale = False
+
+    def next_index(self) -> int | None:
+        if self._stale:
+            self._refit()
+        pool = np.flatnonzero(~self.answered)
+        if not len(pool):
+            return None
+        if len(pool) > self.pool_size:
+            pool = self._rng.choice(pool, self.pool_size, replace=False)
+            pool.sort()  # ties keep file order
+        ai, bi = self._ai[pool], self._bi[pool]
+        score = expected_information_gain(self.theta[ai] - self.theta[bi], self.var[ai] + self.var[bi])
+        return int(pool[np.argmax(score)])
@@ -0,0 +1,242 @@
+"""
+Where rater progress is stored.
+
+`ProgressStore` is the small interface the app talks to: the latest snapshot
+per (user_name, pair_file) plus the append-only answer log used by the delta
+autosave mode. Two implementations share the same semantics:
+
+- `SupabaseStore`: the `progress_snapshots` / `progress_deltas` tables through
+  a supabase-py client (the hosted deployment).
+- `SQLiteStore`: the same two tables in a local SQLite file in WAL mode, for
+  on-prem installs and for running, benchmarking and load-testing the app
+  without a live project.
+
+Snapshots are upserted on (user_name, pair_file) and read back latest by
+updated_at; deltas are keyed by (user_name, pair_file, seq).
+"""
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds").replace("+00:00", "Z")
+
+
+class ProgressStore(ABC):
+    """Interface of a progress backend. Methods may raise; the autosave writer retries."""
+
+    @abstractmethod
+    def load_snapshot(self, user_name: str, pair_file: str) -> dict | None:
+        ...
+
+    @abstractmethod
+    def save_snapshot(self, user_name: str, pair_file: str, snapshot: dict) -> None:
+        ...
+
+    def save_snapshots(self, rows: list[tuple[str, str, dict]]) -> None:
+        """Upsert several (user_name, pair_file, snapshot) at once; backends override with one round trip."""
+        for user_name, pair_file, snapshot in rows:
+            self.save_snapshot(user_name, pair_file, snapshot)
+
+    @abstractmethod
+    def append_deltas(self, rows: list[dict]) -> None:
+        ...
+
+    @abstractmethod
+    def load_deltas(self, user_name: str, pair_file: str, after_seq: int = 0) -> list[dict]:
+        ...
+
+    @abstractmethod
+    def delete_deltas(self, user_name: str, pair_file: str, upto_seq: int) -> None:
+        ...
+
+
+class SupabaseStore(ProgressStore):
+    """
+    Tables (Postgres):
+      create table progress_snapshots (
+        user_name text not null, pair_file text not null, snapshot jsonb not null,
+        updated_at timestamptz not null default now(),
+        primary key (user_name, pair_file));
+      create table progress_deltas (
+        user_name text not null, pair_file text not null, seq bigint not null,
+        idx int not null, a bigint not null, b bigint not null, confidence smallint not null,
+        created_at timestamptz not null default now(),
+        primary key (user_name, pair_file, seq));
+    A delta's (a, b) is the stored pair (winner first), exactly like an entry of `results`.
+    """
+
+    # rows per progress_deltas request; PostgREST caps a response at the project's max-rows
+    # (1000 by default) without saying so, so the log is read page by page until one comes back empty
+    DELTA_PAGE_ROWS = 1000
+
+    def __init__(self, client):
+        self.client = client
+
+    def load_snapshot(self, user_name, pair_file):
+        res = (
+            self.client.table("progress_snapshots")
+            .select("snapshot")
+            .eq("user_name", user_name)
+            .eq("pair_file", pair_file)
+            .order("updated_at", desc=True)
+            .limit(1)
+            .execute()
+        )
+        rows = getattr(res, "data", None) or []
+        return rows[0].get("snapshot") if rows else None
+
+    def save_snapshot(self, user_name, pair_file, snapshot):
+        self.save_snapshots([(user_name, pair_file, snapshot)])
+
+    def save_snapshots(self, rows):
+        updated_at = _utc_now()
+        self.client.table("progress_snapshots").upsert(
+            [
+                {
+                    "user_name": user_name,
+                    "pair_file": pair_file,
+                    "snapshot": snapshot,  # jsonb
+                    "updated_at": updated_at,
+                }
+                for user_name, pair_file, snapshot in rows
+            ],
+            on_conflict="user_name,pair_file",
+        ).execute()
+
+    def append_deltas(self, rows):
+        # one round trip for the batch; upsert so a retried batch is idempotent
+        self.client.table("progress_deltas").upsert(rows, on_conflict="user_name,pair_file,seq").execute()
+
+    def load_deltas(self, user_name, pair_file, after_seq=0):
+        out = []
+        while True:
+            res = (
+                self.client.table("progress_deltas")
+                .select("seq,idx,a,b,confidence")
+                .eq("user_name", user_name)
+                .eq("pair_file", pair_file)
+                .gt("seq", after_seq)
+                .order("seq")
+                .limit(self.DELTA_PAGE_ROWS)
+                .execute()
+            )
+            page = getattr(res, "data", None) or []
+            if not page:
+                return out
+            out.extend(page)
+            after_seq = page[-1]["seq"]  # keyset: the next page starts after the last seq seen
+
+    def delete_deltas(self, user_name, pair_file, upto_seq):
+        (
+            self.client.table("progress_deltas")
+            .delete()
+            .eq("user_name", user_name)
+            .eq("pair_file", pair_file)
+            .lte("seq", int(upto_seq))
+            .execute()
+        )
+
+
+_SQLITE_SCHEMA = """
+create table if not exists progress_snapshots (
+    user_name  text not null,
+    pair_file  text not null,
+    snapshot   text not null,  -- JSON
+    updated_at text not null,  -- ISO-8601 UTC, microseconds
+    primary key (user_name, pair_file)
+);
+create table if not exists progress_deltas (
+    user_name  text not null,
+    pair_file  text not null,
+    seq        integer not null,
+    idx        integer not null,
+    a          integer not null,
+    b          integer not null,
+    confidence integer not null,
+    created_at text not null,
+    primary key (user_name, pair_file, seq)
+);
+"""
+
+
+class SQLiteStore(ProgressStore):
+    """
+    Local file backend. WAL journaling lets the session threads read while one
+    of them writes; each thread gets its own connection (sqlite3 connections
+    are not shared across threads) and every write is its own transaction.
+    """
+
+    def __init__(self, path: str | Path, busy_timeout_ms: int = 5000):
+        self.path = str(path)
+        self._busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        conn.execute("pragma journal_mode=wal")
+        conn.executescript(_SQLITE_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # autocommit: single statements commit on their own, _write_many batches in one transaction
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute(f"pragma busy_timeout={int(self._busy_timeout_ms)}")
+            conn.execute("pragma synchronous=normal")  # durable at checkpoint, safe under WAL
+            self._local.conn = conn
+        return conn
+
+    def load_snapshot(self, user_name, pair_file):
+        row = self._conn().execute(
+            "select snapshot from progress_snapshots where user_name = ? and pair_file = ? "
+            "order by updated_at desc limit 1",
+            (user_name, pair_file),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write_many(self, sql: str, params: list) -> None:
+        conn = self._conn()
+        conn.execute("begin immediate")
+        try:
+            conn.executemany(sql, params)
+        except BaseException:
+            conn.execute("rollback")
+            raise
+        conn.execute("commit")
+
+    def save_snapshot(self, user_name, pair_file, snapshot):
+        self.save_snapshots([(user_name, pair_file, snapshot)])
+
+    def save_snapshots(self, rows):
+        updated_at = _utc_now()
+        self._write_many(
+            "insert into progress_snapshots (user_name, pair_file, snapshot, updated_at) values (?, ?, ?, ?) "
+            "on conflict (user_name, pair_file) do update set snapshot = excluded.snapshot, updated_at = excluded.updated_at",
+            [(u, f, json.dumps(snap, ensure_ascii=False), updated_at) for u, f, snap in rows],
+        )
+
+    def append_deltas(self, rows):
+        self._write_many(
+            "insert or replace into progress_deltas (user_name, pair_file, seq, idx, a, b, confidence, created_at) "
+            "values (:user_name, :pair_file, :seq, :idx, :a, :b, :confidence, :created_at)",
+            [{"created_at": _utc_now(), **r} for r in rows],
+        )
+
+    def load_deltas(self, user_name, pair_file, after_seq=0):
+        cur = self._conn().execute(
+            "select seq, idx, a, b, confidence from progress_deltas "
+            "where user_name = ? and pair_file = ? and seq > ? order by seq",
+            (user_name, pair_file, int(after_seq)),
+        )
+        cols = [d[0] for d in cur.description]
+        return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+    def delete_deltas(self, user_name, pair_file, upto_seq):
+        self._conn().execute(
+            "delete from progress_deltas where user_name = ? and pair_file = ? and seq <= ?",
+            (user_name, pair_file, int(upto_seq)),
+        )
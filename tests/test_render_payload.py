@@ -0,0 +1,15 @@
+"""Per-Submit render payload budget (see benchmarks/bench_render_payload.py)."""
+from benchmarks.bench_render_payload import APP_PATH, SUBMIT_BUDGET, measure
+
+
+def test_submit_stays_within_render_budget(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROGRESS_BACKEND", "sqlite")
+    monkeypatch.setenv("PROGRESS_SQLITE_PATH", str(tmp_path / "progress.sqlite3"))
+    monkeypatch.chdir(APP_PATH.parent)  # .streamlit/config.toml is read from the working directory
+
+    m = measure(answers=5, tmp=tmp_path)
+
+    assert len(m["per_submit"]) == 5, "the app did not reach five Submits"
+    assert max(m["per_submit"]) <= SUBMIT_BUDGET, m["per_submit"]
+    # the stylesheet goes out in full once, then only as a cache reference
+    assert sum(size > 200 for size in m["styles"]) == 1, m["styles"]
@@ -0,0 +1,124 @@
+"""
+Hot-path timing spans with rolling percentiles.
+
+    with span("store.save_snapshot", session_timings, process_timings):
+        ...
+
+records the wall time of the block (perf_counter, also when it exits through
+an exception such as Streamlit's rerun) into every given `SpanRecorder`. A
+recorder keeps, per span name, the last `window` durations (the rolling
+histogram that p50 / p95 / p99 are taken from) plus the all-time count and
+sum. Recording is a deque append under a lock, so spans are cheap enough for
+every rerun and safe from the autosave threads.
+
+`to_prometheus()` renders recorders as a Prometheus text-format summary and
+`to_jsonl()` as one JSON object per span, for the debug panel's downloads.
+"""
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+
+import numpy as np
+
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC = "ranking_app_span_seconds"
+
+
+@dataclass(frozen=True)
+class SpanStats:
+    name: str
+    count: int          # all time
+    total_s: float      # all time
+    p50_ms: float       # over the rolling window
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+
+
+class SpanRecorder:
+    """Rolling per-span duration windows (last `window` samples each), thread-safe."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: dict[str, deque] = {}
+        self._count: dict[str, int] = {}
+        self._sum: dict[str, float] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+                self._count[name], self._sum[name] = 0, 0.0
+            samples.append(seconds)
+            self._count[name] += 1
+            self._sum[name] += seconds
+
+    def stats(self) -> list[SpanStats]:
+        """One row per span name, sorted by name."""
+        with self._lock:
+            snap = {name: (np.fromiter(s, dtype=np.float64), self._count[name], self._sum[name])
+                    for name, s in self._samples.items()}
+        rows = []
+        for name in sorted(snap):
+            ms, count, total = snap[name]
+            ms = ms * 1e3
+            p50, p95, p99 = np.percentile(ms, [q * 100 for q in QUANTILES])
+            rows.append(SpanStats(name, count, total, float(p50), float(p95), float(p99), float(ms.max())))
+        return rows
+
+    def clear(self) -> None:
+        with self._lock:
+            self._samples.clear()
+            self._count.clear()
+            self._sum.clear()
+
+
+@contextmanager
+def span(name: str, *recorders: SpanRecorder):
+    """Time the block into every recorder."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        for rec in recorders:
+            rec.record(name, elapsed)
+
+
+def timed(name: str, fn, *recorders: SpanRecorder):
+    """fn wrapped in span(name, *recorders), for calls made on other threads."""
+    def wrapper(*args, **kwargs):
+        with span(name, *recorders):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def to_prometheus(scopes: dict[str, SpanRecorder]) -> str:
+    """Prometheus text exposition: one summary per span, labelled with its scope ("session", "process")."""
+    lines = [f"# HELP {METRIC} Wall time of instrumented spans (quantiles over the rolling window).",
+             f"# TYPE {METRIC} summary"]
+    for scope, rec in scopes.items():
+        for s in rec.stats():
+            labels = f'span="{_label(s.name)}",scope="{_label(scope)}"'
+            for q, ms in zip(QUANTILES, (s.p50_ms, s.p95_ms, s.p99_ms)):
+                lines.append(f'{METRIC}{{{labels},quantile="{q}"}} {ms / 1e3:.6g}')
+            lines.append(f"{METRIC}_sum{{{labels}}} {s.total_s:.6g}")
+            lines.append(f"{METRIC}_count{{{labels}}} {s.count}")
+    return "\n".join(lines) + "\n"
+
+
+def to_jsonl(scopes: dict[str, SpanRecorder]) -> str:
+    """One JSON object per (scope, span) with the SpanStats fields and the export time."""
+    now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    return "".join(json.dumps({"ts": now, "scope": scope, **asdict(s)}) + "\n"
+                   for scope, rec in scopes.items() for s in rec.stats())
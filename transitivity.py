@@ -0,0 +1,150 @@
+"""
+Transitivity-aware skipping (TRANSITIVE_SKIP = "infer" or "defer").
+
+A rater who answered A over B and B over C with high confidence has implicitly
+answered A over C. `PreferenceClosure` keeps the transitive closure of the
+rater's confident answers (confidence >= min_confidence) as two bitset
+matrices, one row per patient: reach[u] holds every patient u is preferred
+over, directly or through a chain, and rev[v] every patient preferred over v.
+Adding u > v ORs reach[v] ∪ {v} into the rows of u and of everything that
+reaches u (and symmetrically for rev), i.e. O((|ancestors| + |descendants|) ·
+n / 64) word operations; a reachability query is one bit test. Patients get a
+row on their first confident answer and the matrices double as needed, so the
+size follows what the rater answered, not the cohort.
+
+An answer that contradicts the closure (v already reaches u) is kept in the
+results as given but not added, so the closure stays a DAG.
+
+`TransitiveSkipper` applies it to the session's pairs: before a pair is shown,
+`settle(i)` checks whether the closure already decides it. In "infer" mode the
+pair is then recorded as inferred (winner, loser) and never asked; in "defer"
+mode it is put back and asked after every undecided pair.
+"""
+import numpy as np
+
+from pairs_io import pair_columns
+
+MODES = ("infer", "defer")
+
+
+class PreferenceClosure:
+    """Incremental transitive closure of "u preferred over v" answers, as bitsets."""
+
+    def __init__(self, min_confidence: int = 4, capacity: int = 64):
+        self.min_confidence = min_confidence
+        self._slot: dict[int, int] = {}
+        self._cap = 0
+        self.reach = np.zeros((0, 0), dtype=np.uint64)
+        self.rev = np.zeros((0, 0), dtype=np.uint64)
+        self._grow(capacity)
+
+    def __len__(self) -> int:
+        return len(self._slot)
+
+    def _grow(self, capacity: int) -> None:
+        words = -(-capacity // 64)
+        for name in ("reach", "rev"):
+            old = getattr(self, name)
+            new = np.zeros((words * 64, words), dtype=np.uint64)
+            new[: old.shape[0], : old.shape[1]] = old
+            setattr(self, name, new)
+        self._cap = words * 64
+
+    def _node(self, patient_num: int) -> int:
+        i = self._slot.get(patient_num)
+        if i is None:
+            i = self._slot[patient_num] = len(self._slot)
+            if i >= self._cap:
+                self._grow(2 * self._cap)
+        return i
+
+    @staticmethod
+    def _has(row: np.ndarray, j: int) -> bool:
+        return bool((int(row[j >> 6]) >> (j & 63)) & 1)
+
+    def _members(self, row: np.ndarray) -> np.ndarray:
+        bits = np.unpackbits(row.view(np.uint8), bitorder="little")
+        return np.flatnonzero(bits[: len(self._slot)])
+
+    def prefers(self, u: int, v: int) -> bool:
+        """Whether u > v follows from the confident answers (patient_num values)."""
+        i, j = self._slot.get(u), self._slot.get(v)
+        return i is not None and j is not None and self._has(self.reach[i], j)
+
+    def add(self, winner: int, loser: int, confidence: int) -> bool:
+        """Fold one answer in; False when it is not confident enough or contradicts the closure."""
+        if confidence < self.min_confidence or winner == loser:
+            return False
+        u, v = self._node(int(winner)), self._node(int(loser))
+        if self._has(self.reach[v], u):
+            return False  # v > ... > u already: keep the closure acyclic
+        if self._has(self.reach[u], v):
+            return True   # already implied
+        down = self.reach[v].copy()
+        down[v >> 6] |= np.uint64(1 << (v & 63))
+        up = self.rev[u].copy()
+        up[u >> 6] |= np.uint64(1 << (u & 63))
+        self.reach[self._members(up)] |= down
+        self.rev[self._members(down)] |= up
+        return True
+
+
+class TransitiveSkipper:
+    """
+    Decides, pair by pair, whether the session's answers already settle a pair
+    (see the module docstring). `inferred` maps pair index -> (winner, loser).
+    """
+
+    def __init__(self, pairs, mode: str = "infer", min_confidence: int = 4):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, not {mode!r}")
+        cols = pair_columns(pairs)
+        self._a, self._b = cols.a, cols.b
+        self.mode = mode
+        self.closure = PreferenceClosure(min_confidence)
+        self.inferred: dict[int, tuple[int, int]] = {}
+        self.deferred: list[int] = []
+        self.final_pass = False  # "defer": the undecided pairs are done, now asking the deferred ones
+
+    @classmethod
+    def from_results(cls, pairs, results, **kwargs) -> "TransitiveSkipper":
+        skipper = cls(pairs, **kwargs)
+        for r in results:
+            if r is not None:
+                (winner, loser), conf = r
+                skipper.record(winner, loser, conf)
+        return skipper
+
+    def record(self, winner: int, loser: int, conf: int) -> None:
+        self.closure.add(int(winner), int(loser), int(conf))
+
+    def implied(self, i: int) -> tuple[int, int] | None:
+        """(winner, loser) of pair i if the closure decides it, else None."""
+        a, b = int(self._a[i]), int(self._b[i])
+        if self.closure.prefers(a, b):
+            return a, b
+        if self.closure.prefers(b, a):
+            return b, a
+        return None
+
+    def settle(self, i: int) -> bool:
+        """True if pair i should be asked; otherwise it is recorded as inferred or deferred."""
+        if self.final_pass:
+            return True
+        decided = self.implied(i)
+        if decided is None:
+            return True
+        if self.mode == "infer":
+            self.inferred[i] = decided
+        elif i not in self.deferred:
+            self.deferred.append(i)
+        return False
+
+    def next_deferred(self, results) -> int | None:
+        """Start / continue the final pass: the next deferred pair still unanswered."""
+        self.final_pass = True
+        while self.deferred:
+            i = self.deferred.pop(0)
+            if results[i] is None:
+                return i
+        return None